@@ -0,0 +1,193 @@
+# Offline benchmark of the detectors : each detector checks the recorded sold out and available pages of its site, served by a local
+# fixture server with an injected latency, under several levels of concurrency. Throughput (pages/sec), latency percentiles, memory (RSS)
+# and wrong verdicts are reported, and appended to benchmarks/results.jsonl so that regressions show up between versions.
+#
+# Modes :
+#     http : the pages are fetched with plain HTTP requests and matched with is_soldout_from_html (no browser needed)
+#     check : the full SoldoutDetector.check, with the HTTP path when the detector allows it and the browser otherwise (needs Firefox)
+#
+# Usage :
+#     python -m benchmarks.bench_detectors [--mode http] [--concurrency 1 2 4 8] [--n-checks 200] [--latency 0.1] [--detectors etix seetickets]
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import json
+import os
+import subprocess
+import sys
+from time import perf_counter
+from typing import Dict, Optional
+try:
+    import psutil
+except ImportError:
+    psutil = None
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from benchmarks.fixture_server import FixtureServer, STATE_AVAILABLE, STATE_SOLDOUT
+from src.http_fetching import HttpFetcher
+from src.utils import get_percentile
+from src.web_scraping import SoldoutDetector, DriverPool, detector_registry
+
+
+RESULTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results.jsonl")
+
+MODE_HTTP = "http"
+MODE_CHECK = "check"
+
+# The detectors, by name of the site in the fixtures
+DETECTORS : Dict[str, SoldoutDetector] = {
+    "ticketweb" : detector_registry.get_detector_by_name("TicketWeb"),
+    "seetickets" : detector_registry.get_detector_by_name("SeeTickets"),
+    "etix" : detector_registry.get_detector_by_name("Etix"),
+}
+
+
+def get_rss_mb() -> Optional[float]:
+    """Get the memory used by the process and its children (the browsers), in MB. Without psutil, the peak memory of the process is given."""
+    if psutil is not None:
+        process = psutil.Process()
+        rss = process.memory_info().rss
+        for child in process.children(recursive=True):
+            try:
+                rss += child.memory_info().rss
+            except psutil.Error:
+                pass
+        return rss / 1024 ** 2
+    if resource is not None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # in KB on Linux
+    return None
+
+
+def get_version() -> Optional[str]:
+    """Get the git commit of the code, to tell the results of different versions apart."""
+    try:
+        return subprocess.check_output(["git", "describe", "--always", "--dirty"], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_checks(
+    detector : SoldoutDetector, 
+    urls : Dict[str, str], 
+    concurrency : int, 
+    n_checks : int, 
+    mode : str, 
+    http_fetcher : HttpFetcher, 
+    driver_pool : Optional[DriverPool],
+) -> dict:
+    """Check the urls of a detector n_checks times in total, alternating sold out and available pages, with concurrency workers.
+
+    Args:
+        detector (SoldoutDetector): the detector to benchmark
+        urls (Dict[str, str]): the urls of the pages of the detector's site, by state
+        concurrency (int): the number of checks made at the same time
+        n_checks (int): the total number of checks
+        mode (str): MODE_HTTP or MODE_CHECK
+        http_fetcher (HttpFetcher): the HTTP fetcher
+        driver_pool (Optional[DriverPool]): the pool of webdrivers, for MODE_CHECK
+
+    Returns:
+        dict: the measures : pages per second, latency percentiles (in seconds), number of errors and of wrong verdicts
+    """
+    states = [STATE_SOLDOUT, STATE_AVAILABLE]
+
+    def check(index : int) -> tuple:
+        state = states[index % len(states)]
+        start = perf_counter()
+        try:
+            if mode == MODE_HTTP:
+                answer = detector.check_with_http(urls[state], http_fetcher)
+                is_soldout = answer.is_soldout if answer is not None else None
+            else:
+                is_soldout = detector.check(urls[state], driver_pool, http_fetcher).is_soldout
+        except Exception:
+            is_soldout = None
+        return perf_counter() - start, state, is_soldout
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(check, range(n_checks)))
+    duration = perf_counter() - start
+    latencies = [latency for latency, _, _ in results]
+    return {
+        "pages_per_second" : n_checks / duration,
+        "latency_p50" : get_percentile(latencies, 50),
+        "latency_p95" : get_percentile(latencies, 95),
+        "n_errors" : sum(is_soldout is None for _, _, is_soldout in results),
+        "n_wrong_verdicts" : sum(is_soldout is not None and is_soldout != (state == STATE_SOLDOUT) for _, state, is_soldout in results),
+    }
+
+
+def load_previous_results(path : str) -> Dict[tuple, dict]:
+    """Load the last results of each configuration (mode, detector, concurrency, latency) from the results file."""
+    previous_results = {}
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            for line in f:
+                if line.strip():
+                    result = json.loads(line)
+                    previous_results[(result["mode"], result["detector"], result["concurrency"], result["latency"])] = result
+    return previous_results
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the detectors offline, on recorded pages served locally")
+    parser.add_argument("--mode", choices=[MODE_HTTP, MODE_CHECK], default=MODE_HTTP)
+    parser.add_argument("--detectors", nargs="*", default=None, help=f"detectors to benchmark, among {list(DETECTORS)} (default : all the detectors usable in this mode)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--n-checks", type=int, default=200, help="number of checks for each detector and concurrency")
+    parser.add_argument("--latency", type=float, default=0.1, help="latency injected by the fixture server, in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02, help="maximum random variation of the latency, in seconds")
+    parser.add_argument("--results", default=RESULTS_PATH, help="file the results are appended to")
+    parser.add_argument("--no-save", action="store_true", help="don't append the results to the results file")
+    args = parser.parse_args()
+
+    detector_names = args.detectors if args.detectors is not None else list(DETECTORS)
+    if args.mode == MODE_HTTP and args.detectors is None:
+        # In http mode, only the detectors whose marker is in the static HTML give meaningful verdicts
+        detector_names = [name for name in detector_names if DETECTORS[name].marker_in_static_html]
+    previous_results = load_previous_results(args.results)
+    version = get_version()
+    date = datetime.now().isoformat(timespec="seconds")
+
+    http_fetcher = HttpFetcher(pool_size=max(args.concurrency))
+    driver_pool = DriverPool(min_size=0, max_size=max(args.concurrency)) if args.mode == MODE_CHECK else None
+    results = []
+    with FixtureServer(latency=args.latency, jitter=args.jitter) as server:
+        for detector_name in detector_names:
+            detector = DETECTORS[detector_name]
+            urls = {state : server.get_url(detector_name, state) for state in (STATE_SOLDOUT, STATE_AVAILABLE)}
+            print(f"\n{detector.get_name()} ({args.mode} mode, latency {args.latency}s)")
+            for concurrency in args.concurrency:
+                measures = run_checks(detector, urls, concurrency, args.n_checks, args.mode, http_fetcher, driver_pool)
+                result = {
+                    "date" : date, "version" : version, "python" : sys.version.split()[0],
+                    "mode" : args.mode, "detector" : detector_name, "concurrency" : concurrency, "latency" : args.latency, "n_checks" : args.n_checks,
+                    **measures,
+                    "rss_mb" : get_rss_mb(),
+                }
+                results.append(result)
+                line = (
+                    f"  concurrency {concurrency:3d} : {measures['pages_per_second']:8.1f} pages/s, "
+                    f"p50 {measures['latency_p50'] * 1000:7.1f} ms, p95 {measures['latency_p95'] * 1000:7.1f} ms, "
+                    f"RSS {result['rss_mb'] or 0:6.0f} MB, {measures['n_errors']} errors, {measures['n_wrong_verdicts']} wrong verdicts"
+                )
+                previous_result = previous_results.get((args.mode, detector_name, concurrency, args.latency))
+                if previous_result is not None:
+                    change = measures["pages_per_second"] / previous_result["pages_per_second"] - 1
+                    line += f" ({change:+.0%} pages/s vs {previous_result['version']})"
+                print(line)
+    http_fetcher.close()
+    if driver_pool is not None:
+        driver_pool.close()
+
+    if not args.no_save:
+        with open(args.results, "a") as f:
+            for result in results:
+                f.write(json.dumps(result) + "\n")
+        print(f"\nResults appended to {args.results}")
@@ -0,0 +1,79 @@
+# Micro-benchmark of the marker matchers : compare the BeautifulSoup path (is_in_html_classes / is_in_html_ids, which parse the whole page)
+# with the streaming MarkerMatcher (html.parser and lxml backends), on saved pages or on a synthetic large page.
+#
+# Usage :
+#     python -m benchmarks.bench_marker_matcher [page1.html page2.html ...] [--repeat 20]
+
+import argparse
+from timeit import timeit
+from typing import Any, Callable, Dict, List
+
+from bs4 import BeautifulSoup
+
+from src.html_matching import Marker, MarkerMatcher, MARKER_CLASS, MARKER_ID, BACKEND_HTML_PARSER, BACKEND_LXML, etree
+
+
+def is_in_html_classes(
+    page_source : str, 
+    element : Any,
+):
+    soup = BeautifulSoup(page_source, "html.parser")
+    tags = soup.find_all(class_=True)
+    classes = [tag["class"] for tag in tags]
+    return element in classes
+
+def is_in_html_ids(
+    page_source : str, 
+    element_id : str,
+):
+    soup = BeautifulSoup(page_source, "html.parser")
+    return soup.find(id=element_id) is not None
+
+
+def make_synthetic_page(n_blocks : int = 5000, marker_position : float = 0.5) -> str:
+    """Create a large page made of n_blocks blocks of tags, with the markers of the detectors at marker_position (a fraction of the page), or absent if marker_position is None."""
+    blocks = []
+    for i in range(n_blocks):
+        blocks.append(f'<div class="row item-{i % 50} col"><span id="price-{i}" class="price">{i} $</span><a href="/event/{i}" class="link">Event {i}</a></div>')
+    if marker_position is not None:
+        index = int(marker_position * n_blocks)
+        blocks.insert(index, '<div id="normal-price-code" class="changeMe shipping">Buy tickets</div>')
+    return "<html><head><title>Event</title></head><body>" + "".join(blocks) + "</body></html>"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the marker matchers")
+    parser.add_argument("pages", nargs="*", help="paths of saved HTML pages (a synthetic page is used if none is given)")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    # Load pages
+    pages : Dict[str, str] = {}
+    for path in args.pages:
+        with open(path, "r", encoding="utf-8", errors="ignore") as f:
+            pages[path] = f.read()
+    if len(pages) == 0:
+        pages["synthetic, marker in the middle"] = make_synthetic_page(marker_position=0.5)
+        pages["synthetic, marker at the beginning"] = make_synthetic_page(marker_position=0.01)
+        pages["synthetic, no marker"] = make_synthetic_page(marker_position=None)
+
+    # Matching methods to compare, on the class marker of SeeTickets and the id marker of Etix
+    class_marker = ['changeMe', 'shipping']
+    id_marker = "normal-price-code"
+    methods : Dict[str, Callable[[str], bool]] = {
+        "BeautifulSoup (class)" : lambda page: is_in_html_classes(page, class_marker),
+        "BeautifulSoup (id)" : lambda page: is_in_html_ids(page, id_marker),
+    }
+    backends : List[str] = [BACKEND_HTML_PARSER] + ([BACKEND_LXML] if etree is not None else [])
+    for backend in backends:
+        class_matcher = MarkerMatcher([Marker(MARKER_CLASS, class_marker)], backend=backend)
+        id_matcher = MarkerMatcher([Marker(MARKER_ID, id_marker)], backend=backend)
+        methods[f"MarkerMatcher {backend} (class)"] = class_matcher.matches
+        methods[f"MarkerMatcher {backend} (id)"] = id_matcher.matches
+
+    for page_name, page in pages.items():
+        print(f"\n{page_name} ({len(page) / 1024:.0f} KB)")
+        for method_name, method in methods.items():
+            result = method(page)
+            duration = timeit(lambda: method(page), number=args.repeat) / args.repeat
+            print(f"  {method_name:40s} {duration * 1000:8.2f} ms   found={result}")
@@ -0,0 +1,147 @@
+# Local HTTP server of recorded ticket pages, so that the detectors can be benchmarked and tested offline.
+# Pages are served from benchmarks/fixtures/<site>_<state>.html at http://127.0.0.1:<port>/<site>/<state>, with an injected latency.
+#
+# Usage :
+#     python -m benchmarks.fixture_server [--port 8765] [--latency 0.2] [--jitter 0.05]
+#     python -m benchmarks.fixture_server --record <site> <state> <url>   (save a real page as a fixture, with the browser)
+
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import random
+import threading
+from time import sleep
+from typing import Dict, Optional, Tuple
+
+
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# States of the recorded pages
+STATE_SOLDOUT = "soldout"
+STATE_AVAILABLE = "available"
+
+
+
+def load_fixtures(directory : str = FIXTURES_DIRECTORY) -> Dict[Tuple[str, str], bytes]:
+    """Load the recorded pages of a directory, named <site>_<state>.html.
+
+    Args:
+        directory (str, optional): the directory of the pages. Defaults to FIXTURES_DIRECTORY.
+
+    Returns:
+        Dict[Tuple[str, str], bytes]: the pages, by (site, state)
+    """
+    fixtures = {}
+    for file_name in sorted(os.listdir(directory)):
+        name, extension = os.path.splitext(file_name)
+        if extension != ".html" or "_" not in name:
+            continue
+        site, state = name.rsplit("_", 1)
+        with open(os.path.join(directory, file_name), "rb") as f:
+            fixtures[(site, state)] = f.read()
+    return fixtures
+
+
+
+class FixtureServer:
+    """A local HTTP server of recorded pages, each request being delayed by latency seconds (plus or minus a random jitter) to imitate a real site.
+    Requests are served concurrently, each by its own thread.
+
+    Usage :
+        with FixtureServer(latency=0.2) as server:
+            url = server.get_url("etix", STATE_SOLDOUT)
+    """
+    def __init__(self, port : int = 0, latency : float = 0.0, jitter : float = 0.0, fixtures : Optional[Dict[Tuple[str, str], bytes]] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.fixtures = fixtures if fixtures is not None else load_fixtures()
+        self.n_requests = 0
+        self.n_requests_lock = threading.Lock()
+        fixture_server = self
+
+        class FixtureRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with fixture_server.n_requests_lock:
+                    fixture_server.n_requests += 1
+                parts = self.path.split("?")[0].strip("/").split("/")
+                page = fixture_server.fixtures.get(tuple(parts)) if len(parts) == 2 else None
+                delay = fixture_server.latency + random.uniform(-fixture_server.jitter, fixture_server.jitter)
+                if delay > 0:
+                    sleep(delay)
+                if page is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(page)))
+                self.end_headers()
+                self.wfile.write(page)
+
+            def log_message(self, format, *args):
+                pass  # don't print each request
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), FixtureRequestHandler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, name="fixture_server", daemon=True)
+
+    def get_url(self, site : str, state : str) -> str:
+        return f"http://127.0.0.1:{self.port}/{site}/{state}"
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+
+def record_fixture(site : str, state : str, url : str, directory : str = FIXTURES_DIRECTORY) -> str:
+    """Save the HTML of a real page, as rendered by the browser, as the fixture of a site and a state.
+
+    Returns:
+        str: the path of the saved page
+    """
+    from src.web_scraping import get_driver, load_page
+    driver = get_driver()
+    try:
+        load_page(driver, url)
+        page_source = driver.page_source
+    finally:
+        driver.quit()
+    path = os.path.join(directory, f"{site}_{state}.html")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(page_source)
+    return path
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the recorded ticket pages locally, or record a new one")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="latency injected in each response, in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="maximum random variation of the latency, in seconds")
+    parser.add_argument("--record", nargs=3, metavar=("SITE", "STATE", "URL"), help="record the page at URL as the fixture of SITE in STATE (soldout or available)")
+    args = parser.parse_args()
+
+    if args.record is not None:
+        site, state, url = args.record
+        print(f"Page saved in {record_fixture(site, state, url)}")
+    else:
+        server = FixtureServer(port=args.port, latency=args.latency, jitter=args.jitter)
+        for site, state in server.fixtures:
+            print(server.get_url(site, state))
+        print("Serving the recorded pages, press Ctrl+C to stop.")
+        try:
+            server.server.serve_forever()
+        except KeyboardInterrupt:
+            server.server.server_close()
@@ -1,114 +1,113 @@
 # This file aim to find a class discriminator inside an HTML page that will be used to discriminate available (yes, presence of the discriminator) and soldout (no, absence of the discriminator).
 
-from typing import Callable, Dict, List, Set, Tuple
-from bs4 import BeautifulSoup
-from selenium import webdriver
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional
 from tqdm import tqdm
-from src.web_scraping import get_driver
+from src.web_scraping import BrowserProfile, DriverPool, load_page
+from src.page_store import PageStore
+from src.discriminators import IdentifierMatrix, StreamingIdentifierCounter, get_identifiers_from_html, format_identifier, METRIC_F1, METRIC_PRECISION, METRIC_RECALL, METRIC_DIFFERENCE
 
 
-class Tag: pass
-class Infoname: str
-class Infovalue: str
+def load_urls(path : str) -> List[str]:
+    """Load the urls of a file, one per line, without duplicates nor empty lines."""
+    with open(path, "r") as f:
+        urls = [line.strip() for line in f]
+    return sorted(set(url for url in urls if url != ""))
 
-
-infoname_to_getter : Dict[Infoname, Callable[[Tag], Infovalue]] = {
-    "id": lambda tag: tag["id"],
-    "class": lambda tag: tuple(tag["class"]),
-    "name" : lambda tag: tag.name,
-    "text" : lambda tag: tag.text,
-}
-infoname_to_getter2 = {}
-infoname_to_getter3 = {}
-for infoname1, getter1 in infoname_to_getter.items():
-    # Add combination of 2
-    for infoname2, getter2 in infoname_to_getter.items():
-        if infoname1 == infoname2:
-            continue
-        infoname_to_getter2[f"{infoname1}_{infoname2}"] = lambda tag, getter1=getter1, getter2=getter2: (getter1(tag), getter2(tag))
-        # Add combination of 3
-        for infoname3, getter3 in infoname_to_getter.items():
-            if infoname1 == infoname3 or infoname2 == infoname3:
-                continue
-            infoname_to_getter3[f"{infoname1}_{infoname2}_{infoname3}"] = lambda tag, getter1=getter1, getter2=getter2, getter3=getter3: (getter1(tag), getter2(tag), getter3(tag))
-infoname_to_getter.update(infoname_to_getter2)
-infoname_to_getter.update(infoname_to_getter3)
-
-def get_infos_from_tag(tag : Tag) -> List[Infovalue]:
-    """Get the all the infovalues from a tag. Infovalues are the value of a certain tag according to a certain infoname.
-    Infovalues contain the infoname in their name, so that we can distinguish them.
+def fetch_missing_pages(urls : List[str], page_store : PageStore, driver_pool : Optional[DriverPool], n_workers : int) -> List[str]:
+    """Make sure that the pages of urls are in the page store, by loading concurrently with the browser those that are missing or stale.
+    Pages are saved in the page store as soon as they are loaded, and not kept in memory.
 
     Args:
-        tag (Tag): the tag to get the infovalues from, a tag represent a html tag from the BeautifulSoup library
+        urls (List[str]): the urls of the pages
+        page_store (PageStore): the on-disk store of the pages
+        driver_pool (Optional[DriverPool]): the pool of webdrivers, or None to work offline (stale pages are then used, and missing pages are skipped)
+        n_workers (int): the number of pages loaded at the same time
 
     Returns:
-        List[Infovalue]: the list of infovalues contained in the tag
+        List[str]: the urls whose page is in the page store
     """
-    return [f"{infoname}_{getter(tag)}" for infoname, getter in infoname_to_getter.items()]
-
-def get_set_of_identifiers_from_url(url : str, driver : webdriver.Firefox) -> Set[str]:
-    """Get the set of identifiers that we can observe in the url. Identifiers are the (user destined) repr of a criteria (such as : "id is 'checkoutbutton' and name is 'div'")
-
-    Args:
-        url (str): the url of the page
-        driver (webdriver.Firefox): the webdriver to use
-
-    Returns:
-        Set[str]: the set of identifiers that we can observe in the url
-    """
-    driver.get(url)
-    page_source = driver.page_source
-    soup = BeautifulSoup(page_source, "html.parser")
-    tags = soup.find_all(id=True, class_=True)   # list of tags, each of which has a class attribute of type List[str]
-    identifiers = sum([get_infos_from_tag(tag) for tag in tags], [])
-    identifiers = set(identifiers)
-    return identifiers
+    stored_urls = []
+    urls_to_fetch = []
+    for url in urls:
+        if page_store.is_fresh(url) or (driver_pool is None and page_store.is_stored(url)):
+            stored_urls.append(url)
+        elif driver_pool is not None:
+            urls_to_fetch.append(url)
+        else:
+            print(f"Warning : {url} is not in the page cache, it is skipped.")
+
+    def fetch(url : str):
+        with driver_pool.lease() as driver:
+            load_page(driver, url)
+            page_store.put(url, driver.page_source)
+
+    if len(urls_to_fetch) > 0:
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            futures = {executor.submit(fetch, url) : url for url in urls_to_fetch}
+            for future in tqdm(as_completed(futures), total=len(futures), desc="Loading pages"):
+                url = futures[future]
+                try:
+                    future.result()
+                    stored_urls.append(url)
+                except Exception as e:
+                    print(f"Warning : could not load {url} : {e}")
+        page_store.save()
+    return stored_urls
 
 
 
 if __name__ == "__main__":
-    print("Getting driver...")
-    driver = get_driver()
-
-    print("Loading soldout urls...")
-    with open("data/soldout_urls.txt", "r") as f:
-        soldout_urls = f.readlines()
-        soldout_urls = set(string.strip() for string in soldout_urls)
-        soldout_urls = set(string for string in soldout_urls if string != "")
-        soldout_list_of_identifiers = [get_set_of_identifiers_from_url(url, driver) for url in soldout_urls]
-        n_soldout_urls = len(soldout_list_of_identifiers)
-    print(f"Loaded {n_soldout_urls} soldout urls.")
-
-    print("Loading available urls...")
-    with open("data/available_urls.txt", "r") as f:
-        available_urls = f.readlines()
-        available_urls = set(string.strip() for string in available_urls)
-        available_urls = set(string for string in available_urls if string != "")
-        available_list_of_identifiers_set = [get_set_of_identifiers_from_url(url, driver) for url in available_urls]
-        n_available_urls = len(available_list_of_identifiers_set)
-    print(f"Loaded {n_available_urls} available urls.")
-
-    print("Computing scores for each classname...")
-    identifiers_to_scores : Dict[Tuple[str], Tuple[float, float]] = {}
-    # The first component denotes the number of times the classname appear in an available url's set of classnames, so its 
-    # The second component denotes the number of times the classname appear in a soldout url's set of classnames, so it is True Positive + False Negative
-    # We want to find the component that minimize abs(first - second)
-    for identifier_set in tqdm(available_list_of_identifiers_set, desc="Available urls"):
-        for identifier in identifier_set:
-            if identifier in identifiers_to_scores:
-                identifiers_to_scores[identifier] = (identifiers_to_scores[identifier][0] + 1, identifiers_to_scores[identifier][1])
-            else:
-                identifiers_to_scores[identifier] = (1, 0)
-    for identifier_set in tqdm(soldout_list_of_identifiers, desc="Soldout urls"):
-        for identifier in identifier_set:
-            if identifier in identifiers_to_scores:
-                identifiers_to_scores[identifier] = (identifiers_to_scores[identifier][0], identifiers_to_scores[identifier][1] + 1)
-            else:
-                identifiers_to_scores[identifier] = (0, 1)
+    parser = argparse.ArgumentParser(description="Find the identifiers discriminating the available and the soldout pages of a site")
+    parser.add_argument("--soldout-urls", default="data/soldout_urls.txt")
+    parser.add_argument("--available-urls", default="data/available_urls.txt")
+    parser.add_argument("--cache-dir", default="data/page_cache", help="directory of the on-disk cache of the pages")
+    parser.add_argument("--ttl", type=float, default=24, help="time after which a cached page is loaded again, in hours")
+    parser.add_argument("--n-workers", type=int, default=4, help="number of pages loaded at the same time")
+    parser.add_argument("--offline", action="store_true", help="only use the cached pages, even stale ones, without loading any page")
+    parser.add_argument("--metric", choices=[METRIC_F1, METRIC_PRECISION, METRIC_RECALL, METRIC_DIFFERENCE], default=METRIC_F1, help="metric by which the identifiers are ranked")
+    parser.add_argument("--min-precision", type=float, default=0.0, help="minimum precision of the identifiers shown")
+    parser.add_argument("--min-recall", type=float, default=0.0, help="minimum recall of the identifiers shown")
+    parser.add_argument("--top-k", type=int, default=10, help="number of identifiers shown")
+    parser.add_argument("--min-support", type=int, default=2, help="minimum number of pages an identifier must be in to be counted exactly (1 to count all the identifiers exactly)")
+    parser.add_argument("--min-frequency", type=float, default=0.001, help="minimum ratio of the pages an identifier must be in to keep its exact counter (0 to keep them all)")
+    parser.add_argument("--exact", action="store_true", help="keep the identifiers of all the pages in a sparse matrix, instead of running counts")
+    args = parser.parse_args()
+
+    page_store = PageStore(args.cache_dir, ttl=args.ttl * 3600)
+    soldout_urls = load_urls(args.soldout_urls)
+    available_urls = load_urls(args.available_urls)
+    driver_pool = None
+    if not args.offline and not all(page_store.is_fresh(url) for url in soldout_urls + available_urls):
+        print("Getting drivers...")
+        # The pages are stored once the load event fired (and not as soon as the DOM is ready, as for the checks) :
+        # the identifiers rendered by scripts must be in the stored pages, which are reused until they expire
+        driver_pool = DriverPool(min_size=0, max_size=args.n_workers, profile=BrowserProfile(page_load_strategy="normal"))
+
+    # Pages are processed one at a time, and their identifiers folded into running counts (or into a matrix of all the pages, with --exact)
+    identifier_counter = IdentifierMatrix() if args.exact else StreamingIdentifierCounter(min_support=args.min_support, min_frequency=args.min_frequency)
+    for label, urls, is_available in [("soldout", soldout_urls, False), ("available", available_urls, True)]:
+        print(f"Loading {label} urls...")
+        stored_urls = fetch_missing_pages(urls, page_store, driver_pool, args.n_workers)
+        for url in tqdm(stored_urls, desc=f"Extracting identifiers of {label} urls"):
+            identifier_counter.add_page(get_identifiers_from_html(page_store.get(url, allow_stale=True)), is_available)
+        print(f"Loaded {len(stored_urls)} {label} urls.")
+    if driver_pool is not None:
+        driver_pool.close()
+    n_available_urls, n_soldout_urls = identifier_counter.get_n_pages()
+
+    print("Computing scores...")
+    identifiers, scores = identifier_counter.get_scores()
+    print(f"{len(identifiers)} identifiers scored.")
     
-    #Printing the best scores according to our criteria
-    print("Best scores:")
-    best_scores = sorted(identifiers_to_scores.items(), key=lambda x: abs(x[1][0] - x[1][1]), reverse=True)
-    for i in range(min(10, len(best_scores))):
-        identifier, (available_detected, soldout_detected) = best_scores[i]
-        print(f"N°{i+1}: {identifier} with {available_detected}/{n_available_urls} available urls and {soldout_detected}/{n_soldout_urls} soldout urls")
\ No newline at end of file
+    # Printing the best scores according to our criteria
+    print(f"Best scores ({args.metric}):")
+    best_identifier_ids = scores.get_top_k(args.top_k, metric=args.metric, min_precision=args.min_precision, min_recall=args.min_recall)
+    for i, identifier_id in enumerate(best_identifier_ids):
+        identifier = format_identifier(identifiers[identifier_id])
+        prediction = "soldout" if scores.is_inverted[identifier_id] else "available"
+        print(
+            f"N°{i+1}: {identifier} with {scores.available_counts[identifier_id]}/{n_available_urls} available urls and {scores.soldout_counts[identifier_id]}/{n_soldout_urls} soldout urls"
+            f" (presence means {prediction} : precision {scores.precision[identifier_id]:.2f}, recall {scores.recall[identifier_id]:.2f}, F1 {scores.f1[identifier_id]:.2f})"
+        )
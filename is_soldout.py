@@ -1,8 +1,7 @@
 import argparse
 
-from selenium import webdriver
-
-from src.web_scraping import url_to_detector
+from src.web_scraping import url_to_detector, DriverPool
+from src.http_fetching import HttpFetcher
     
     
 
@@ -14,9 +13,6 @@ if __name__ == "__main__":
     args = parser.parse_args()
     url = args.url
 
-    # Create driver
-    driver = webdriver.Firefox("driver")
-
     # Check if sold out
     detector = url_to_detector(url)
     if detector is None:
@@ -24,7 +20,10 @@ if __name__ == "__main__":
 
     else:
         print(f"Site detected : {detector.get_name()}")
-        if detector.is_soldout(url, driver):
+        with DriverPool(min_size=0, max_size=1) as driver_pool:
+            answer = detector.check(url, driver_pool, HttpFetcher())
+        print(f"Checked with : {answer.fetch_path}")
+        if answer.is_soldout:
             print("Status : sold out")
         else:
             print("Status : available")
\ No newline at end of file
@@ -0,0 +1,138 @@
+import threading
+from time import monotonic, sleep
+from typing import Callable, List, Tuple
+
+from telegram.error import RetryAfter
+
+from src.interface_database import DBInterface
+from src.profiling import profiler
+
+
+# Kinds of alerts
+ALERT_SOLDOUT = "soldout"
+ALERT_ERROR = "error"
+ALERT_INFO = "info"
+
+MAX_MESSAGE_LENGTH = 4000  # Telegram messages are limited to 4096 characters
+ALERT_CLAIM_DURATION = 600  # the time during which the alerts being sent by a node can't be sent by another node, in seconds
+
+
+
+class AlertSender:
+    """This class sends the alerts of the outbox table on Telegram, from a background thread, so that a slow or rate limited Telegram API
+    never stalls the checks. Alerts queued during a window of window seconds are coalesced into as few messages as possible,
+    messages are sent at most once every min_send_interval seconds, and an alert is removed from the outbox only once it is sent :
+    on a 429 (RetryAfter) the sender waits the time asked by Telegram, on other errors it retries with an exponential backoff.
+    Alerts are claimed in the outbox before being sent, so that when several nodes share the database, each alert is sent by a single node.
+
+    Args:
+        db_interface (DBInterface): the database containing the outbox
+        send_message (Callable[[str], None]): the function sending a message on the chat
+        window (float): the time during which alerts are gathered before being sent, in seconds
+        min_send_interval (float): the minimum time between two messages, in seconds
+        max_backoff (float): the maximum time between two attempts to send an alert, in seconds
+        node_name (str): the name of the node, claiming the alerts it sends
+    """
+    def __init__(
+        self,
+        db_interface : DBInterface,
+        send_message : Callable[[str], None],
+        window : float = 5,
+        min_send_interval : float = 3,
+        max_backoff : float = 300,
+        node_name : str = "default",
+    ):
+        self.db_interface = db_interface
+        self.send_message = send_message
+        self.window = window
+        self.min_send_interval = min_send_interval
+        self.max_backoff = max_backoff
+        self.node_name = node_name
+        self.last_send_time = None
+        self.wake_event = threading.Event()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="alert_sender", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def notify(self):
+        """Tell the sender that alerts were queued. They will be sent after the current window."""
+        self.wake_event.set()
+
+    def stop(self, timeout : float = 30):
+        """Stop the sender, after a last attempt to send the pending alerts."""
+        self.stop_event.set()
+        self.wake_event.set()
+        if self.thread.is_alive():
+            self.thread.join(timeout)
+
+    def run(self):
+        n_failures = 0
+        while not self.stop_event.is_set():
+            # Sleep until alerts are queued (or regularly, to retry postponed alerts), then gather alerts during a window
+            self.wake_event.wait(timeout=self.window)
+            self.wake_event.clear()
+            self.stop_event.wait(self.window)
+            # An error (e.g. of the database) must never stop the sender : it is retried with an exponential backoff
+            try:
+                self.flush()
+                n_failures = 0
+            except Exception as e:
+                backoff = min(self.window * 2 ** n_failures, self.max_backoff)
+                n_failures += 1
+                print(f"Error : exception while sending the alerts ({e}), retrying in {backoff} seconds.")
+                self.stop_event.wait(backoff)
+
+    def flush(self):
+        """Send all the pending alerts of the outbox, coalesced."""
+        try:
+            alerts = self.db_interface.claim_alerts(self.node_name, ALERT_CLAIM_DURATION)
+        except Exception as e:
+            print(f"Error : could not read the alert outbox : {e}")
+            return
+        for text, alert_ids, attempts in self.coalesce(alerts):
+            # Respect the rate limit of Telegram
+            if self.last_send_time is not None:
+                remaining = self.last_send_time + self.min_send_interval - monotonic()
+                if remaining > 0:
+                    sleep(remaining)
+            try:
+                with profiler.measure("telegram.send"):
+                    self.send_message(text)
+                self.last_send_time = monotonic()
+                self.db_interface.delete_alerts(alert_ids)
+            except RetryAfter as e:
+                print(f"Warning : Telegram rate limit reached, retrying alerts in {e.retry_after} seconds.")
+                self.db_interface.postpone_alerts(alert_ids, e.retry_after)
+                return
+            except Exception as e:
+                # Telegram errors, but also network errors of the HTTP client : the alerts are retried later
+                backoff = min(self.min_send_interval * 2 ** attempts, self.max_backoff)
+                print(f"Warning : could not send alerts ({e}), retrying in {backoff} seconds.")
+                self.db_interface.postpone_alerts(alert_ids, backoff)
+                return
+
+    def coalesce(self, alerts : List[Tuple[int, str, str, int]]) -> List[Tuple[str, List[int], int]]:
+        """Group alerts into messages, sold out alerts first, each message being at most MAX_MESSAGE_LENGTH characters long.
+
+        Args:
+            alerts (List[Tuple[int, str, str, int]]): the alerts, as (id, kind, text, attempts)
+
+        Returns:
+            List[Tuple[str, List[int], int]]: the messages, as (text, ids of the alerts in the message, max number of failed attempts of these alerts)
+        """
+        alerts = sorted(alerts, key=lambda alert: (alert[1] != ALERT_SOLDOUT, alert[0]))
+        messages = []
+        text, alert_ids, attempts = "", [], 0
+        for alert_id, kind, alert_text, alert_attempts in alerts:
+            alert_text = alert_text[:MAX_MESSAGE_LENGTH]
+            if text != "" and len(text) + 1 + len(alert_text) > MAX_MESSAGE_LENGTH:
+                messages.append((text, alert_ids, attempts))
+                text, alert_ids, attempts = "", [], 0
+            text = alert_text if text == "" else text + "\n" + alert_text
+            alert_ids.append(alert_id)
+            attempts = max(attempts, alert_attempts)
+        if text != "":
+            messages.append((text, alert_ids, attempts))
+        return messages
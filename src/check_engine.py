@@ -0,0 +1,302 @@
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from datetime import datetime
+import queue
+import threading
+from time import perf_counter
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from src.discriminators import get_marker_candidates
+from src.http_fetching import HttpFetcher
+from src.page_cache import PageCache, get_content_hash
+from src.profiling import profiler
+from src.web_scraping import url_to_detector, extract_event_date, DriverPool, DEFAULT_MAX_RENDER_AGE, FETCH_PATH_HTTP, FETCH_PATH_LISTING, TIER_BROWSER, TIER_STATIC
+
+
+
+class CheckResult:
+    """The result of the check of one ticket url, as produced by a worker of the check engine.
+    Exactly one of is_soldout and error is meaningful : if error is not None, the check failed and is_soldout is None.
+    fetch_path is the way the check was answered (FETCH_PATH_HTTP, FETCH_PATH_SELENIUM or FETCH_PATH_LISTING), or None if it failed.
+    site, event_date and content_hash are the signals extracted from the page for the scheduler, or None if unknown.
+    marker_candidates are the keys of the candidate markers of the page, if the check engine collects them for the online learning of the markers.
+    listing_url is the url of the listing page linked from the event page, if the site supports listing checks.
+    tier is the tier that settled the check (TIER_UNCHANGED, TIER_STATIC or TIER_BROWSER), or None if it failed.
+    needs_own_page_check is True if the ticket was not answered by its listing and must be checked on its own page : it is not a result yet,
+    and the ticket is still in flight. is_listing is True if url is the url of a listing page that could not be fetched (error is its error).
+    """
+    def __init__(
+        self, 
+        url : str, 
+        is_soldout : Optional[bool] = None, 
+        error : Optional[Exception] = None, 
+        duration : float = 0.0, 
+        fetch_path : Optional[str] = None,
+        site : Optional[str] = None,
+        event_date : Optional[datetime] = None,
+        content_hash : Optional[str] = None,
+        marker_candidates : Optional[Set[str]] = None,
+        listing_url : Optional[str] = None,
+        tier : Optional[int] = None,
+        needs_own_page_check : bool = False,
+        is_listing : bool = False,
+    ):
+        self.url = url
+        self.is_soldout = is_soldout
+        self.error = error
+        self.duration = duration
+        self.fetch_path = fetch_path
+        self.site = site
+        self.event_date = event_date
+        self.content_hash = content_hash
+        self.marker_candidates = marker_candidates
+        self.listing_url = listing_url
+        self.tier = tier
+        self.needs_own_page_check = needs_own_page_check
+        self.is_listing = is_listing
+
+
+
+class CheckEngine:
+    """This class checks the tickets of the watchlist concurrently. The urls of a pass are fanned out across n_workers threads.
+    Each check tries a plain HTTP request first if an http_fetcher is given, and leases a webdriver from the driver pool if this is inconclusive.
+    The results are given back to the caller, which is the only one applying side effects (database deletion, alerts).
+
+    Urls can either be checked by batch with run_pass(), or submitted one by one with submit(), in which case the results are
+    collected with get_finished_results() and on_result is called (from a worker thread) each time a result is available.
+    If collect_marker_candidates is True, the candidate markers of each fetched page are collected in the workers, for the online learning of the markers.
+    max_render_age is the time during which the detectors reuse a verdict of the browser while the server-rendered HTML of the page doesn't change.
+
+    The events of a listing page can also be submitted together with submit_listing() : the listing is fetched once, and the events whose verdict
+    is not in the listing (or is soldout, which is confirmed on the event page before alerting) are given back to the caller to be submitted
+    on their own page, so that these fetches go through its rate limiting like any other check.
+    """
+    def __init__(
+        self, 
+        n_workers : int, 
+        driver_pool : DriverPool, 
+        http_fetcher : Optional[HttpFetcher] = None,
+        page_cache : Optional[PageCache] = None,
+        on_result : Optional[Callable[[], None]] = None,
+    ):
+        self.driver_pool = driver_pool
+        self.http_fetcher = http_fetcher
+        self.page_cache = page_cache
+        self.on_result = on_result
+        self.collect_marker_candidates = False
+        self.max_render_age = DEFAULT_MAX_RENDER_AGE
+        self.finished_results : "queue.Queue[CheckResult]" = queue.Queue()
+        # Counters of the checks, by site and outcome ("soldout", "available" or "error"), and total duration of the checks, by site
+        self.counters_lock = threading.Lock()
+        self.check_counts : Dict[Tuple[str, str], int] = {}
+        self.check_durations : Dict[str, float] = {}
+        # Counters of the listing checks : listings fetched, events answered by their listing, and events checked on their own page instead
+        self.listing_counts : Dict[str, int] = {"listings" : 0, "answered" : 0, "fallbacks" : 0}
+        # Counters of the checks, by site and tier that settled them
+        self.tier_counts : Dict[Tuple[str, int], int] = {}
+        self.n_workers = None
+        self.executor = None
+        self.set_n_workers(n_workers)
+
+    def set_n_workers(self, n_workers : int):
+        """Change the number of workers. If it changed, the workers are recreated.
+
+        Args:
+            n_workers (int): the new number of workers, at least 1
+        """
+        n_workers = max(1, int(n_workers))
+        if n_workers == self.n_workers:
+            return
+        self.close()
+        self.n_workers = n_workers
+        self.executor = ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix="check_worker")
+
+    def check_url(self, url : str) -> CheckResult:
+        """Check if one ticket is sold out. This is run inside a worker thread and must not have any side effect.
+
+        Args:
+            url (str): the url of the ticket
+
+        Returns:
+            CheckResult: the result of the check
+        """
+        with profiler.sample_check():
+            check_result = self.run_check(url)
+        profiler.record("check", check_result.duration)
+        self.count_check(check_result)
+        return check_result
+
+    def count_check(self, check_result : CheckResult):
+        site = check_result.site if check_result.site is not None else "unknown"
+        if check_result.error is not None:
+            outcome = "error"
+        else:
+            outcome = "soldout" if check_result.is_soldout else "available"
+        with self.counters_lock:
+            self.check_counts[(site, outcome)] = self.check_counts.get((site, outcome), 0) + 1
+            self.check_durations[site] = self.check_durations.get(site, 0.0) + check_result.duration
+            if check_result.tier is not None:
+                self.tier_counts[(site, check_result.tier)] = self.tier_counts.get((site, check_result.tier), 0) + 1
+
+    def get_check_counters(self) -> Tuple[Dict[Tuple[str, str], int], Dict[str, float]]:
+        """Get the number of checks by (site, outcome) and the total duration of the checks by site, since the engine was created."""
+        with self.counters_lock:
+            return dict(self.check_counts), dict(self.check_durations)
+
+    def get_tier_counters(self) -> Dict[Tuple[str, int], int]:
+        """Get the number of checks by (site, tier that settled them), since the engine was created."""
+        with self.counters_lock:
+            return dict(self.tier_counts)
+
+    def get_listing_counters(self) -> Dict[str, int]:
+        """Get the number of listings fetched, of events answered by their listing and of events checked on their own page instead."""
+        with self.counters_lock:
+            return dict(self.listing_counts)
+
+    def run_check(self, url : str) -> CheckResult:
+        """Same as check_url, without the profiling of the whole check."""
+        start = perf_counter()
+        detector = url_to_detector(url)
+        site = detector.get_name() if detector is not None else None
+        try:
+            if detector is None:
+                raise ValueError(f"Site not detected for ticket {url}")
+            answer = detector.check(
+                url=url, driver_pool=self.driver_pool, http_fetcher=self.http_fetcher, page_cache=self.page_cache, max_render_age=self.max_render_age,
+            )
+            event_date, content_hash, marker_candidates, listing_url = None, answer.content_hash, None, None
+            if answer.page_source is not None:
+                with profiler.measure("event_date"):
+                    event_date = extract_event_date(answer.page_source)
+                if content_hash is None:
+                    with profiler.measure("content_hash"):
+                        content_hash = get_content_hash(answer.page_source)
+                if self.collect_marker_candidates:
+                    with profiler.measure("marker_candidates"):
+                        marker_candidates = get_marker_candidates(answer.page_source)
+                if detector.listing_rule is not None:
+                    listing_url = detector.get_listing_url(url, answer.page_source)
+            return CheckResult(
+                url, 
+                is_soldout=answer.is_soldout, 
+                duration=perf_counter() - start, 
+                fetch_path=answer.fetch_path,
+                site=site,
+                event_date=event_date,
+                content_hash=content_hash,
+                marker_candidates=marker_candidates,
+                listing_url=listing_url,
+                tier=answer.tier,
+            )
+        except Exception as e:
+            return CheckResult(url, error=e, duration=perf_counter() - start, site=site)
+
+    def check_listing(self, listing_url : str, urls : List[str]) -> List[CheckResult]:
+        """Check the events of a listing page with a single fetch of the listing. This is run inside a worker thread and must not have any side effect.
+        The events that are not in the listing, ambiguous or soldout in it, and all of them if the listing can't be fetched, 
+        are given back with needs_own_page_check, to be checked on their own page. If the listing can't be fetched, a result of the listing
+        with its error is given back too, so that the failure counts for its site.
+
+        Args:
+            listing_url (str): the url of the listing page
+            urls (List[str]): the canonical urls of the events of the listing
+
+        Returns:
+            List[CheckResult]: the results of the events answered by the listing, the events to check on their own page, and the error of the listing
+        """
+        start = perf_counter()
+        detector = url_to_detector(listing_url)
+        listing_error = None
+        try:
+            with profiler.measure("listing"):
+                verdicts, fetch_path = detector.check_listing(listing_url, driver_pool=self.driver_pool, http_fetcher=self.http_fetcher)
+        except Exception as e:
+            listing_error = e
+            verdicts, fetch_path = {}, None
+        # A sold out event is removed from the watch list : the verdict of its own page is more reliable
+        answered_urls = [url for url in urls if verdicts.get(url) is False]
+        duration = (perf_counter() - start) / max(1, len(answered_urls))
+        check_results = [
+            CheckResult(
+                url, is_soldout=False, duration=duration, fetch_path=FETCH_PATH_LISTING, site=detector.get_name(),
+                tier=TIER_STATIC if fetch_path == FETCH_PATH_HTTP else TIER_BROWSER,
+            ) 
+            for url in answered_urls
+        ]
+        for check_result in check_results:
+            profiler.record("check", check_result.duration)
+            self.count_check(check_result)
+        with self.counters_lock:
+            self.listing_counts["listings"] += 1
+            self.listing_counts["answered"] += len(answered_urls)
+            self.listing_counts["fallbacks"] += len(urls) - len(answered_urls)
+        check_results += [
+            CheckResult(url, site=detector.get_name(), needs_own_page_check=True) for url in urls if verdicts.get(url) is not False
+        ]
+        if listing_error is not None:
+            check_results.append(
+                CheckResult(listing_url, error=listing_error, duration=perf_counter() - start, site=detector.get_name(), is_listing=True)
+            )
+        return check_results
+
+    def run_pass(self, urls : List[str]) -> Iterator[CheckResult]:
+        """Check all the urls across the workers and yield the results as soon as they are available.
+
+        Args:
+            urls (List[str]): the urls of the tickets to check
+
+        Yields:
+            Iterator[CheckResult]: the results of the checks, in order of completion
+        """
+        futures = [self.executor.submit(self.check_url, url) for url in urls]
+        for future in as_completed(futures):
+            yield future.result()
+
+    def submit(self, url : str):
+        """Submit an url to be checked by a worker. The result will be available in get_finished_results().
+
+        Args:
+            url (str): the url of the ticket
+        """
+        future = self.executor.submit(self.check_url, url)
+        future.add_done_callback(self.on_future_done)
+
+    def submit_listing(self, listing_url : str, urls : List[str]):
+        """Submit the events of a listing page to be checked by a worker with a single fetch of the listing (see check_listing()).
+        The results will be available in get_finished_results().
+
+        Args:
+            listing_url (str): the url of the listing page
+            urls (List[str]): the canonical urls of the events of the listing
+        """
+        future = self.executor.submit(self.check_listing, listing_url, urls)
+        future.add_done_callback(self.on_listing_future_done)
+
+    def on_future_done(self, future : Future):
+        self.finished_results.put(future.result())
+        if self.on_result is not None:
+            self.on_result()
+
+    def on_listing_future_done(self, future : Future):
+        for check_result in future.result():
+            self.finished_results.put(check_result)
+        if self.on_result is not None:
+            self.on_result()
+
+    def get_finished_results(self) -> List[CheckResult]:
+        """Get (and forget) the results of the submitted urls that were checked since the last call.
+
+        Returns:
+            List[CheckResult]: the results, in order of completion
+        """
+        results = []
+        while True:
+            try:
+                results.append(self.finished_results.get_nowait())
+            except queue.Empty:
+                return results
+
+    def close(self):
+        """Stop the workers. The webdrivers belong to the driver pool and are not quit."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
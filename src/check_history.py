@@ -0,0 +1,101 @@
+from typing import Dict, List, Optional, Tuple
+
+from src.check_engine import CheckResult
+from src.utils import get_percentile
+
+
+VERDICT_AVAILABLE = 0
+VERDICT_SOLDOUT = 1
+VERDICT_ERROR = None
+
+
+
+def get_history_row(check_result : CheckResult, checked_at : float) -> Tuple[str, str, float, Optional[int], Optional[str], float, Optional[str]]:
+    """Get the row of the check history corresponding to the result of a check.
+
+    Args:
+        check_result (CheckResult): the result of the check
+        checked_at (float): the time of the check, as a timestamp
+
+    Returns:
+        Tuple: the row, as (ticket_url, site, checked_at, verdict, fetch_path, latency, error_class)
+    """
+    if check_result.error is not None:
+        verdict, error_class = VERDICT_ERROR, type(check_result.error).__name__
+    else:
+        verdict, error_class = (VERDICT_SOLDOUT if check_result.is_soldout else VERDICT_AVAILABLE), None
+    site = check_result.site if check_result.site is not None else "unknown"
+    return (check_result.url, site, checked_at, verdict, check_result.fetch_path, check_result.duration, error_class)
+
+
+class SiteStats:
+    """The statistics of the checks of a site over a period : number of checks and errors, and the median and 95th percentile of the latency."""
+    def __init__(self, n_checks : int, n_errors : int, latency_p50 : Optional[float], latency_p95 : Optional[float]):
+        self.n_checks = n_checks
+        self.n_errors = n_errors
+        self.latency_p50 = latency_p50
+        self.latency_p95 = latency_p95
+
+    def get_error_rate(self) -> float:
+        return self.n_errors / self.n_checks if self.n_checks > 0 else 0.0
+
+
+
+def get_site_stats_from_history(history : List[Tuple[str, float, Optional[str]]]) -> Dict[str, SiteStats]:
+    """Compute the statistics of each site from raw rows of the check history.
+
+    Args:
+        history (List[Tuple[str, float, Optional[str]]]): the checks, as (site, latency, error_class)
+
+    Returns:
+        Dict[str, SiteStats]: the statistics, by site
+    """
+    latencies : Dict[str, List[float]] = {}
+    n_errors : Dict[str, int] = {}
+    for site, latency, error_class in history:
+        latencies.setdefault(site, []).append(latency)
+        n_errors[site] = n_errors.get(site, 0) + (error_class is not None)
+    return {
+        site : SiteStats(len(site_latencies), n_errors[site], get_percentile(site_latencies, 50), get_percentile(site_latencies, 95))
+        for site, site_latencies in latencies.items()
+    }
+
+
+def get_site_stats_from_rollups(rollups : List[Tuple[str, int, int, Optional[float], Optional[float]]]) -> Dict[str, SiteStats]:
+    """Compute the statistics of each site from hourly rollups of the check history. The percentiles of the latency are approximated
+    by the averages of the hourly percentiles, weighted by the number of checks of each hour.
+
+    Args:
+        rollups (List[Tuple[str, int, int, Optional[float], Optional[float]]]): the hourly rollups, as (site, n_checks, n_errors, latency_p50, latency_p95)
+
+    Returns:
+        Dict[str, SiteStats]: the statistics, by site
+    """
+    sums : Dict[str, List[float]] = {}
+    for site, n_checks, n_errors, latency_p50, latency_p95 in rollups:
+        site_sums = sums.setdefault(site, [0, 0, 0.0, 0.0])
+        site_sums[0] += n_checks
+        site_sums[1] += n_errors
+        site_sums[2] += n_checks * (latency_p50 or 0.0)
+        site_sums[3] += n_checks * (latency_p95 or 0.0)
+    return {
+        site : SiteStats(n_checks, n_errors, p50_sum / n_checks if n_checks > 0 else None, p95_sum / n_checks if n_checks > 0 else None)
+        for site, (n_checks, n_errors, p50_sum, p95_sum) in sums.items()
+    }
+
+
+def merge_site_stats(site_stats_1 : Dict[str, SiteStats], site_stats_2 : Dict[str, SiteStats]) -> Dict[str, SiteStats]:
+    """Merge the statistics of the sites over two disjoint periods. The percentiles are averaged, weighted by the number of checks of each period."""
+    merged_site_stats = {}
+    for site in set(site_stats_1) | set(site_stats_2):
+        stats_list = [stats for stats in (site_stats_1.get(site), site_stats_2.get(site)) if stats is not None and stats.n_checks > 0]
+        n_checks = sum(stats.n_checks for stats in stats_list)
+        if n_checks == 0:
+            continue
+        merged_site_stats[site] = SiteStats(
+            n_checks,
+            sum(stats.n_errors for stats in stats_list),
+            sum(stats.latency_p50 * stats.n_checks for stats in stats_list) / n_checks,
+            sum(stats.latency_p95 * stats.n_checks for stats in stats_list) / n_checks,
+        )
+    return merged_site_stats
@@ -1,8 +1,103 @@
 # Telegram 
-from typing import Dict
+from typing import Any, Dict, List
 
 DEFAULT_VALUES : Dict[str, str] = {
     "checking_frequency" : "60",
-    "machine_name" : "default",
     "stop" : "False",
-}
\ No newline at end of file
+    # Check engine
+    "n_workers" : "4",
+    # Driver pool
+    "driver_pool_min_size" : "1",
+    "driver_pool_max_size" : "4",
+    "driver_max_page_loads" : "200",
+    "driver_max_memory_mb" : "1500",
+    # Browser profile
+    "browser_headless" : "True",
+    "browser_block_assets" : "True",    # don't download images, media, fonts and stylesheets
+    "browser_blocked_domains" : "default",  # comma separated list of domains to block, "default" for analytics and ads domains, "None" for no blocking
+    "page_load_strategy" : "eager",     # "normal", "eager" or "none"
+    "marker_wait_timeout" : "10",
+    # Fetch mode : "auto" (plain HTTP request when the detector allows it, browser otherwise) or "selenium" (always the browser)
+    "fetch_mode" : "auto",
+    "http_pool_size" : "4",
+    "http_timeout" : "10",
+    "page_cache_size" : "10000",        # number of urls whose last verdict is remembered, to skip parsing unchanged pages
+    # For the sites whose markers are rendered by scripts, the time during which the verdict of the browser is reused
+    # while the server-rendered HTML of the page doesn't change, in seconds (0 to render the page at each check), or "auto" for checking_frequency.
+    # Their server-rendered HTML usually doesn't change when the event sells out, so a sell out can be missed during this time
+    "max_render_age" : "auto",
+    # Per-site rate limiting, backoff after errors, and pause of the sites with too many consecutive errors
+    "site_rate_per_minute" : "30",
+    "site_burst" : "5",
+    "backoff_base" : "5",
+    "backoff_max" : "600",
+    "circuit_failure_threshold" : "5",
+    "circuit_open_duration" : "900",
+    # Alerts are gathered during alert_window seconds before being sent, and at most one message is sent every alert_min_send_interval seconds
+    "alert_window" : "5",
+    "alert_min_send_interval" : "3",
+    # Adaptive polling : each ticket gets its own checking interval, shorter when its event is close or its page changed recently
+    "adaptive_polling" : "False",
+    "fetch_budget_per_minute" : "0",    # page loads per minute shared among tickets, 0 for no budget (intervals are then relative to checking_frequency)
+    "min_checking_interval" : "10",
+    "max_checking_interval" : "3600",
+    "site_weights" : "",                # e.g. "SeeTickets:2,Etix:0.5"
+    # History of the checks : each check is kept history_retention_hours hours, then downsampled into hourly rollups kept history_rollup_retention_days days
+    "history_retention_hours" : "48",
+    "history_rollup_retention_days" : "90",
+    "profiling" : "True",               # measure the duration of each stage of the checks, displayed by /profile
+    "metrics_port" : "0",               # port of the local metrics endpoint (Prometheus text format), 0 to disable it
+    # Online learning of the markers : the candidate markers of the checked pages are counted per site, and the markers of the detectors are validated
+    # once a site has marker_validation_min_pages labelled pages of each kind (see /markers)
+    "online_learning" : "False",
+    "marker_validation_min_pages" : "20",
+    "marker_validation_min_accuracy" : "0.9",   # minimum balanced accuracy of the markers of a detector, and of a learned reference marker
+    "marker_validation_min_agreement" : "0.8",  # minimum ratio of the recent checks agreeing with the reference marker
+    # Sharding : the watchlist is shared by the instances of the bot using the same database file on the same host (not on a network filesystem),
+    # each instance renewing its lease every heartbeat_period seconds.
+    # The tickets of an instance are taken over by the others once it didn't renew its lease for lease_duration seconds.
+    "sharding" : "False",
+    "heartbeat_period" : "10",
+    "lease_duration" : "30",
+    # Check the watched events of a listing page (e.g. a venue) with a single fetch of the listing, for the sites whose rule has a listing
+    "listing_checks" : "True",
+}
+
+# The parameters whose value must be a positive number, checked by /set (e.g. a rate of 0 would make the sites never checked)
+POSITIVE_PARAMETERS : List[str] = ["site_rate_per_minute"]
+
+
+# Soldout detectors, one per site, compiled at startup (see DetectorRegistry in src/web_scraping.py) :
+# - hosts : the hostnames of the site, subdomains included (e.g. "etix.com" also matches "www.etix.com"),
+#   or "name.*" for the domain name under any top-level domain (e.g. "seetickets.*" matches seetickets.us and seetickets.co.uk)
+# - markers : the markers whose presence in the event page means that the event is available, as {"kind" : "id", "class" or "text", "value" : ...}
+# - fetch_mode : "auto" if the markers are in the server-rendered HTML (a plain HTTP request is tried before the browser), "selenium" otherwise
+# - wait_timeout : the maximum time the browser waits for a marker, in seconds (optional, marker_wait_timeout by default)
+# - query_parameters : the query parameters of the urls identifying an event, the others being dropped from the canonical urls
+#   (optional, by default only the tracking parameters are dropped). Only set it for a site known to identify its events by the path of the urls :
+#   an empty list drops every query parameter, merging the events identified by a query parameter (e.g. performance_id on Etix)
+# - listing : how the events are found in the listing pages of the site (the events of a venue or of a promoter), so that the watched events
+#   of a listing are checked with a single fetch of the listing (optional, by default each event page is fetched), as :
+#   {"link_pattern" : regular expression matching the link of an event page to its listing page,
+#    "item" : marker of the tag of each event in the listing (id or class), "soldout" : marker of a sold out event inside this tag}
+#   No rule has a listing yet : the markup of the listing pages of these sites must be checked before one is added, until then listing_checks does nothing
+DETECTOR_RULES : List[Dict[str, Any]] = [
+    {
+        "name" : "TicketWeb",
+        "hosts" : ["ticketweb.com"],
+        "markers" : [{"kind" : "id", "value" : "edp-section-tickets-heading"}],
+        "fetch_mode" : "selenium",
+    },
+    {
+        "name" : "SeeTickets",
+        "hosts" : ["seetickets.*"],
+        "markers" : [{"kind" : "class", "value" : ["changeMe", "shipping"]}],
+        "fetch_mode" : "auto",
+    },
+    {
+        "name" : "Etix",
+        "hosts" : ["etix.com"],
+        "markers" : [{"kind" : "id", "value" : "normal-price-code"}],
+        "fetch_mode" : "auto",
+    },
+]
\ No newline at end of file
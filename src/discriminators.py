@@ -0,0 +1,349 @@
+from array import array
+from html.parser import HTMLParser
+from itertools import combinations
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from bs4 import BeautifulSoup
+import numpy as np
+from scipy import sparse
+
+from src.html_matching import Marker, MARKER_ID, MARKER_CLASS
+
+
+# Informations read on the tags of a page, from which the identifiers are made
+infoname_to_getter : Dict[str, Callable[[Any], Any]] = {
+    "id": lambda tag: tag["id"],
+    "class": lambda tag: tuple(tag["class"]),
+    "name" : lambda tag: tag.name,
+    "text" : lambda tag: tag.text,
+}
+INFONAMES : List[str] = list(infoname_to_getter)
+# Combinations of 1, 2 and 3 informations (unordered, so that "id and class" and "class and id" are the same identifier)
+INFONAME_COMBINATIONS : List[Tuple[int, ...]] = [combination for size in (1, 2, 3) for combination in combinations(range(len(INFONAMES)), size)]
+INFONAME_COMBINATION_NAMES : List[str] = ["_".join(INFONAMES[index] for index in combination) for combination in INFONAME_COMBINATIONS]
+
+# An identifier is a criteria on a tag, such as "id is 'checkoutbutton' and name is 'div'", as (index of the combination of infonames, values)
+Identifier = Tuple[int, tuple]
+
+# Metrics by which the identifiers can be ranked
+METRIC_F1 = "f1"
+METRIC_PRECISION = "precision"
+METRIC_RECALL = "recall"
+METRIC_DIFFERENCE = "difference"  # the difference between the numbers of available and soldout pages containing the identifier
+
+
+
+def get_identifiers_from_tag(tag : Any) -> Iterator[Identifier]:
+    """Get all the identifiers of a tag. Each information of the tag is read only once, then combined.
+
+    Args:
+        tag (Any): the tag, from the BeautifulSoup library
+
+    Yields:
+        Iterator[Identifier]: the identifiers of the tag
+    """
+    values = [getter(tag) for getter in infoname_to_getter.values()]
+    for combination_index, combination in enumerate(INFONAME_COMBINATIONS):
+        yield (combination_index, tuple(values[index] for index in combination))
+
+def get_identifiers_from_html(page_source : str) -> Set[Identifier]:
+    """Get the set of identifiers that we can observe in a page, on the tags having both an id and a class.
+
+    Args:
+        page_source (str): the HTML of the page
+
+    Returns:
+        Set[Identifier]: the identifiers of the page
+    """
+    soup = BeautifulSoup(page_source, "html.parser")
+    identifiers = set()
+    for tag in soup.find_all(id=True, class_=True):
+        identifiers.update(get_identifiers_from_tag(tag))
+    return identifiers
+
+def format_identifier(identifier : Identifier) -> str:
+    """Get the (user destined) repr of an identifier, e.g. "id_name_('checkoutbutton', 'div')"."""
+    combination_index, values = identifier
+    return f"{INFONAME_COMBINATION_NAMES[combination_index]}_{values[0] if len(values) == 1 else values}"
+
+
+
+class MarkerCandidateParser(HTMLParser):
+    """An html.parser tokenizer collecting the ids and the sets of classes of all the tags, i.e. the candidate markers of a page."""
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.marker_keys : Set[str] = set()
+
+    def handle_starttag(self, tag : str, attrs : List[Tuple[str, Optional[str]]]):
+        for name, value in attrs:
+            if value is None:
+                continue
+            if name == "id" and value.strip() != "":
+                self.marker_keys.add(get_marker_key(Marker(MARKER_ID, value)))
+            elif name == "class" and value.strip() != "":
+                self.marker_keys.add(get_marker_key(Marker(MARKER_CLASS, value.split())))
+
+def get_marker_candidates(page_source : str) -> Set[str]:
+    """Get the keys of the id and class markers that could be used on a page : the ids and the sets of classes of all its tags.
+
+    Args:
+        page_source (str): the HTML of the page
+
+    Returns:
+        Set[str]: the keys of the markers, as given by get_marker_key()
+    """
+    parser = MarkerCandidateParser()
+    parser.feed(page_source)
+    parser.close()
+    return parser.marker_keys
+
+def get_marker_key(marker : Marker) -> str:
+    """Get a string representing a marker, e.g. "id:normal-price-code" or "class:changeMe shipping" (classes sorted)."""
+    value = " ".join(sorted(marker.value)) if marker.kind == MARKER_CLASS else marker.value
+    return f"{marker.kind}:{value}"
+
+def get_marker_from_key(marker_key : str) -> Marker:
+    """Get the marker represented by a string given by get_marker_key()."""
+    kind, value = marker_key.split(":", 1)
+    return Marker(kind, value.split()) if kind == MARKER_CLASS else Marker(kind, value)
+
+
+
+class IdentifierMatrix:
+    """The identifiers of a set of labelled pages, as a sparse boolean matrix of pages by identifiers. Identifiers are interned to integer ids,
+    which are the columns of the matrix.
+
+    Usage :
+        identifier_matrix = IdentifierMatrix()
+        for page_source, is_available in pages:
+            identifier_matrix.add_page(get_identifiers_from_html(page_source), is_available)
+        identifiers, scores = identifier_matrix.get_scores()
+    """
+    def __init__(self):
+        self.identifier_to_id : Dict[Identifier, int] = {}
+        self.identifiers : List[Identifier] = []
+        # The matrix, in CSR format : the ids of the identifiers of page i are indices[indptr[i]:indptr[i + 1]]
+        self.indices = array("q")
+        self.indptr = array("q", [0])
+        self.labels = array("b")  # 1 if the page is available, 0 if it is soldout
+
+    def get_id(self, identifier : Identifier) -> int:
+        """Get the id of an identifier, interning it on the first call."""
+        identifier_id = self.identifier_to_id.get(identifier)
+        if identifier_id is None:
+            identifier_id = self.identifier_to_id[identifier] = len(self.identifiers)
+            self.identifiers.append(identifier)
+        return identifier_id
+
+    def add_page(self, identifiers : Set[Identifier], is_available : bool):
+        """Add a page, with its identifiers and its label."""
+        self.indices.extend(sorted(self.get_id(identifier) for identifier in identifiers))
+        self.indptr.append(len(self.indices))
+        self.labels.append(1 if is_available else 0)
+
+    def get_n_pages(self) -> Tuple[int, int]:
+        """Get the number of available pages and of soldout pages."""
+        n_available = sum(self.labels)
+        return n_available, len(self.labels) - n_available
+
+    def get_matrix(self) -> sparse.csr_matrix:
+        """Get the boolean matrix of pages by identifiers."""
+        indices = np.frombuffer(self.indices, dtype=np.int64)
+        return sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.int32), indices, np.frombuffer(self.indptr, dtype=np.int64)),
+            shape=(len(self.labels), len(self.identifiers)),
+        )
+
+    def get_counts(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the number of available pages and the number of soldout pages containing each identifier, as column sums of the matrix."""
+        matrix = self.get_matrix()
+        labels = np.frombuffer(self.labels, dtype=np.int8).astype(np.int32)
+        available_counts = matrix.T @ labels
+        soldout_counts = matrix.T @ (1 - labels)
+        return available_counts, soldout_counts
+
+    def get_scores(self) -> Tuple[List[Identifier], "DiscriminatorScores"]:
+        """Get the identifiers and their scores (the i-th scores being those of the i-th identifier)."""
+        available_counts, soldout_counts = self.get_counts()
+        return list(self.identifiers), DiscriminatorScores(available_counts, soldout_counts, *self.get_n_pages())
+
+
+
+class StreamingIdentifierCounter:
+    """Running counts of the identifiers of labelled pages, processed one at a time, in bounded memory : only the identifiers seen in at least
+    min_support pages get an exact counter. Before that, their occurrences are counted approximately in a count-min sketch (one per label)
+    of fixed size, and they are promoted with the counts estimated by the sketch when they reach min_support.
+    Identifiers seen in fewer than min_support pages (most of the identifiers made of long texts) never take memory.
+    Every prune_period pages, the exact counters are pruned, so that their number stays bounded however many pages are processed :
+    - the identifiers present in every page so far (they can't discriminate anything yet) are only kept in a set, and get an exact counter back
+      from the number of pages when a page lacks them,
+    - the identifiers in less than min_frequency of the pages are demoted : their counts are folded back into the sketches, from which they
+      are promoted again at their next occurrence, and they are not scored if they are still demoted at the end (their recall is at most min_frequency).
+    Identifiers present in every page are dropped when scoring. With min_support = 1 and min_frequency = 0, all the counts are exact.
+
+    Usage :
+        identifier_counter = StreamingIdentifierCounter(min_support=2)
+        for page_source, is_available in pages:
+            identifier_counter.add_page(get_identifiers_from_html(page_source), is_available)
+        identifiers, scores = identifier_counter.get_scores()
+    """
+    def __init__(
+        self, 
+        min_support : int = 2, 
+        min_frequency : float = 0.001, 
+        prune_period : int = 1000, 
+        sketch_width : int = 2 ** 18, 
+        sketch_depth : int = 4, 
+        seed : int = 0,
+    ):
+        self.min_support = min_support
+        self.min_frequency = min_frequency
+        self.prune_period = prune_period
+        self.sketch_width = sketch_width
+        # Count-min sketches of the identifiers not promoted yet : [label, row, column], label being 1 for available and 0 for soldout
+        self.sketches = np.zeros((2, sketch_depth, sketch_width), dtype=np.int32)
+        random_generator = np.random.default_rng(seed)
+        self.hash_multipliers = random_generator.integers(1, 2 ** 63, size=(sketch_depth, 1), dtype=np.uint64) | np.uint64(1)
+        self.hash_offsets = random_generator.integers(0, 2 ** 63, size=(sketch_depth, 1), dtype=np.uint64)
+        # Exact counts of the promoted identifiers : [number of soldout pages, number of available pages]
+        self.counts : Dict[Identifier, List[int]] = {}
+        # The identifiers present in every page since they were pruned, whose counts are the numbers of pages
+        self.in_every_page : Set[Identifier] = set()
+        self.n_pages = [0, 0]
+
+    def get_sketch_columns(self, identifiers : List[Identifier]) -> np.ndarray:
+        """Get the columns of the identifiers in each row of the sketches, as an array of shape (sketch_depth, len(identifiers))."""
+        hashes = np.array([hash(identifier) for identifier in identifiers], dtype=np.int64).view(np.uint64)
+        with np.errstate(over="ignore"):
+            mixed_hashes = hashes[np.newaxis, :] * self.hash_multipliers + self.hash_offsets
+        return ((mixed_hashes >> np.uint64(32)) % np.uint64(self.sketch_width)).astype(np.int64)
+
+    def add_page(self, identifiers : Set[Identifier], is_available : bool):
+        """Fold the identifiers of a page into the counts."""
+        label = 1 if is_available else 0
+        # The identifiers that were in every page until this one get their counts back
+        if self.in_every_page:
+            for identifier in self.in_every_page - identifiers:
+                self.counts[identifier] = list(self.n_pages)
+            self.in_every_page &= identifiers
+        self.n_pages[label] += 1
+        new_identifiers = []
+        for identifier in identifiers:
+            identifier_counts = self.counts.get(identifier)
+            if identifier_counts is not None:
+                identifier_counts[label] += 1
+            elif identifier not in self.in_every_page:
+                new_identifiers.append(identifier)
+        if len(new_identifiers) > 0:
+            columns = self.get_sketch_columns(new_identifiers)
+            rows = np.arange(columns.shape[0])[:, np.newaxis]
+            np.add.at(self.sketches[label], (rows, columns), 1)
+            # Promote the identifiers that reached min_support pages, according to the sketches
+            estimated_counts = self.sketches[:, rows, columns].min(axis=1)  # [label, identifier]
+            for index in np.flatnonzero(estimated_counts.sum(axis=0) >= self.min_support):
+                self.counts[new_identifiers[index]] = [int(estimated_counts[0, index]), int(estimated_counts[1, index])]
+        if sum(self.n_pages) % self.prune_period == 0:
+            self.prune()
+
+    def prune(self):
+        """Move the identifiers present in every page to in_every_page, and demote the identifiers in less than min_frequency of the pages."""
+        n_soldout, n_available = self.n_pages
+        min_count = self.min_frequency * (n_soldout + n_available)
+        demoted_identifiers = []
+        for identifier, (soldout_count, available_count) in list(self.counts.items()):
+            if soldout_count == n_soldout and available_count == n_available:
+                del self.counts[identifier]
+                self.in_every_page.add(identifier)
+            elif soldout_count + available_count < min_count:
+                demoted_identifiers.append(identifier)
+        if len(demoted_identifiers) == 0:
+            return
+        # The sketches already hold the occurrences counted before the promotion : only the missing ones are added,
+        # so that the estimated counts of the demoted identifiers are at least their exact counts
+        columns = self.get_sketch_columns(demoted_identifiers)
+        rows = np.arange(columns.shape[0])[:, np.newaxis]
+        exact_counts = np.array([self.counts.pop(identifier) for identifier in demoted_identifiers], dtype=np.int32).T  # [label, identifier]
+        estimated_counts = self.sketches[:, rows, columns].min(axis=1)
+        missing_counts = np.maximum(exact_counts - estimated_counts, 0)
+        for label in (0, 1):
+            np.add.at(self.sketches[label], (rows, columns), np.broadcast_to(missing_counts[label], columns.shape))
+
+    def get_n_pages(self) -> Tuple[int, int]:
+        """Get the number of available pages and of soldout pages."""
+        return self.n_pages[1], self.n_pages[0]
+
+    def get_scores(self) -> Tuple[List[Identifier], "DiscriminatorScores"]:
+        """Get the promoted identifiers that are not in every page, and their scores (the i-th scores being those of the i-th identifier)."""
+        n_available, n_soldout = self.get_n_pages()
+        identifiers = [
+            identifier for identifier, (soldout_count, available_count) in self.counts.items() 
+            if soldout_count < n_soldout or available_count < n_available
+        ]
+        available_counts = np.array([self.counts[identifier][1] for identifier in identifiers], dtype=np.int64)
+        soldout_counts = np.array([self.counts[identifier][0] for identifier in identifiers], dtype=np.int64)
+        return identifiers, DiscriminatorScores(available_counts, soldout_counts, n_available, n_soldout)
+
+
+
+class DiscriminatorScores:
+    """The scores of identifiers used as discriminators : the presence of an identifier predicts that a page is available, or, if is_inverted,
+    that it is soldout. Each identifier gets the polarity giving it the best F1 score.
+
+    Args:
+        available_counts (np.ndarray): the number of available pages containing each identifier
+        soldout_counts (np.ndarray): the number of soldout pages containing each identifier
+        n_available (int): the number of available pages
+        n_soldout (int): the number of soldout pages
+    """
+    def __init__(self, available_counts : np.ndarray, soldout_counts : np.ndarray, n_available : int, n_soldout : int):
+        self.available_counts = available_counts
+        self.soldout_counts = soldout_counts
+        precision, recall, f1 = get_precision_recall_f1(available_counts, soldout_counts, n_available)
+        inverted_precision, inverted_recall, inverted_f1 = get_precision_recall_f1(soldout_counts, available_counts, n_soldout)
+        self.is_inverted = inverted_f1 > f1
+        self.precision = np.where(self.is_inverted, inverted_precision, precision)
+        self.recall = np.where(self.is_inverted, inverted_recall, recall)
+        self.f1 = np.where(self.is_inverted, inverted_f1, f1)
+        self.difference = np.abs(available_counts.astype(np.int64) - soldout_counts)
+
+    def get_metric(self, metric : str) -> np.ndarray:
+        if metric == METRIC_F1:
+            return self.f1
+        elif metric == METRIC_PRECISION:
+            return self.precision
+        elif metric == METRIC_RECALL:
+            return self.recall
+        elif metric == METRIC_DIFFERENCE:
+            return self.difference.astype(np.float64)
+        raise ValueError(f"Unknown metric {metric}")
+
+    def get_top_k(self, k : int, metric : str = METRIC_F1, min_precision : float = 0.0, min_recall : float = 0.0) -> np.ndarray:
+        """Get the ids of the k best identifiers according to a metric, among those reaching the minimum precision and recall.
+
+        Args:
+            k (int): the number of identifiers
+            metric (str, optional): METRIC_F1, METRIC_PRECISION, METRIC_RECALL or METRIC_DIFFERENCE. Defaults to METRIC_F1.
+            min_precision (float, optional): the minimum precision of the identifiers. Defaults to 0.0.
+            min_recall (float, optional): the minimum recall of the identifiers. Defaults to 0.0.
+
+        Returns:
+            np.ndarray: the ids of the identifiers, the best first
+        """
+        values = self.get_metric(metric)
+        candidates = np.flatnonzero((self.precision >= min_precision) & (self.recall >= min_recall))
+        if len(candidates) > k:
+            # Select the k best without sorting all the candidates
+            candidates = candidates[np.argpartition(-values[candidates], k - 1)[:k]]
+        return candidates[np.argsort(-values[candidates], kind="stable")]
+
+
+
+def get_precision_recall_f1(true_positives : np.ndarray, false_positives : np.ndarray, n_positives : int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Get the precision, recall and F1 score of classifiers, from their numbers of true and false positives and the number of positive examples."""
+    true_positives = true_positives.astype(np.float64)
+    n_predicted = true_positives + false_positives
+    precision = np.divide(true_positives, n_predicted, out=np.zeros_like(true_positives), where=n_predicted > 0)
+    recall = true_positives / n_positives if n_positives > 0 else np.zeros_like(true_positives)
+    denominator = precision + recall
+    f1 = np.divide(2 * precision * recall, denominator, out=np.zeros_like(true_positives), where=denominator > 0)
+    return precision, recall, f1
@@ -0,0 +1,242 @@
+from html.parser import HTMLParser
+from typing import Iterable, List, Optional, Tuple
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+from src.profiling import profiler
+
+
+# Kinds of markers
+MARKER_ID = "id"        # a tag with this id
+MARKER_CLASS = "class"  # a tag with exactly this set of classes
+MARKER_TEXT = "text"    # this text, in the text content of the page
+
+# Parser backends
+BACKEND_HTML_PARSER = "html.parser"
+BACKEND_LXML = "lxml"
+
+CHUNK_SIZE = 64 * 1024
+
+
+
+class Marker:
+    """Something whose presence in a page is looked for : a tag id, a set of classes of a tag, or a text.
+
+    Args:
+        kind (str): MARKER_ID, MARKER_CLASS or MARKER_TEXT
+        value (str or List[str]): the id, the list of classes, or the text
+    """
+    def __init__(self, kind : str, value):
+        if kind not in (MARKER_ID, MARKER_CLASS, MARKER_TEXT):
+            raise ValueError(f"Unknown marker kind {kind}")
+        self.kind = kind
+        self.value = frozenset(value) if kind == MARKER_CLASS else value
+
+    def could_be_in(self, page_source : str) -> bool:
+        """Return False if the marker is certainly not in the page, without parsing it (only for id and class markers)."""
+        if self.kind == MARKER_ID:
+            return self.value in page_source
+        elif self.kind == MARKER_CLASS:
+            return all(class_name in page_source for class_name in self.value)
+        return True
+
+    def __repr__(self) -> str:
+        value = sorted(self.value) if self.kind == MARKER_CLASS else self.value
+        return f"Marker({self.kind!r}, {value!r})"
+
+
+
+class MarkerFound(Exception):
+    """Raised inside the parsers to stop parsing at the first marker found."""
+    def __init__(self, marker : Marker):
+        self.marker = marker
+
+
+
+class StreamingMarkerParser(HTMLParser):
+    """An html.parser tokenizer that checks each start tag and each text against the markers, and stops at the first hit."""
+    def __init__(self, id_markers : dict, class_markers : dict, text_markers : List[Marker]):
+        super().__init__(convert_charrefs=True)
+        self.id_markers = id_markers
+        self.class_markers = class_markers
+        self.text_markers = text_markers
+        # The end of the previous texts, so that texts spanning several tags are found
+        self.text_tail = ""
+        self.text_tail_length = max((len(marker.value) for marker in text_markers), default=1) - 1
+
+    def handle_starttag(self, tag : str, attrs : List[Tuple[str, Optional[str]]]):
+        for name, value in attrs:
+            if value is None:
+                continue
+            if name == "id" and value in self.id_markers:
+                raise MarkerFound(self.id_markers[value])
+            if name == "class" and self.class_markers:
+                marker = self.class_markers.get(frozenset(value.split()))
+                if marker is not None:
+                    raise MarkerFound(marker)
+
+    def handle_data(self, data : str):
+        if not self.text_markers:
+            return
+        text = self.text_tail + data
+        for marker in self.text_markers:
+            if marker.value in text:
+                raise MarkerFound(marker)
+        self.text_tail = text[-self.text_tail_length:] if self.text_tail_length > 0 else ""
+
+
+
+class MarkerMatcher:
+    """A compiled set of markers, matched against pages by streaming through their HTML tokens and stopping at the first hit,
+    instead of building the whole document tree. Pages that can't contain any id or class marker are rejected without being parsed.
+
+    The lxml backend (if lxml is installed) is faster, but only supports id and class markers : the html.parser backend is used when there are text markers.
+
+    Usage :
+        matcher = MarkerMatcher([Marker(MARKER_ID, "normal-price-code")])
+        is_available = matcher.matches(page_source)
+    """
+    def __init__(self, markers : Iterable[Marker], backend : str = BACKEND_LXML):
+        self.markers = list(markers)
+        self.id_markers = {marker.value : marker for marker in self.markers if marker.kind == MARKER_ID}
+        self.class_markers = {marker.value : marker for marker in self.markers if marker.kind == MARKER_CLASS}
+        self.text_markers = [marker for marker in self.markers if marker.kind == MARKER_TEXT]
+        if backend == BACKEND_LXML and (etree is None or self.text_markers):
+            backend = BACKEND_HTML_PARSER
+        self.backend = backend
+
+    def find_first(self, page_source : str) -> Optional[Marker]:
+        """Get the first marker found in the page.
+
+        Args:
+            page_source (str): the HTML of the page
+
+        Returns:
+            Optional[Marker]: the first marker found, or None if no marker is in the page
+        """
+        with profiler.measure("parsing"):
+            if not any(marker.could_be_in(page_source) for marker in self.markers):
+                return None
+            try:
+                if self.backend == BACKEND_LXML:
+                    self.parse_with_lxml(page_source)
+                else:
+                    parser = StreamingMarkerParser(self.id_markers, self.class_markers, self.text_markers)
+                    for start in range(0, len(page_source), CHUNK_SIZE):
+                        parser.feed(page_source[start:start + CHUNK_SIZE])
+                    parser.close()
+            except MarkerFound as marker_found:
+                return marker_found.marker
+            return None
+
+    def parse_with_lxml(self, page_source : str):
+        parser = etree.HTMLPullParser(events=("start",))
+        for start in range(0, len(page_source), CHUNK_SIZE):
+            parser.feed(page_source[start:start + CHUNK_SIZE])
+            self.check_lxml_events(parser)
+        parser.close()
+        self.check_lxml_events(parser)
+
+    def check_lxml_events(self, parser : "etree.HTMLPullParser"):
+        for _, element in parser.read_events():
+            element_id = element.get("id")
+            if element_id is not None and element_id in self.id_markers:
+                raise MarkerFound(self.id_markers[element_id])
+            element_class = element.get("class")
+            if element_class is not None and self.class_markers:
+                marker = self.class_markers.get(frozenset(element_class.split()))
+                if marker is not None:
+                    raise MarkerFound(marker)
+
+    def matches(self, page_source : str) -> bool:
+        """Return True if at least one of the markers is in the page."""
+        return self.find_first(page_source) is not None
+
+
+
+class ListingParser(HTMLParser):
+    """An html.parser tokenizer splitting a listing page (e.g. the events of a venue) into its event items : each item is a tag having
+    the item marker, with the links it contains and whether the soldout marker is in it. Unlike in MarkerMatcher, a class marker matches the tags
+    having at least its classes, so that a badge class added to the item tag itself (e.g. "event soldout") is found.
+    """
+    def __init__(self, item_marker : Marker, soldout_marker : Marker):
+        super().__init__(convert_charrefs=True)
+        if item_marker.kind == MARKER_TEXT:
+            raise ValueError("The item marker of a listing must be an id or class marker")
+        self.item_marker = item_marker
+        self.soldout_marker = soldout_marker
+        self.items : List[Tuple[List[str], bool]] = []
+        # The item being parsed : its tag, the number of open tags with the same name, its links, and whether it is soldout
+        self.item_tag : Optional[str] = None
+        self.item_depth = 0
+        self.item_links : List[str] = []
+        self.item_texts : List[str] = []
+        self.is_item_soldout = False
+
+    def has_marker(self, marker : Marker, attrs : List[Tuple[str, Optional[str]]]) -> bool:
+        for name, value in attrs:
+            if value is None:
+                continue
+            if marker.kind == MARKER_ID and name == "id" and value == marker.value:
+                return True
+            if marker.kind == MARKER_CLASS and name == "class" and marker.value <= set(value.split()):
+                return True
+        return False
+
+    def handle_starttag(self, tag : str, attrs : List[Tuple[str, Optional[str]]]):
+        if self.item_tag is None:
+            if not self.has_marker(self.item_marker, attrs):
+                return
+            self.item_tag, self.item_depth = tag, 0
+            self.item_links, self.item_texts, self.is_item_soldout = [], [], False
+        if tag == self.item_tag:
+            self.item_depth += 1
+        if tag == "a":
+            href = dict(attrs).get("href")
+            if href:
+                self.item_links.append(href)
+        if self.soldout_marker.kind != MARKER_TEXT and self.has_marker(self.soldout_marker, attrs):
+            self.is_item_soldout = True
+
+    def handle_endtag(self, tag : str):
+        if self.item_tag is None or tag != self.item_tag:
+            return
+        self.item_depth -= 1
+        if self.item_depth == 0:
+            self.end_item()
+
+    def handle_data(self, data : str):
+        if self.item_tag is not None and self.soldout_marker.kind == MARKER_TEXT:
+            self.item_texts.append(data)
+
+    def end_item(self):
+        if self.soldout_marker.kind == MARKER_TEXT and self.soldout_marker.value in "".join(self.item_texts):
+            self.is_item_soldout = True
+        self.items.append((self.item_links, self.is_item_soldout))
+        self.item_tag = None
+
+    def close(self):
+        super().close()
+        if self.item_tag is not None:
+            self.end_item()
+
+
+
+def parse_listing(page_source : str, item_marker : Marker, soldout_marker : Marker) -> List[Tuple[List[str], bool]]:
+    """Get the event items of a listing page.
+
+    Args:
+        page_source (str): the HTML of the listing page
+        item_marker (Marker): the marker of the tag of each event item (id or class)
+        soldout_marker (Marker): the marker whose presence in an item means that its event is soldout
+
+    Returns:
+        List[Tuple[List[str], bool]]: the links (href attributes, as in the page) of each item, and whether it is soldout
+    """
+    with profiler.measure("parsing"):
+        parser = ListingParser(item_marker, soldout_marker)
+        for start in range(0, len(page_source), CHUNK_SIZE):
+            parser.feed(page_source[start:start + CHUNK_SIZE])
+        parser.close()
+        return parser.items
@@ -0,0 +1,73 @@
+import threading
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.profiling import profiler
+
+
+HEADERS : Dict[str, str] = {
+    "User-Agent" : "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:109.0) Gecko/20100101 Firefox/115.0",
+    "Accept" : "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Language" : "en-US,en;q=0.5",
+    "Accept-Encoding" : "gzip, deflate",
+    "Connection" : "keep-alive",
+}
+
+
+
+class HttpFetcher:
+    """Fetch pages with plain HTTP requests, without a browser. There is one keep-alive session per domain,
+    each with its own connection pool of pool_size connections, so that successive checks of a site reuse the same TCP/TLS connections.
+    Responses are gzip-compressed when the server supports it.
+    """
+    def __init__(self, pool_size : int = 4, timeout : float = 10):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.sessions : Dict[str, requests.Session] = {}
+        self.sessions_lock = threading.Lock()
+
+    def get_session(self, url : str) -> requests.Session:
+        """Get the session of the domain of the url, creating it on the first call.
+
+        Args:
+            url (str): the url that will be fetched
+
+        Returns:
+            requests.Session: the session of the domain
+        """
+        domain = urlsplit(url).hostname or ""
+        with self.sessions_lock:
+            session = self.sessions.get(domain)
+            if session is None:
+                session = requests.Session()
+                session.headers.update(HEADERS)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self.sessions[domain] = session
+            return session
+
+    def fetch(self, url : str, headers : Optional[Dict[str, str]] = None) -> requests.Response:
+        """Fetch a page.
+
+        Args:
+            url (str): the url of the page
+            headers (Optional[Dict[str, str]], optional): additional headers of the request, e.g. to make it conditional. Defaults to None.
+
+        Raises:
+            requests.RequestException: if the request failed (connection error, timeout...)
+
+        Returns:
+            requests.Response: the response, whatever its status code
+        """
+        with profiler.measure("http.fetch"):
+            return self.get_session(url).get(url, headers=headers, timeout=self.timeout)
+
+    def close(self):
+        with self.sessions_lock:
+            for session in self.sessions.values():
+                session.close()
+            self.sessions = {}
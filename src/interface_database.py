@@ -1,41 +1,239 @@
+import queue
 import sqlite3
-from typing import Dict, List, Tuple
+import threading
+from time import perf_counter, time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 from src.config import DEFAULT_VALUES
+from src.utils import get_percentile
+from src.profiling import profiler
 DATABASE_PATH = "database.db"
 
+WRITE_BATCH_MAX_SIZE = 100  # the maximum number of writes committed in a single transaction
+READ_BATCH_SIZE = 1000      # the number of rows fetched at once when streaming the results of a query
+BUSY_TIMEOUT = 30           # the time a connection waits for a lock held by another connection, in seconds
+
+
+
+class WriteRequest:
+    """A write waiting in the queue of the writer thread. The thread that queued it waits until it is committed."""
+    def __init__(self, write_function : Callable[[sqlite3.Connection], Any]):
+        self.write_function = write_function
+        self.done = threading.Event()
+        self.result = None
+        self.error : Optional[BaseException] = None
+
+    def wait(self) -> Any:
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
 
 
 class DBInterface:
+    """The interface to the SQLite database, safe to use from several threads (the main loop, the check workers, the Telegram dispatcher
+    and the alert sender) :
+    - the database is in WAL mode, so that reads never block the writes and conversely,
+    - each thread reads with its own connection,
+    - all the writes go through a queue to a single writer thread, which commits the writes queued meanwhile in a single transaction.
+      Each write is isolated by a savepoint, so that a failing write doesn't cancel the others. Write methods return once their write is committed.
+    - the parameters are cached in memory, the cache being updated on each set_parameter_in_db().
+    """
 
-    def __init__(self):
-        # Create SQL objects
-        self.conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
-        self.cursor = self.conn.cursor()
-        self.create_tables()
+    def __init__(self, database_path : str = DATABASE_PATH):
+        self.database_path = database_path
+        # Connections for reading, one per thread
+        self.local = threading.local()
+        self.read_connections : List[sqlite3.Connection] = []
+        self.read_connections_lock = threading.Lock()
+        # Connection for writing, only used by the writer thread
+        self.write_connection = self.connect()
+        self.write_connection.execute("PRAGMA journal_mode=WAL")
+        self.write_queue : "queue.Queue[Optional[WriteRequest]]" = queue.Queue()
+        self.writer_thread = threading.Thread(target=self.run_writer, name="db_writer", daemon=True)
+        self.writer_thread.start()
+        # Number and total duration of the writes, including their wait in the queue
+        self.write_stats_lock = threading.Lock()
+        self.n_writes = 0
+        self.write_duration_total = 0.0
+        # Cache of the parameters
+        self.parameters : Dict[str, str] = {}
+        self.parameters_lock = threading.Lock()
         for parameter_name, default_parameter_value in DEFAULT_VALUES.items():
             assert type(default_parameter_value) == str, f"Default value of parameter {parameter_name} is not a string in the config file."
-            if self.get_parameter_from_db(parameter_name) is None:
-                self.execute(f"INSERT INTO parameters (name, value) VALUES (?, ?)", (parameter_name, default_parameter_value))
-                self.commit()
+        self.create_tables()
+
+    def connect(self) -> sqlite3.Connection:
+        # Transactions are managed explicitly (isolation_level=None), the connection is only used by one thread at a time
+        return sqlite3.connect(self.database_path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False)
+
+    def get_read_connection(self) -> sqlite3.Connection:
+        """Get the reading connection of the current thread, creating it on the first call."""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.connect()
+            conn.execute("PRAGMA query_only=ON")
+            self.local.conn = conn
+            with self.read_connections_lock:
+                self.read_connections.append(conn)
+        return conn
+
+    def read(self, query : str, parameters : Tuple = ()) -> List[tuple]:
+        """Run a reading query with the connection of the current thread.
+
+        Args:
+            query (str): the SQL query
+            parameters (Tuple, optional): the parameters of the query. Defaults to ().
+
+        Returns:
+            List[tuple]: the rows returned by the query
+        """
+        with profiler.measure("db.read"):
+            return self.get_read_connection().execute(query, parameters).fetchall()
+
+    def run_in_write_transaction(self, write_function : Callable[[sqlite3.Connection], Any]) -> Any:
+        """Run a function on the writing connection, in the next transaction of the writer thread, and wait until it is committed.
+
+        Args:
+            write_function (Callable[[sqlite3.Connection], Any]): the function making the writes, all of which are committed or cancelled together
+
+        Raises:
+            Exception: the exception raised by write_function, if any (its writes are then cancelled)
+
+        Returns:
+            Any: the value returned by write_function
+        """
+        start = perf_counter()
+        try:
+            write_request = WriteRequest(write_function)
+            self.write_queue.put(write_request)
+            return write_request.wait()
+        finally:
+            duration = perf_counter() - start
+            profiler.record("db.write", duration)
+            with self.write_stats_lock:
+                self.n_writes += 1
+                self.write_duration_total += duration
+
+    def get_write_stats(self) -> Tuple[int, float]:
+        """Get the number of writes and their total duration in seconds (including their wait in the queue), since the interface was created."""
+        with self.write_stats_lock:
+            return self.n_writes, self.write_duration_total
+
+    def write(self, query : str, parameters : Tuple = ()):
+        """Run a writing query in the next transaction of the writer thread, and wait until it is committed."""
+        self.run_in_write_transaction(lambda conn : conn.execute(query, parameters))
+
+    def run_writer(self):
+        """The loop of the writer thread : commit the queued writes by batches, until None is queued."""
+        while True:
+            write_requests = [self.write_queue.get()]
+            while len(write_requests) < WRITE_BATCH_MAX_SIZE:
+                try:
+                    write_requests.append(self.write_queue.get_nowait())
+                except queue.Empty:
+                    break
+            is_stopping = None in write_requests
+            write_requests = [write_request for write_request in write_requests if write_request is not None]
+            if write_requests:
+                self.commit_write_requests(write_requests)
+            if is_stopping:
+                return
+
+    def commit_write_requests(self, write_requests : List[WriteRequest]):
+        conn = self.write_connection
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for write_request in write_requests:
+                conn.execute("SAVEPOINT write_request")
+                try:
+                    write_request.result = write_request.write_function(conn)
+                    conn.execute("RELEASE write_request")
+                except Exception as e:
+                    write_request.error = e
+                    conn.execute("ROLLBACK TO write_request")
+                    conn.execute("RELEASE write_request")
+            conn.execute("COMMIT")
+        except Exception as e:
+            # The whole transaction failed (e.g. the database is locked for too long)
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for write_request in write_requests:
+                write_request.error = e
+        for write_request in write_requests:
+            write_request.done.set()
 
     def create_tables(self):
-        # Create empty ticket table
-        self.execute('''CREATE TABLE IF NOT EXISTS tickets_url
-                (url TEXT PRIMARY KEY)''')
-        # Create parameters table and add the default values
-        self.execute('''CREATE TABLE IF NOT EXISTS parameters
-                (name TEXT PRIMARY KEY, value TEXT)''')
-        for name, value in DEFAULT_VALUES.items():
-            self.execute(f"INSERT OR IGNORE INTO parameters (name, value) VALUES (?, ?)", (name, value))
-        self.commit()
+        def create(conn : sqlite3.Connection):
+            # Create empty ticket table, with the time each ticket was added (NULL for the tickets added before this column existed),
+            # the canonical url of its event, shared by all the urls of the event (NULL until the watch list is canonicalized),
+            # and the url of the listing page of its event, if its site supports listing checks (NULL until found in the event page)
+            conn.execute('''CREATE TABLE IF NOT EXISTS tickets_url
+                    (url TEXT PRIMARY KEY, added_at REAL, canonical_url TEXT, listing_url TEXT)''')
+            ticket_columns = [row[1] for row in conn.execute("PRAGMA table_info(tickets_url)")]
+            if "added_at" not in ticket_columns:
+                conn.execute("ALTER TABLE tickets_url ADD COLUMN added_at REAL")
+            if "canonical_url" not in ticket_columns:
+                conn.execute("ALTER TABLE tickets_url ADD COLUMN canonical_url TEXT")
+            if "listing_url" not in ticket_columns:
+                conn.execute("ALTER TABLE tickets_url ADD COLUMN listing_url TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS tickets_url_added_at ON tickets_url (added_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS tickets_url_canonical_url ON tickets_url (canonical_url)")
+            # Create parameters table and add the default values
+            conn.execute('''CREATE TABLE IF NOT EXISTS parameters
+                    (name TEXT PRIMARY KEY, value TEXT)''')
+            conn.executemany("INSERT OR IGNORE INTO parameters (name, value) VALUES (?, ?)", DEFAULT_VALUES.items())
+            # The name of a machine is set in its .env (MACHINE_NAME), not in the parameters shared by all the machines
+            conn.execute("DELETE FROM parameters WHERE name = 'machine_name'")
+            # Create the outbox of the alerts waiting to be sent on Telegram
+            # (an alert being sent is claimed by a node until claimed_until, so that several nodes sharing the database never send it twice)
+            conn.execute('''CREATE TABLE IF NOT EXISTS alert_outbox
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT, text TEXT, created_at REAL, attempts INTEGER DEFAULT 0, next_attempt_at REAL,
+                    claimed_by TEXT, claimed_until REAL)''')
+            outbox_columns = [row[1] for row in conn.execute("PRAGMA table_info(alert_outbox)")]
+            if "claimed_by" not in outbox_columns:
+                conn.execute("ALTER TABLE alert_outbox ADD COLUMN claimed_by TEXT")
+                conn.execute("ALTER TABLE alert_outbox ADD COLUMN claimed_until REAL")
+            # Create the table of the heartbeats of the nodes sharing the database, with the instance (process) holding the name of each node
+            conn.execute('''CREATE TABLE IF NOT EXISTS node_heartbeats
+                    (node TEXT PRIMARY KEY, heartbeat_at REAL, instance TEXT)''')
+            if "instance" not in [row[1] for row in conn.execute("PRAGMA table_info(node_heartbeats)")]:
+                conn.execute("ALTER TABLE node_heartbeats ADD COLUMN instance TEXT")
+            # Create the append-only history of the checks (verdict is 1 if sold out, 0 if available, NULL if the check failed),
+            # and its rollups per site and per hour, into which the old checks are downsampled
+            conn.execute('''CREATE TABLE IF NOT EXISTS check_history
+                    (ticket_url TEXT, site TEXT, checked_at REAL, verdict INTEGER, fetch_path TEXT, latency REAL, error_class TEXT)''')
+            conn.execute("CREATE INDEX IF NOT EXISTS check_history_checked_at ON check_history (checked_at)")
+            conn.execute('''CREATE TABLE IF NOT EXISTS check_history_hourly
+                    (site TEXT, hour INTEGER, n_checks INTEGER, n_soldout INTEGER, n_errors INTEGER, latency_p50 REAL, latency_p95 REAL, 
+                    PRIMARY KEY (site, hour))''')
+            # Create the tables of the online learning of the markers : the labelled pages (at most one available and one soldout page per ticket),
+            # the number of labelled pages of each site, and the number of labelled pages of each site containing each candidate marker
+            conn.execute('''CREATE TABLE IF NOT EXISTS labelled_pages
+                    (ticket_url TEXT, label INTEGER, site TEXT, labelled_at REAL, PRIMARY KEY (ticket_url, label))''')
+            conn.execute('''CREATE TABLE IF NOT EXISTS labelled_page_counts
+                    (site TEXT PRIMARY KEY, n_available INTEGER DEFAULT 0, n_soldout INTEGER DEFAULT 0)''')
+            conn.execute('''CREATE TABLE IF NOT EXISTS marker_counts
+                    (site TEXT, marker TEXT, n_available INTEGER DEFAULT 0, n_soldout INTEGER DEFAULT 0, PRIMARY KEY (site, marker))''')
+        self.run_in_write_transaction(create)
+        self.load_parameters()
 
     def remove_tables(self):
-        self.execute("DROP TABLE IF EXISTS tickets_url")
-        self.execute("DROP TABLE IF EXISTS parameters")
-        self.commit()
+        def remove(conn : sqlite3.Connection):
+            conn.execute("DROP TABLE IF EXISTS tickets_url")
+            conn.execute("DROP TABLE IF EXISTS parameters")
+        self.run_in_write_transaction(remove)
+        with self.parameters_lock:
+            self.parameters = {}
+
+    def load_parameters(self):
+        """Fill the cache of the parameters from the database."""
+        parameters = {name : value for name, value in self.read("SELECT name, value FROM parameters")}
+        with self.parameters_lock:
+            self.parameters = parameters
 
     def get_parameter_from_db(self, parameter_name : str) -> str:
-        """Get the parameter value (string) corresponding to the parameter name in the database.
+        """Get the parameter value (string) corresponding to the parameter name in the database. The value is read from the cache.
 
         Args:
             parameter_name (str): the name of the parameter
@@ -43,13 +241,8 @@ class DBInterface:
         Returns:
             str: the parameter value, as a string, or None, if the parameter is not found
         """
-        self.execute(f"SELECT value FROM parameters WHERE name = ?", (parameter_name,))
-        list_of_rows_with_correct_name = self.fetchall()
-        if len(list_of_rows_with_correct_name) == 0:
-            return None
-        else:
-            value = list_of_rows_with_correct_name[0][0]
-            return value
+        with self.parameters_lock:
+            return self.parameters.get(parameter_name)
         
     def set_parameter_in_db(self, parameter_name : str, parameter_value : str):
         """Update the parameter value (string) corresponding to the parameter name in the database. The parameter must already exist.
@@ -58,8 +251,10 @@ class DBInterface:
             parameter_name (str): the name of the parameter
             parameter_value (str): the new value of the parameter, as a string
         """
-        self.execute(f"UPDATE parameters SET value = ? WHERE name = ?", (parameter_value, parameter_name))
-        self.commit()
+        self.write("UPDATE parameters SET value = ? WHERE name = ?", (parameter_value, parameter_name))
+        with self.parameters_lock:
+            if parameter_name in self.parameters:
+                self.parameters[parameter_name] = parameter_value
 
     def is_ticket_existing(self, ticket_url : str) -> bool:
         """Return True if the ticket is already in the watch list, False otherwise.
@@ -70,12 +265,7 @@ class DBInterface:
         Returns:
             bool: whether the ticket is already in the watch list
         """
-        self.execute(f"SELECT url FROM tickets_url WHERE url = ?", (ticket_url,))
-        list_of_rows_with_correct_url = self.fetchall()
-        if len(list_of_rows_with_correct_url) == 0:
-            return False
-        else:
-            return True
+        return len(self.read("SELECT url FROM tickets_url WHERE url = ?", (ticket_url,))) > 0
         
     def get_ticket_urls(self) -> List[str]:
         """Get a list of the urls of the tickets in the watch list.
@@ -83,9 +273,129 @@ class DBInterface:
         Returns:
             List[str]: the list of the urls of the tickets in the watch list
         """
-        self.execute(f"SELECT url FROM tickets_url")
-        list_of_rows = self.fetchall()
-        return [row[0] for row in list_of_rows]
+        return [row[0] for row in self.read("SELECT url FROM tickets_url")]
+
+    def get_canonical_urls(self) -> List[str]:
+        """Get the canonical urls of the events of the watch list, each event being checked once whatever its number of urls."""
+        return [row[0] for row in self.read("SELECT DISTINCT COALESCE(canonical_url, url) FROM tickets_url")]
+
+    def get_aliases(self, canonical_url : str) -> List[str]:
+        """Get the urls of the tickets of an event, the first added first."""
+        return [row[0] for row in self.read("SELECT url FROM tickets_url WHERE canonical_url = ? ORDER BY added_at, rowid", (canonical_url,))]
+
+    def get_ticket_canonical_urls(self) -> List[Tuple[str, Optional[str]]]:
+        """Get the urls of the tickets with their canonical url (None for the tickets added before canonical urls existed)."""
+        return self.read("SELECT url, canonical_url FROM tickets_url")
+
+    def set_canonical_urls(self, tickets : List[Tuple[str, str]]):
+        """Set the canonical urls of tickets, in a single transaction.
+
+        Args:
+            tickets (List[Tuple[str, str]]): the tickets, as (url, canonical url)
+        """
+        self.run_in_write_transaction(
+            lambda conn : conn.executemany(
+                "UPDATE tickets_url SET canonical_url = ? WHERE url = ?", [(canonical_url, ticket_url) for ticket_url, canonical_url in tickets],
+            )
+        )
+
+    def get_listing_urls(self) -> Dict[str, str]:
+        """Get the url of the listing page of the watched events whose listing is known, by canonical url."""
+        return dict(self.read("SELECT DISTINCT COALESCE(canonical_url, url), listing_url FROM tickets_url WHERE listing_url IS NOT NULL"))
+
+    def set_listing_url(self, canonical_url : str, listing_url : str):
+        """Set the url of the listing page of an event, for all its aliases."""
+        self.run_in_write_transaction(
+            lambda conn : conn.execute(
+                "UPDATE tickets_url SET listing_url = ? WHERE canonical_url = ? OR (canonical_url IS NULL AND url = ?)", 
+                (listing_url, canonical_url, canonical_url),
+            )
+        )
+
+    def get_n_tickets(self) -> int:
+        """Get the number of tickets in the watch list."""
+        return self.read("SELECT COUNT(*) FROM tickets_url")[0][0]
+
+    def get_tickets_page(self, limit : int, offset : int = 0) -> List[Tuple[str, Optional[float]]]:
+        """Get a page of the watch list, the last added tickets first.
+
+        Args:
+            limit (int): the maximum number of tickets
+            offset (int, optional): the number of tickets skipped. Defaults to 0.
+
+        Returns:
+            List[Tuple[str, Optional[float]]]: the tickets, as (url, added_at)
+        """
+        return self.read("SELECT url, added_at FROM tickets_url ORDER BY added_at DESC, rowid DESC LIMIT ? OFFSET ?", (limit, offset))
+
+    def iter_tickets(self) -> Iterator[Tuple[str, Optional[float]]]:
+        """Iterate over the watch list, the first added tickets first, fetching READ_BATCH_SIZE tickets at a time instead of the whole list.
+
+        Yields:
+            Iterator[Tuple[str, Optional[float]]]: the tickets, as (url, added_at)
+        """
+        cursor = self.get_read_connection().execute("SELECT url, added_at FROM tickets_url ORDER BY added_at, rowid")
+        try:
+            while True:
+                rows = cursor.fetchmany(READ_BATCH_SIZE)
+                if len(rows) == 0:
+                    return
+                yield from rows
+        finally:
+            cursor.close()
+
+    def add_tickets(self, tickets : List[Tuple[str, str]]) -> List[str]:
+        """Add tickets to the watch list, in a single transaction.
+
+        Args:
+            tickets (List[Tuple[str, str]]): the tickets, as (url, canonical url)
+
+        Returns:
+            List[str]: the urls that were added, i.e. that were not already in the watch list
+        """
+        def add(conn : sqlite3.Connection) -> List[str]:
+            added_ticket_urls = []
+            for ticket_url, canonical_url in tickets:
+                if conn.execute(
+                    "INSERT OR IGNORE INTO tickets_url (url, added_at, canonical_url) VALUES (?, ?, ?)", (ticket_url, time(), canonical_url),
+                ).rowcount > 0:
+                    added_ticket_urls.append(ticket_url)
+            return added_ticket_urls
+        return self.run_in_write_transaction(add)
+
+    def import_tickets(self, tickets : Iterable[Tuple[str, str]]) -> int:
+        """Add many tickets to the watch list with a single statement, in a single transaction. The urls must be deduplicated.
+
+        Args:
+            tickets (Iterable[Tuple[str, str]]): the tickets, as (url, canonical url)
+
+        Returns:
+            int: the number of tickets added, i.e. that were not already in the watch list
+        """
+        now = time()
+        return self.run_in_write_transaction(
+            lambda conn : conn.executemany(
+                "INSERT OR IGNORE INTO tickets_url (url, added_at, canonical_url) VALUES (?, ?, ?)", 
+                [(ticket_url, now, canonical_url) for ticket_url, canonical_url in tickets],
+            ).rowcount
+        )
+
+    def remove_tickets(self, ticket_urls : List[str]) -> List[str]:
+        """Remove tickets from the watch list, in a single transaction.
+
+        Args:
+            ticket_urls (List[str]): the urls of the tickets
+
+        Returns:
+            List[str]: the urls that were removed, i.e. that were in the watch list
+        """
+        def remove(conn : sqlite3.Connection) -> List[str]:
+            removed_ticket_urls = []
+            for ticket_url in ticket_urls:
+                if conn.execute("DELETE FROM tickets_url WHERE url = ?", (ticket_url,)).rowcount > 0:
+                    removed_ticket_urls.append(ticket_url)
+            return removed_ticket_urls
+        return self.run_in_write_transaction(remove)
         
     def get_parameters(self) -> Dict[str, str]:
         """Get the dictionary of the parameters.
@@ -93,19 +403,215 @@ class DBInterface:
         Returns:
             Dict[str, str]: a dict with the parameters names as keys and the parameters values as values (string)
         """
-        self.execute(f"SELECT name, value FROM parameters")
-        list_of_rows = self.fetchall()
-        return {row[0] : row[1] for row in list_of_rows}
+        with self.parameters_lock:
+            return dict(self.parameters)
     
-    def close(self):
-        self.cursor.close()
-        self.conn.close()
+    def queue_alert(self, kind : str, text : str, removed_canonical_url : str = None) -> bool:
+        """Add an alert to the outbox, from which it will be sent on Telegram. If removed_canonical_url is given, the tickets of this event are removed
+        from the watch list in the same transaction, so that a ticket is never removed without its alert being durably queued, 
+        and the alert is only queued if the tickets were still in the watch list, so that it is queued once even if several nodes checked the event.
 
-    def execute(self, query : str, parameters : Tuple[str] = ()):
-        self.cursor.execute(query, parameters)
+        Args:
+            kind (str): the kind of alert, e.g. "soldout" or "error"
+            text (str): the text of the alert
+            removed_canonical_url (str, optional): the canonical url of an event whose tickets are removed from the watch list. Defaults to None.
 
-    def commit(self):
-        self.conn.commit()
+        Returns:
+            bool: whether the alert was queued
+        """
+        def queue_in_outbox(conn : sqlite3.Connection) -> bool:
+            if removed_canonical_url is not None and conn.execute(
+                "DELETE FROM tickets_url WHERE canonical_url = ? OR (canonical_url IS NULL AND url = ?)", (removed_canonical_url, removed_canonical_url)
+            ).rowcount == 0:
+                return False
+            now = time()
+            conn.execute("INSERT INTO alert_outbox (kind, text, created_at, next_attempt_at) VALUES (?, ?, ?, ?)", (kind, text, now, now))
+            return True
+        return self.run_in_write_transaction(queue_in_outbox)
+
+    def get_pending_alerts(self) -> List[Tuple[int, str, str, int]]:
+        """Get the alerts of the outbox that are due to be sent, oldest first.
 
-    def fetchall(self):
-        return self.cursor.fetchall()
\ No newline at end of file
+        Returns:
+            List[Tuple[int, str, str, int]]: the alerts, as (id, kind, text, attempts)
+        """
+        return self.read("SELECT id, kind, text, attempts FROM alert_outbox WHERE next_attempt_at <= ? ORDER BY id", (time(),))
+
+    def claim_alerts(self, node_name : str, claim_duration : float) -> List[Tuple[int, str, str, int]]:
+        """Claim the alerts of the outbox that are due to be sent and not claimed by another node, for claim_duration seconds.
+        The claimed alerts are only sent by this node, unless it doesn't delete or postpone them before the end of the claim (e.g. because it crashed).
+
+        Args:
+            node_name (str): the name of the node claiming the alerts
+            claim_duration (float): the duration of the claim, in seconds
+
+        Returns:
+            List[Tuple[int, str, str, int]]: the claimed alerts, oldest first, as (id, kind, text, attempts)
+        """
+        def claim(conn : sqlite3.Connection) -> List[Tuple[int, str, str, int]]:
+            now = time()
+            conn.execute(
+                """UPDATE alert_outbox SET claimed_by = ?, claimed_until = ? 
+                WHERE next_attempt_at <= ? AND (claimed_until IS NULL OR claimed_until < ? OR claimed_by = ?)""",
+                (node_name, now + claim_duration, now, now, node_name),
+            )
+            return conn.execute(
+                "SELECT id, kind, text, attempts FROM alert_outbox WHERE claimed_by = ? AND claimed_until = ? ORDER BY id", (node_name, now + claim_duration),
+            ).fetchall()
+        return self.run_in_write_transaction(claim)
+
+    def delete_alerts(self, alert_ids : List[int]):
+        """Remove sent alerts from the outbox."""
+        self.run_in_write_transaction(
+            lambda conn : conn.executemany("DELETE FROM alert_outbox WHERE id = ?", [(alert_id,) for alert_id in alert_ids])
+        )
+
+    def postpone_alerts(self, alert_ids : List[int], delay : float):
+        """Postpone the next attempt to send some alerts by delay seconds, and count the failed attempt."""
+        self.run_in_write_transaction(
+            lambda conn : conn.executemany(
+                "UPDATE alert_outbox SET attempts = attempts + 1, next_attempt_at = ?, claimed_by = NULL, claimed_until = NULL WHERE id = ?", 
+                [(time() + delay, alert_id) for alert_id in alert_ids],
+            )
+        )
+
+    def heartbeat_node(self, node_name : str, instance : str, heartbeat_at : float, since : float) -> Optional[str]:
+        """Record that a node sharing the database is alive, unless its name is held by another instance whose last heartbeat is more recent than since.
+
+        Args:
+            node_name (str): the name of the node
+            instance (str): the identifier of the process running the node
+            heartbeat_at (float): the time of the heartbeat, as a timestamp
+            since (float): the time before which the heartbeats of the other instances are expired
+
+        Returns:
+            Optional[str]: the other instance holding the name, in which case nothing is recorded, or None
+        """
+        def heartbeat(conn : sqlite3.Connection) -> Optional[str]:
+            row = conn.execute("SELECT instance, heartbeat_at FROM node_heartbeats WHERE node = ?", (node_name,)).fetchone()
+            if row is not None and row[0] is not None and row[0] != instance and row[1] >= since:
+                return row[0]
+            conn.execute("INSERT OR REPLACE INTO node_heartbeats (node, heartbeat_at, instance) VALUES (?, ?, ?)", (node_name, heartbeat_at, instance))
+            return None
+        return self.run_in_write_transaction(heartbeat)
+
+    def get_live_nodes(self, since : float) -> List[str]:
+        """Get the names of the nodes whose last heartbeat is more recent than since."""
+        return [row[0] for row in self.read("SELECT node FROM node_heartbeats WHERE heartbeat_at >= ? ORDER BY node", (since,))]
+
+    def remove_node(self, node_name : str, instance : str):
+        """Forget the heartbeats of a node that stopped, if its name is still held by this instance."""
+        self.write("DELETE FROM node_heartbeats WHERE node = ? AND instance = ?", (node_name, instance))
+
+    def get_outbox_depth(self) -> int:
+        """Get the number of alerts waiting in the outbox."""
+        return self.read("SELECT COUNT(*) FROM alert_outbox")[0][0]
+
+    def add_check_history(self, rows : List[Tuple[str, str, float, Optional[int], Optional[str], float, Optional[str]]]):
+        """Append checks to the check history, in a single transaction.
+
+        Args:
+            rows (List[Tuple]): the checks, as (ticket_url, site, checked_at, verdict, fetch_path, latency, error_class)
+        """
+        self.run_in_write_transaction(
+            lambda conn : conn.executemany(
+                "INSERT INTO check_history (ticket_url, site, checked_at, verdict, fetch_path, latency, error_class) VALUES (?, ?, ?, ?, ?, ?, ?)", rows,
+            )
+        )
+
+    def downsample_check_history(self, retention : float, rollup_retention : float):
+        """Downsample the checks older than retention seconds into rollups per site and per hour, and delete the rollups older than rollup_retention seconds.
+        Only whole hours are downsampled, so that each hour is rolled up at once.
+
+        Args:
+            retention (float): the time during which each check is kept, in seconds
+            rollup_retention (float): the time during which the hourly rollups are kept, in seconds
+        """
+        now = time()
+        cutoff = (now - retention) // 3600 * 3600
+        def downsample(conn : sqlite3.Connection):
+            checks : Dict[Tuple[str, int], List[tuple]] = {}
+            for site, checked_at, verdict, latency in conn.execute(
+                "SELECT site, checked_at, verdict, latency FROM check_history WHERE checked_at < ?", (cutoff,)
+            ):
+                checks.setdefault((site, int(checked_at // 3600 * 3600)), []).append((verdict, latency))
+            for (site, hour), hour_checks in checks.items():
+                latencies = [latency for _, latency in hour_checks]
+                conn.execute(
+                    # If checks of this hour were already rolled up (e.g. checks recorded late), the rollups are merged
+                    """INSERT INTO check_history_hourly (site, hour, n_checks, n_soldout, n_errors, latency_p50, latency_p95) VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (site, hour) DO UPDATE SET 
+                    latency_p50 = (latency_p50 * n_checks + excluded.latency_p50 * excluded.n_checks) / (n_checks + excluded.n_checks),
+                    latency_p95 = (latency_p95 * n_checks + excluded.latency_p95 * excluded.n_checks) / (n_checks + excluded.n_checks),
+                    n_checks = n_checks + excluded.n_checks, n_soldout = n_soldout + excluded.n_soldout, n_errors = n_errors + excluded.n_errors""",
+                    (
+                        site, hour, len(hour_checks), 
+                        sum(verdict == 1 for verdict, _ in hour_checks), sum(verdict is None for verdict, _ in hour_checks),
+                        get_percentile(latencies, 50), get_percentile(latencies, 95),
+                    ),
+                )
+            conn.execute("DELETE FROM check_history WHERE checked_at < ?", (cutoff,))
+            conn.execute("DELETE FROM check_history_hourly WHERE hour < ?", (now - rollup_retention,))
+        self.run_in_write_transaction(downsample)
+
+    def get_check_history(self, since : float) -> List[Tuple[str, float, Optional[str]]]:
+        """Get the checks made since a time, as (site, latency, error_class)."""
+        return self.read("SELECT site, latency, error_class FROM check_history WHERE checked_at >= ?", (since,))
+
+    def get_check_rollups(self, since : float, until : float) -> List[Tuple[str, int, int, Optional[float], Optional[float]]]:
+        """Get the hourly rollups of the checks of the hours starting between since and until, as (site, n_checks, n_errors, latency_p50, latency_p95)."""
+        return self.read(
+            "SELECT site, n_checks, n_errors, latency_p50, latency_p95 FROM check_history_hourly WHERE hour >= ? AND hour < ?", (since, until),
+        )
+
+    def add_labelled_page(self, ticket_url : str, site : str, is_available : bool, marker_keys : Set[str]) -> bool:
+        """Fold the candidate markers of a labelled page into the marker counts of its site, in a single transaction.
+        Each ticket gives at most one available page and one soldout page, so that a ticket checked many times doesn't outweigh the others.
+
+        Args:
+            ticket_url (str): the url of the ticket
+            site (str): the site of the ticket
+            is_available (bool): the label of the page
+            marker_keys (Set[str]): the keys of the candidate markers found in the page
+
+        Returns:
+            bool: True if the page was counted, False if the ticket already gave a page with this label
+        """
+        counted_column = "n_available" if is_available else "n_soldout"
+        def add(conn : sqlite3.Connection) -> bool:
+            if conn.execute(
+                "INSERT OR IGNORE INTO labelled_pages (ticket_url, label, site, labelled_at) VALUES (?, ?, ?, ?)", (ticket_url, int(is_available), site, time()),
+            ).rowcount == 0:
+                return False
+            conn.execute("INSERT OR IGNORE INTO labelled_page_counts (site) VALUES (?)", (site,))
+            conn.execute(f"UPDATE labelled_page_counts SET {counted_column} = {counted_column} + 1 WHERE site = ?", (site,))
+            conn.executemany(
+                f"""INSERT INTO marker_counts (site, marker, {counted_column}) VALUES (?, ?, 1)
+                ON CONFLICT (site, marker) DO UPDATE SET {counted_column} = {counted_column} + 1""",
+                [(site, marker_key) for marker_key in marker_keys],
+            )
+            return True
+        return self.run_in_write_transaction(add)
+
+    def is_page_labelled(self, ticket_url : str, is_available : bool) -> bool:
+        """Return True if the ticket already gave a page with this label."""
+        return len(self.read("SELECT 1 FROM labelled_pages WHERE ticket_url = ? AND label = ?", (ticket_url, int(is_available)))) > 0
+
+    def get_labelled_page_counts(self, site : str) -> Tuple[int, int]:
+        """Get the number of labelled pages of a site, as (n_available, n_soldout)."""
+        rows = self.read("SELECT n_available, n_soldout FROM labelled_page_counts WHERE site = ?", (site,))
+        return tuple(rows[0]) if len(rows) > 0 else (0, 0)
+
+    def get_marker_counts(self, site : str) -> List[Tuple[str, int, int]]:
+        """Get the candidate markers of a site, as (marker key, number of available pages containing it, number of soldout pages containing it)."""
+        return self.read("SELECT marker, n_available, n_soldout FROM marker_counts WHERE site = ?", (site,))
+
+    def close(self):
+        """Commit the queued writes, stop the writer thread and close all the connections."""
+        self.write_queue.put(None)
+        self.writer_thread.join()
+        self.write_connection.close()
+        with self.read_connections_lock:
+            for conn in self.read_connections:
+                conn.close()
+            self.read_connections = []
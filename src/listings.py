@@ -0,0 +1,67 @@
+from typing import Dict, List, Set, Tuple
+
+
+
+class ListingIndex:
+    """This class knows the listing page of the watched events whose site supports listing checks, so that the main loop can group the due tickets
+    by listing and check each group with a single fetch of its listing. The listing of an event is found in its page by the check engine,
+    and persisted in the database by the main loop. It is only used from the main loop's thread.
+    """
+    def __init__(self):
+        self.ticket_to_listing : Dict[str, str] = {}
+        self.listing_to_tickets : Dict[str, Set[str]] = {}
+
+    def load(self, listing_urls : Dict[str, str]):
+        """Replace the index with the given listings, by canonical url of the events (see DBInterface.get_listing_urls)."""
+        self.ticket_to_listing = {}
+        self.listing_to_tickets = {}
+        for ticket_url, listing_url in listing_urls.items():
+            self.set(ticket_url, listing_url)
+
+    def set(self, ticket_url : str, listing_url : str) -> bool:
+        """Set the listing of an event.
+
+        Returns:
+            bool: True if the listing of the event changed, i.e. if it must be persisted
+        """
+        previous_listing_url = self.ticket_to_listing.get(ticket_url)
+        if previous_listing_url == listing_url:
+            return False
+        self.remove(ticket_url)
+        self.ticket_to_listing[ticket_url] = listing_url
+        self.listing_to_tickets.setdefault(listing_url, set()).add(ticket_url)
+        return True
+
+    def remove(self, ticket_url : str):
+        """Forget the listing of an event, e.g. because it is no longer watched."""
+        listing_url = self.ticket_to_listing.pop(ticket_url, None)
+        if listing_url is None:
+            return
+        tickets = self.listing_to_tickets[listing_url]
+        tickets.discard(ticket_url)
+        if not tickets:
+            del self.listing_to_tickets[listing_url]
+
+    def get_tickets(self, listing_url : str) -> Set[str]:
+        """Get the events of a listing."""
+        return set(self.listing_to_tickets.get(listing_url, ()))
+
+    def group(self, ticket_urls : List[str]) -> Tuple[Dict[str, List[str]], List[str]]:
+        """Group tickets by listing. A listing is only worth fetching if it has several watched events : the tickets of the listings with
+        a single event, and the tickets whose listing is unknown, are checked on their own page.
+
+        Args:
+            ticket_urls (List[str]): the canonical urls of the tickets
+
+        Returns:
+            Tuple[Dict[str, List[str]], List[str]]: the tickets by listing url, and the tickets to check on their own page
+        """
+        listing_groups : Dict[str, List[str]] = {}
+        single_ticket_urls = []
+        for ticket_url in ticket_urls:
+            listing_url = self.ticket_to_listing.get(ticket_url)
+            if listing_url is None or len(self.listing_to_tickets[listing_url]) < 2:
+                single_ticket_urls.append(ticket_url)
+            else:
+                listing_groups.setdefault(listing_url, []).append(ticket_url)
+        return listing_groups, single_ticket_urls
@@ -0,0 +1,130 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import math
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+# Kinds of metrics, as named in the Prometheus text format
+METRIC_GAUGE = "gauge"
+METRIC_COUNTER = "counter"
+METRIC_SUMMARY = "summary"
+
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+
+class Metric:
+    """A metric and its current samples, each sample being a value with labels (and an optional suffix of the name, e.g. "_sum" for summaries).
+
+    Args:
+        name (str): the name of the metric
+        kind (str): METRIC_GAUGE, METRIC_COUNTER or METRIC_SUMMARY
+        description (str): the help text of the metric
+    """
+    def __init__(self, name : str, kind : str, description : str):
+        self.name = name
+        self.kind = kind
+        self.description = description
+        self.samples : List[Tuple[str, Dict[str, str], float]] = []
+
+    def add(self, value : float, labels : Optional[Dict[str, str]] = None, suffix : str = "") -> "Metric":
+        self.samples.append((suffix, labels or {}, value))
+        return self
+
+
+
+def escape_label_value(value : str) -> str:
+    """Escape the backslashes, double quotes and line feeds of a label value."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_value(value : float) -> str:
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+def format_metrics(metrics : List[Metric]) -> str:
+    """Format metrics in the Prometheus text exposition format.
+
+    Args:
+        metrics (List[Metric]): the metrics
+
+    Returns:
+        str: the text to serve to the scraper
+    """
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for suffix, labels, value in metric.samples:
+            labels_text = ",".join(f'{name}="{escape_label_value(label)}"' for name, label in labels.items())
+            labels_text = "{" + labels_text + "}" if labels_text else ""
+            lines.append(f"{metric.name}{suffix}{labels_text} {format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+
+class MetricsExporter:
+    """An HTTP endpoint serving metrics in the Prometheus text format on http://host:port/metrics, from a background thread.
+    The metrics are collected only when the endpoint is scraped, by calling collect_metrics, so the exporter costs nothing between scrapes,
+    and nothing at all if it is not started (port 0).
+
+    Args:
+        collect_metrics (Callable[[], List[Metric]]): the function collecting the current metrics
+        host (str, optional): the interface to listen on. Defaults to "127.0.0.1" (local only).
+    """
+    def __init__(self, collect_metrics : Callable[[], List[Metric]], host : str = "127.0.0.1"):
+        self.collect_metrics = collect_metrics
+        self.host = host
+        self.port = 0
+        self.server : Optional[HTTPServer] = None
+        self.thread : Optional[threading.Thread] = None
+
+    def set_port(self, port : int):
+        """Start the endpoint on a port, restarting it if it was on another port, or stop it if the port is 0."""
+        port = int(port)
+        if port == self.port:
+            return
+        self.stop()
+        self.port = port
+        if port == 0:
+            return
+        exporter = self
+
+        class MetricsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                try:
+                    body = format_metrics(exporter.collect_metrics()).encode("utf-8")
+                except Exception as e:
+                    self.send_error(500, str(e))
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", METRICS_CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # don't print each scrape
+
+        # Requests are served one at a time, by a single thread
+        self.server = HTTPServer((self.host, port), MetricsRequestHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name="metrics_exporter", daemon=True)
+        self.thread.start()
+        print(f"Metrics are served on http://{self.host}:{port}/metrics")
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = None
+            self.thread = None
+        self.port = 0
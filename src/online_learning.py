@@ -0,0 +1,210 @@
+from collections import OrderedDict, deque
+import threading
+from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+from src.check_engine import CheckResult
+from src.discriminators import get_marker_key
+from src.html_matching import Marker, MARKER_TEXT
+from src.interface_database import DBInterface
+
+
+MAX_PENDING_PAGES = 10000  # the number of tickets whose last candidate markers are kept in memory, to be labelled with /label
+N_SUGGESTIONS = 5          # the number of markers suggested when the markers of a detector seem broken
+
+
+
+class MarkerScore:
+    """The score of a candidate marker of a site, learned from the labelled pages : the presence of the marker predicts that a page is available,
+    or, if is_inverted, that it is soldout. The balanced accuracy is the mean of the ratios of available and soldout pages correctly predicted,
+    so that a marker present in all the pages scores 0.5 however unbalanced the labelled pages are.
+    """
+    def __init__(self, marker_key : str, n_available : int, n_soldout : int, n_available_pages : int, n_soldout_pages : int):
+        self.marker_key = marker_key
+        self.n_available = n_available
+        self.n_soldout = n_soldout
+        available_ratio = n_available / n_available_pages if n_available_pages > 0 else 0.0
+        soldout_ratio = n_soldout / n_soldout_pages if n_soldout_pages > 0 else 0.0
+        self.is_inverted = soldout_ratio > available_ratio
+        self.balanced_accuracy = 0.5 + abs(available_ratio - soldout_ratio) / 2
+
+    def predicts_available(self, marker_keys : Set[str]) -> bool:
+        """Get the verdict predicted by the marker on a page, from the candidate markers of the page."""
+        return (self.marker_key in marker_keys) != self.is_inverted
+
+    def __repr__(self) -> str:
+        polarity = "soldout" if self.is_inverted else "available"
+        return f"{self.marker_key} ({polarity} if present, balanced accuracy {self.balanced_accuracy:.1%}, in {self.n_available} available and {self.n_soldout} soldout pages)"
+
+
+
+class OnlineMarkerLearner:
+    """This class folds the pages fetched by the checks into per-site counts of candidate markers persisted in the database, so that broken
+    markers are caught without an offline crawl (see find_discriminator.py for the offline version) :
+    - the verdict of the detector alone never labels a page, otherwise broken markers would teach the learner their own mistakes.
+      The last page of each ticket is kept pending, and is labelled by the user with label(), e.g. after a wrong sold out alert.
+      Each ticket gives at most one available and one soldout page.
+    - once a site has min_pages labelled pages of each kind, its best candidate marker other than the markers of its detector becomes its reference marker.
+    - each check is compared with the verdict of the reference marker. The pages on which they agree are labelled, since two independent markers
+      confirm their verdict. If less than min_agreement of the last min_pages checks of a site agree, or if the markers of the detector score less
+      than min_accuracy on the labelled pages, the markers are reported as possibly broken, once until they agree again, and are_markers_suspect()
+      is True for the site until then, so that its sold out verdicts are not acted upon.
+    observe() and are_markers_suspect() are called from the main loop's thread, label() and get_report() from the commands.
+    """
+    def __init__(self, db_interface : DBInterface, min_pages : int = 20, min_accuracy : float = 0.9, min_agreement : float = 0.8):
+        self.db_interface = db_interface
+        self.lock = threading.Lock()
+        self.pending_pages : "OrderedDict[str, Tuple[str, Set[str]]]" = OrderedDict()
+        # The reference marker and the balanced accuracy of the markers of the detector of each site, updated when pages are labelled
+        self.reference_markers : Dict[str, Optional[MarkerScore]] = {}
+        self.detector_accuracies : Dict[str, Optional[float]] = {}
+        self.recent_agreements : Dict[str, Deque[bool]] = {}
+        self.reported_sites : Set[str] = set()
+        self.set_limits(min_pages, min_accuracy, min_agreement)
+
+    def set_limits(self, min_pages : int, min_accuracy : float, min_agreement : float):
+        """Change the limits of the validation. The reference markers are chosen again at the next check of each site."""
+        with self.lock:
+            self.min_pages = max(1, int(min_pages))
+            self.min_accuracy = min_accuracy
+            self.min_agreement = min_agreement
+            self.reference_markers = {}
+            self.detector_accuracies = {}
+            self.recent_agreements = {site : deque(agreements, maxlen=self.min_pages) for site, agreements in self.recent_agreements.items()}
+
+    def get_marker_scores(self, site : str) -> List[MarkerScore]:
+        """Get the scores of all the candidate markers of a site, the best first."""
+        n_available_pages, n_soldout_pages = self.db_interface.get_labelled_page_counts(site)
+        marker_scores = [
+            MarkerScore(marker_key, n_available, n_soldout, n_available_pages, n_soldout_pages)
+            for marker_key, n_available, n_soldout in self.db_interface.get_marker_counts(site)
+        ]
+        return sorted(marker_scores, key=lambda marker_score: (-marker_score.balanced_accuracy, marker_score.marker_key))
+
+    def update_site(self, site : str, detector_markers : Iterable[Marker]):
+        """Choose the reference marker of a site, i.e. its best candidate marker other than the markers of its detector, and score the markers
+        of its detector. Nothing is chosen nor scored if it has less than min_pages labelled pages of each kind. The caller must hold the lock."""
+        previous_reference_marker = self.reference_markers.get(site)
+        self.reference_markers[site] = None
+        self.detector_accuracies[site] = None
+        if min(self.db_interface.get_labelled_page_counts(site)) < self.min_pages:
+            return
+        marker_scores = self.get_marker_scores(site)
+        detector_marker_keys = {get_marker_key(marker) for marker in detector_markers if marker.kind != MARKER_TEXT}
+        for marker_score in marker_scores:
+            if marker_score.marker_key not in detector_marker_keys:
+                if marker_score.balanced_accuracy >= self.min_accuracy:
+                    self.reference_markers[site] = marker_score
+                break
+        # The recent checks were compared with the previous reference marker
+        if previous_reference_marker is not None and (
+            self.reference_markers[site] is None or self.reference_markers[site].marker_key != previous_reference_marker.marker_key
+        ):
+            self.recent_agreements.pop(site, None)
+        # The markers of the detectors mean that the event is available : a marker more present in soldout pages has the complementary accuracy,
+        # and markers in none of the labelled pages predict that all the pages are soldout
+        self.detector_accuracies[site] = max(
+            [
+                1 - marker_score.balanced_accuracy if marker_score.is_inverted else marker_score.balanced_accuracy
+                for marker_score in marker_scores if marker_score.marker_key in detector_marker_keys
+            ],
+            default=0.5,
+        )
+
+    def observe(self, check_result : CheckResult, detector_markers : List[Marker]) -> Optional[str]:
+        """Keep the page of a check to be labelled, fold it into the marker counts of its site if the reference marker confirms its verdict,
+        and validate the markers of its detector. It must be called before acting on the verdict of the check.
+
+        Args:
+            check_result (CheckResult): the result of the check, whose marker_candidates were collected by the check engine
+            detector_markers (List[Marker]): the markers of the detector of the site, whose presence means that the event is available
+
+        Returns:
+            Optional[str]: the message reporting that the markers of the detector may be broken, or None
+        """
+        if check_result.error is not None or check_result.marker_candidates is None or check_result.site is None:
+            return None
+        site, marker_keys = check_result.site, check_result.marker_candidates
+        is_available = not check_result.is_soldout
+        with self.lock:
+            self.pending_pages[check_result.url] = (site, marker_keys)
+            self.pending_pages.move_to_end(check_result.url)
+            while len(self.pending_pages) > MAX_PENDING_PAGES:
+                self.pending_pages.popitem(last=False)
+
+            if site not in self.reference_markers:
+                self.update_site(site, detector_markers)
+            reference_marker = self.reference_markers[site]
+            if reference_marker is not None:
+                is_agreeing = reference_marker.predicts_available(marker_keys) == is_available
+                self.recent_agreements.setdefault(site, deque(maxlen=self.min_pages)).append(is_agreeing)
+                if is_agreeing and self.add_page(check_result.url, site, is_available, marker_keys):
+                    self.update_site(site, detector_markers)
+            return self.validate(site)
+
+    def are_markers_suspect(self, site : str) -> bool:
+        """Return True if the markers of the detector of a site were reported as possibly broken by the last validation of the site."""
+        with self.lock:
+            return site in self.reported_sites
+
+    def label(self, ticket_url : str, is_available : bool) -> bool:
+        """Fold the last page of a ticket into the marker counts of its site with a label given by the user.
+        The reference marker of the site is chosen again at its next check.
+
+        Returns:
+            bool: False if no page of the ticket was checked since the bot started with online learning enabled
+        """
+        with self.lock:
+            if ticket_url not in self.pending_pages:
+                return False
+            site, marker_keys = self.pending_pages[ticket_url]
+            if self.add_page(ticket_url, site, is_available, marker_keys):
+                self.reference_markers.pop(site, None)
+            return True
+
+    def add_page(self, ticket_url : str, site : str, is_available : bool, marker_keys : Set[str]) -> bool:
+        # Most checks are of tickets which already gave a page with the same label : they are discarded without a write
+        if self.db_interface.is_page_labelled(ticket_url, is_available):
+            return False
+        return self.db_interface.add_labelled_page(ticket_url, site, is_available, marker_keys)
+
+    def validate(self, site : str) -> Optional[str]:
+        """Check the markers of the detector of a site against the recent checks and the labelled pages, and get a message if they seem broken
+        (only the first time, until they are valid again). The caller must hold the lock."""
+        problems = []
+        reference_marker = self.reference_markers.get(site)
+        agreements = self.recent_agreements.get(site, ())
+        if reference_marker is not None and len(agreements) == self.min_pages and sum(agreements) < self.min_agreement * len(agreements):
+            problems.append(f"only {sum(agreements)} of its last {len(agreements)} checks agree with the learned marker {reference_marker.marker_key}")
+        detector_accuracy = self.detector_accuracies.get(site)
+        if detector_accuracy is not None and detector_accuracy < self.min_accuracy:
+            problems.append(f"its markers have a balanced accuracy of {detector_accuracy:.1%} on the labelled pages")
+        if len(problems) == 0:
+            self.reported_sites.discard(site)
+            return None
+        if site in self.reported_sites:
+            return None
+        self.reported_sites.add(site)
+        suggestions = ", ".join(marker_score.marker_key for marker_score in self.get_marker_scores(site)[:N_SUGGESTIONS])
+        return f"Warning : the markers of site {site} may be broken : {' and '.join(problems)}. Suggested markers : {suggestions}."
+
+    def get_report(self, site : str, detector_markers : List[Marker], n_suggestions : int = N_SUGGESTIONS) -> str:
+        """Get a (user destined) report of the markers of a site : the number of labelled pages, the scores of the markers of its detector,
+        its reference marker and the best candidate markers."""
+        n_available_pages, n_soldout_pages = self.db_interface.get_labelled_page_counts(site)
+        marker_scores = self.get_marker_scores(site)
+        marker_key_to_score = {marker_score.marker_key : marker_score for marker_score in marker_scores}
+        report = f"Site {site}: {n_available_pages} available and {n_soldout_pages} soldout pages labelled.\n"
+        report += "Markers of the detector:\n"
+        for marker in detector_markers:
+            marker_key = get_marker_key(marker)
+            marker_score = marker_key_to_score.get(marker_key)
+            report += f"- {marker_score if marker_score is not None else marker_key + ' (not in the labelled pages)'}\n"
+        with self.lock:
+            reference_marker = self.reference_markers.get(site)
+            agreements = list(self.recent_agreements.get(site, ()))
+        if reference_marker is not None:
+            report += f"Reference marker: {reference_marker.marker_key}, agreeing with {sum(agreements)} of the last {len(agreements)} checks.\n"
+        report += "Best candidate markers:\n"
+        for marker_score in marker_scores[:n_suggestions]:
+            report += f"- {marker_score}\n"
+        return report
@@ -0,0 +1,154 @@
+from collections import OrderedDict
+import hashlib
+import re
+import threading
+from time import time
+from typing import Dict, Optional
+
+
+
+# Parts of a page that change at every fetch without the page really changing : scripts and styles (inline timestamps, nonces...),
+# form values and meta contents (CSRF tokens), nonce attributes, ISO timestamps and epoch timestamps in milliseconds or seconds.
+VOLATILE_CONTENT_PATTERN = re.compile(
+    r'<script\b.*?</script>|<style\b.*?</style>|\b(?:value|content|nonce)="[^"]*"'
+    r'|\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:\.\d+)?(?:Z|[+-]\d{2}:?\d{2})?|\b\d{10}(?:\d{3})?\b',
+    re.DOTALL | re.IGNORECASE,
+)
+
+def get_content_hash(page_source : str) -> str:
+    """Get a hash of the normalized content of a page : volatile tokens (CSRF values, timestamps, scripts...) are stripped before hashing,
+    so that two fetches of an unchanged page have the same hash.
+
+    Args:
+        page_source (str): the HTML of the page
+
+    Returns:
+        str: the hexadecimal hash of the page content
+    """
+    content = VOLATILE_CONTENT_PATTERN.sub("", page_source)
+    return hashlib.sha1(content.encode("utf-8", errors="ignore")).hexdigest()
+
+
+
+class PageCacheEntry:
+    """What is remembered about the last fetch of an url : the hash of its content, the verdict of the detector on it,
+    the HTTP validators (ETag, Last-Modified) sent by the server, and the time the verdict was given by the browser if it was
+    (for the sites whose markers are rendered by scripts, the verdict is given on the rendered page but the hash is the one of the server-rendered HTML)."""
+    def __init__(self, content_hash : str, is_soldout : bool, rendered_at : Optional[float] = None):
+        self.content_hash = content_hash
+        self.is_soldout = is_soldout
+        self.rendered_at = rendered_at
+        self.etag : Optional[str] = None
+        self.last_modified : Optional[str] = None
+
+    def is_usable(self, max_render_age : Optional[float]) -> bool:
+        """Return True if the verdict can be reused : always if max_render_age is None, otherwise only if it was given by the browser less than max_render_age seconds ago."""
+        return max_render_age is None or (self.rendered_at is not None and time() - self.rendered_at <= max_render_age)
+
+
+
+class PageCache:
+    """A per-url cache of the last verdict of the detectors. A page whose normalized content didn't change since the last check
+    gets the same verdict without being parsed again, and a page that the server reports as not modified (HTTP 304) isn't even downloaded.
+    The cache keeps the max_entries most recently used urls. Hits, misses and not modified responses are counted.
+    """
+    def __init__(self, max_entries : int = 10000):
+        self.max_entries = max_entries
+        self.entries : "OrderedDict[str, PageCacheEntry]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.n_hits = 0
+        self.n_misses = 0
+        self.n_not_modified = 0
+
+    def lookup(self, url : str, content_hash : str, max_render_age : Optional[float] = None) -> Optional[bool]:
+        """Get the cached verdict of a page if its content didn't change, and count a hit or a miss.
+
+        Args:
+            url (str): the url of the page
+            content_hash (str): the hash of the content of the page, as given by get_content_hash()
+            max_render_age (Optional[float], optional): if given, only a verdict given by the browser less than max_render_age seconds ago is used.
+                Defaults to None.
+
+        Returns:
+            Optional[bool]: whether the event is soldout, or None if the page is not in the cache, changed, or its verdict is too old
+        """
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is not None and entry.content_hash == content_hash and entry.is_usable(max_render_age):
+                self.entries.move_to_end(url)
+                self.n_hits += 1
+                return entry.is_soldout
+            self.n_misses += 1
+            return None
+
+    def store(self, url : str, content_hash : str, is_soldout : bool, rendered_at : Optional[float] = None):
+        """Remember the verdict of a page, forgetting its previous HTTP validators. rendered_at is the time the verdict was given by the browser, if it was."""
+        with self.lock:
+            self.entries[url] = PageCacheEntry(content_hash, is_soldout, rendered_at)
+            self.entries.move_to_end(url)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def store_validators(self, url : str, etag : Optional[str], last_modified : Optional[str]):
+        """Remember the HTTP validators of a page, so that the next fetch can be a conditional request. The page must have been stored first."""
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is not None:
+                entry.etag = etag
+                entry.last_modified = last_modified
+
+    def get_conditional_headers(self, url : str) -> Dict[str, str]:
+        """Get the headers making the next fetch of a page conditional (If-None-Match, If-Modified-Since), if its validators are known.
+
+        Args:
+            url (str): the url of the page
+
+        Returns:
+            Dict[str, str]: the headers to add to the request, possibly empty
+        """
+        headers = {}
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is not None:
+                if entry.etag is not None:
+                    headers["If-None-Match"] = entry.etag
+                if entry.last_modified is not None:
+                    headers["If-Modified-Since"] = entry.last_modified
+        return headers
+
+    def get_content_hash(self, url : str) -> Optional[str]:
+        """Get the hash of the content of a page at its last fetch, or None if it is not in the cache."""
+        with self.lock:
+            entry = self.entries.get(url)
+            return entry.content_hash if entry is not None else None
+
+    def get_not_modified_verdict(self, url : str, max_render_age : Optional[float] = None) -> Optional[bool]:
+        """Get the verdict of a page that the server reported as not modified, and count it.
+
+        Args:
+            url (str): the url of the page
+            max_render_age (Optional[float], optional): if given, only a verdict given by the browser less than max_render_age seconds ago is used.
+                Defaults to None.
+
+        Returns:
+            Optional[bool]: whether the event is soldout, or None if the page is not in the cache or its verdict is too old
+        """
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is None or not entry.is_usable(max_render_age):
+                return None
+            self.entries.move_to_end(url)
+            self.n_not_modified += 1
+            return entry.is_soldout
+
+    def get_stats(self) -> Dict[str, float]:
+        """Get the counters of the cache : hits, misses, not modified responses, and the ratio of checks that didn't need parsing."""
+        with self.lock:
+            n_lookups = self.n_hits + self.n_misses + self.n_not_modified
+            return {
+                "entries" : len(self.entries),
+                "hits" : self.n_hits,
+                "misses" : self.n_misses,
+                "not_modified" : self.n_not_modified,
+                "hit_ratio" : (self.n_hits + self.n_not_modified) / n_lookups if n_lookups > 0 else 0.0,
+            }
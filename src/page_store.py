@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import threading
+from time import time
+from typing import Dict, Optional
+
+
+INDEX_FILE_NAME = "index.json"
+OBJECTS_DIRECTORY_NAME = "objects"
+
+
+
+class PageStore:
+    """An on-disk, content-addressed store of fetched pages : each page is saved once in objects/<sha1 of the page>.html, 
+    and index.json maps each url to the hash of its last fetched page and the time it was fetched. 
+    Identical pages fetched from several urls are stored once, and a page older than ttl seconds is considered stale.
+
+    Usage :
+        page_store = PageStore("data/page_cache", ttl=86400)
+        page_source = page_store.get(url)  # None if the url was never fetched or is stale
+        if page_source is None:
+            page_store.put(url, fetch(url))
+        page_store.save()
+    """
+    def __init__(self, directory : str, ttl : Optional[float] = None):
+        self.directory = directory
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        os.makedirs(os.path.join(directory, OBJECTS_DIRECTORY_NAME), exist_ok=True)
+        self.index : Dict[str, dict] = {}
+        index_path = os.path.join(directory, INDEX_FILE_NAME)
+        if os.path.exists(index_path):
+            with open(index_path, "r", encoding="utf-8") as f:
+                self.index = json.load(f)
+
+    def get_object_path(self, content_hash : str) -> str:
+        return os.path.join(self.directory, OBJECTS_DIRECTORY_NAME, f"{content_hash}.html")
+
+    def is_stored(self, url : str) -> bool:
+        """Return True if a page of the url is in the store, fresh or stale."""
+        with self.lock:
+            entry = self.index.get(url)
+        return entry is not None and os.path.exists(self.get_object_path(entry["hash"]))
+
+    def is_fresh(self, url : str) -> bool:
+        """Return True if the url was fetched less than ttl seconds ago (or at any time, if there is no ttl) and its page is in the store."""
+        if not self.is_stored(url):
+            return False
+        with self.lock:
+            entry = self.index[url]
+        return self.ttl is None or time() - entry["fetched_at"] < self.ttl
+
+    def get(self, url : str, allow_stale : bool = False) -> Optional[str]:
+        """Get the last fetched page of an url.
+
+        Args:
+            url (str): the url of the page
+            allow_stale (bool, optional): whether to return the page even if it is older than the ttl. Defaults to False.
+
+        Returns:
+            Optional[str]: the HTML of the page, or None if it was never fetched (or is stale)
+        """
+        if not allow_stale and not self.is_fresh(url):
+            return None
+        with self.lock:
+            entry = self.index.get(url)
+        if entry is None:
+            return None
+        try:
+            with open(self.get_object_path(entry["hash"]), "r", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, url : str, page_source : str) -> str:
+        """Save the page of an url, and return its hash. The index is only written to disk by save().
+
+        Args:
+            url (str): the url of the page
+            page_source (str): the HTML of the page
+
+        Returns:
+            str: the hash of the page
+        """
+        content = page_source.encode("utf-8")
+        content_hash = hashlib.sha1(content).hexdigest()
+        object_path = self.get_object_path(content_hash)
+        if not os.path.exists(object_path):
+            # Write to a temporary file first, so that a page is never partially written
+            temporary_path = f"{object_path}.{threading.get_ident()}.tmp"
+            with open(temporary_path, "wb") as f:
+                f.write(content)
+            os.replace(temporary_path, object_path)
+        with self.lock:
+            self.index[url] = {"hash" : content_hash, "fetched_at" : time()}
+        return content_hash
+
+    def save(self):
+        """Write the index to disk."""
+        with self.lock:
+            index = dict(self.index)
+        index_path = os.path.join(self.directory, INDEX_FILE_NAME)
+        temporary_path = f"{index_path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump(index, f, indent=1)
+        os.replace(temporary_path, index_path)
@@ -0,0 +1,159 @@
+from contextlib import contextmanager
+import cProfile
+import pstats
+import threading
+from time import perf_counter, strftime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+# Upper bounds of the buckets of the histograms, in seconds : 0.1ms, 0.2ms, 0.4ms... up to about 3.7 hours
+HISTOGRAM_BUCKETS : List[float] = [0.0001 * 2 ** k for k in range(28)]
+
+
+
+class StageHistogram:
+    """The durations of a stage, as an histogram with exponential buckets, along with their count, sum and maximum."""
+    def __init__(self):
+        self.bucket_counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, duration : float):
+        index = 0
+        while index < len(HISTOGRAM_BUCKETS) and duration > HISTOGRAM_BUCKETS[index]:
+            index += 1
+        self.bucket_counts[index] += 1
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+
+    def get_mean(self) -> float:
+        return self.total / self.count if self.count > 0 else 0.0
+
+    def get_percentile(self, q : float) -> float:
+        """Get an upper bound of the q-th percentile of the durations : the upper bound of the bucket containing it (or the maximum duration, if lower)."""
+        rank = q / 100 * self.count
+        cumulated_count = 0
+        for index, bucket_count in enumerate(self.bucket_counts):
+            cumulated_count += bucket_count
+            if cumulated_count >= rank and cumulated_count > 0:
+                return min(HISTOGRAM_BUCKETS[index], self.max) if index < len(HISTOGRAM_BUCKETS) else self.max
+        return 0.0
+
+
+
+class Profiler:
+    """Lightweight timing instrumentation : the code measures its stages (page load, page source, parsing, database, Telegram...) with measure(),
+    and the durations are gathered in an in-memory histogram per stage. Measuring costs two perf_counter() calls and a lock, and nothing if disabled.
+
+    The profiler can also sample a number of the next checks with cProfile (one check at a time, as cProfile only profiles the thread it runs in)
+    and dump the merged statistics to a file, which can be read with pstats, or turned into a flamegraph with tools like flameprof or snakeviz.
+
+    Usage :
+        with profiler.measure("driver.get"):
+            driver.get(url)
+    """
+    def __init__(self, enabled : bool = True):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.histograms : Dict[str, StageHistogram] = {}
+        # cProfile sampling
+        self.n_checks_to_sample = 0
+        self.is_sampling_check = False
+        self.sample_stats : Optional[pstats.Stats] = None
+        self.sample_path : Optional[str] = None
+        self.last_sample_path : Optional[str] = None
+
+    @contextmanager
+    def measure(self, stage : str) -> Iterator[None]:
+        """Measure the duration of the code run inside the context, as a stage."""
+        if not self.enabled:
+            yield
+            return
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, perf_counter() - start)
+
+    def record(self, stage : str, duration : float):
+        """Record a duration of a stage, in seconds."""
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = StageHistogram()
+            histogram.add(duration)
+
+    def get_hottest_stages(self, n_stages : Optional[int] = None) -> List[Tuple[str, StageHistogram]]:
+        """Get the stages which took the most time in total, with their histograms, the hottest first.
+
+        Args:
+            n_stages (Optional[int], optional): the maximum number of stages. Defaults to None (all the stages).
+
+        Returns:
+            List[Tuple[str, StageHistogram]]: the stages and their histograms
+        """
+        with self.lock:
+            stages = sorted(self.histograms.items(), key=lambda item: item[1].total, reverse=True)
+        return stages[:n_stages] if n_stages is not None else stages
+
+    def reset(self):
+        """Forget all the recorded durations."""
+        with self.lock:
+            self.histograms = {}
+
+    def request_sampling(self, n_checks : int, path : Optional[str] = None) -> str:
+        """Sample the next n_checks checks with cProfile. Their merged statistics are dumped to path once they are all done.
+
+        Args:
+            n_checks (int): the number of checks to sample, e.g. the number of tickets for a whole pass
+            path (Optional[str], optional): the file to dump the statistics to. Defaults to None (profile_<date>.prof).
+
+        Returns:
+            str: the path of the file
+        """
+        with self.lock:
+            self.n_checks_to_sample = max(1, n_checks)
+            self.sample_stats = None
+            self.sample_path = path if path is not None else f"profile_{strftime('%Y%m%d_%H%M%S')}.prof"
+            return self.sample_path
+
+    def is_sampling(self) -> bool:
+        with self.lock:
+            return self.n_checks_to_sample > 0
+
+    @contextmanager
+    def sample_check(self) -> Iterator[None]:
+        """Profile the check run inside the context with cProfile, if sampling was requested and no other check is being sampled."""
+        with self.lock:
+            profile = None
+            if self.n_checks_to_sample > 0 and not self.is_sampling_check:
+                self.is_sampling_check = True
+                profile = cProfile.Profile()
+        if profile is None:
+            yield
+            return
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            with self.lock:
+                if self.sample_stats is None:
+                    self.sample_stats = pstats.Stats(profile)
+                else:
+                    self.sample_stats.add(profile)
+                self.is_sampling_check = False
+                self.n_checks_to_sample -= 1
+                if self.n_checks_to_sample == 0:
+                    self.sample_stats.dump_stats(self.sample_path)
+                    self.last_sample_path = self.sample_path
+                    self.sample_stats = None
+
+
+
+# The profiler of the program, used by all the modules
+profiler = Profiler()
@@ -0,0 +1,163 @@
+import random
+import threading
+from time import monotonic
+from typing import Dict, List, Optional
+
+
+# States of the circuit breaker of a domain
+CIRCUIT_CLOSED = "closed"         # requests are allowed
+CIRCUIT_OPEN = "open"             # the domain is paused after too many consecutive failures
+CIRCUIT_HALF_OPEN = "half_open"   # the pause is over, one trial request is allowed
+
+
+
+class TokenBucket:
+    """A token bucket : rate tokens are added per second, up to capacity, and each request consumes one token."""
+    def __init__(self, rate : float, capacity : float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_update = monotonic()
+
+    def reserve(self, now : float) -> float:
+        """Consume a token if one is available and return 0, otherwise return the time to wait for one, in seconds."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_update) * self.rate)
+        self.last_update = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+
+class DomainState:
+    """The rate limiting state of a domain."""
+    def __init__(self, bucket : TokenBucket):
+        self.bucket = bucket
+        self.n_consecutive_failures = 0
+        self.backoff_until = 0.0
+        self.circuit_state = CIRCUIT_CLOSED
+        self.circuit_open_until = 0.0
+        self.is_trial_in_flight = False
+        self.last_error : Optional[str] = None
+
+
+
+class DomainRateLimiter:
+    """This class protects the ticket sites from being hammered, per domain (i.e. per site, as named by the detectors) :
+    - each domain has a token bucket allowing rate_per_minute requests per minute, with bursts of at most burst requests,
+    - after a failure, requests to the domain are delayed by an exponential backoff with jitter (backoff_base * 2^(n-1) seconds, at most backoff_max),
+    - after failure_threshold consecutive failures, the circuit breaker of the domain opens : the domain is paused for open_duration seconds,
+      then a single trial request is made, which closes the circuit if it succeeds and reopens it otherwise.
+    Opening and closing events are returned by record_failure() and record_success(), so that they can be reported once.
+    """
+    def __init__(
+        self,
+        rate_per_minute : float = 30,
+        burst : float = 5,
+        backoff_base : float = 5,
+        backoff_max : float = 600,
+        failure_threshold : int = 5,
+        open_duration : float = 900,
+    ):
+        self.lock = threading.Lock()
+        self.domain_states : Dict[str, DomainState] = {}
+        self.set_limits(rate_per_minute, burst, backoff_base, backoff_max, failure_threshold, open_duration)
+
+    def set_limits(self, rate_per_minute : float, burst : float, backoff_base : float, backoff_max : float, failure_threshold : int, open_duration : float):
+        """Change the limits. The token buckets of the domains are updated, but their backoffs and circuits are kept.
+        Raises ValueError if rate_per_minute is not positive."""
+        if rate_per_minute <= 0:
+            raise ValueError(f"The rate limit must be positive, got {rate_per_minute} requests per minute")
+        with self.lock:
+            self.rate_per_minute = rate_per_minute
+            self.burst = max(1, burst)
+            self.backoff_base = backoff_base
+            self.backoff_max = backoff_max
+            self.failure_threshold = failure_threshold
+            self.open_duration = open_duration
+            for domain_state in self.domain_states.values():
+                domain_state.bucket.rate = rate_per_minute / 60
+                domain_state.bucket.capacity = self.burst
+
+    def get_domain_state(self, domain : str) -> DomainState:
+        """Get the state of a domain, creating it on the first call. The caller must hold the lock."""
+        domain_state = self.domain_states.get(domain)
+        if domain_state is None:
+            domain_state = DomainState(TokenBucket(self.rate_per_minute / 60, self.burst))
+            self.domain_states[domain] = domain_state
+        return domain_state
+
+    def reserve(self, domain : str) -> float:
+        """Ask for the permission to make a request to a domain. If it is granted, a token is consumed and 0 is returned,
+        otherwise the time to wait before asking again is returned.
+
+        Args:
+            domain (str): the domain of the request
+
+        Returns:
+            float: 0 if the request can be made now, otherwise the time to wait, in seconds
+        """
+        with self.lock:
+            now = monotonic()
+            domain_state = self.get_domain_state(domain)
+            if domain_state.circuit_state == CIRCUIT_OPEN:
+                if now < domain_state.circuit_open_until:
+                    return domain_state.circuit_open_until - now
+                domain_state.circuit_state = CIRCUIT_HALF_OPEN
+                domain_state.is_trial_in_flight = False
+            if domain_state.circuit_state == CIRCUIT_HALF_OPEN and domain_state.is_trial_in_flight:
+                # Wait for the result of the trial request
+                return self.backoff_base
+            if now < domain_state.backoff_until:
+                return domain_state.backoff_until - now
+            delay = domain_state.bucket.reserve(now)
+            if delay == 0 and domain_state.circuit_state == CIRCUIT_HALF_OPEN:
+                domain_state.is_trial_in_flight = True
+            return delay
+
+    def record_success(self, domain : str) -> bool:
+        """Record that a request to a domain succeeded.
+
+        Returns:
+            bool: True if this closed the circuit of the domain, i.e. if the domain was paused and is now resumed
+        """
+        with self.lock:
+            domain_state = self.get_domain_state(domain)
+            was_paused = domain_state.circuit_state != CIRCUIT_CLOSED
+            domain_state.n_consecutive_failures = 0
+            domain_state.backoff_until = 0.0
+            domain_state.circuit_state = CIRCUIT_CLOSED
+            return was_paused
+
+    def record_failure(self, domain : str, error : Optional[str] = None) -> bool:
+        """Record that a request to a domain failed, and delay the next requests to it.
+
+        Args:
+            domain (str): the domain of the request
+            error (Optional[str], optional): the description of the error. Defaults to None.
+
+        Returns:
+            bool: True if this opened the circuit of the domain, i.e. if the domain has just been paused
+        """
+        with self.lock:
+            now = monotonic()
+            domain_state = self.get_domain_state(domain)
+            domain_state.n_consecutive_failures += 1
+            domain_state.last_error = error
+            backoff = min(self.backoff_base * 2 ** (domain_state.n_consecutive_failures - 1), self.backoff_max)
+            domain_state.backoff_until = now + backoff * random.uniform(0.5, 1.5)
+            if domain_state.circuit_state == CIRCUIT_HALF_OPEN or (
+                domain_state.circuit_state == CIRCUIT_CLOSED and domain_state.n_consecutive_failures >= self.failure_threshold
+            ):
+                was_closed = domain_state.circuit_state == CIRCUIT_CLOSED
+                domain_state.circuit_state = CIRCUIT_OPEN
+                domain_state.circuit_open_until = now + self.open_duration
+                domain_state.backoff_until = 0.0
+                return was_closed
+            return False
+
+    def get_paused_domains(self) -> List[str]:
+        """Get the domains whose circuit is not closed."""
+        with self.lock:
+            return [domain for domain, domain_state in self.domain_states.items() if domain_state.circuit_state != CIRCUIT_CLOSED]
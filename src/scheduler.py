@@ -0,0 +1,298 @@
+from datetime import datetime, timezone
+import heapq
+import math
+import threading
+from time import monotonic
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+
+class TicketSignals:
+    """What the scheduler knows about a ticket, used to choose its checking interval : its site, the date of its event,
+    the hash of the content of its page and the last time this content changed.
+    """
+    def __init__(self):
+        self.site : Optional[str] = None
+        self.event_date : Optional[datetime] = None
+        self.content_hash : Optional[str] = None
+        self.last_change_date : Optional[datetime] = None
+
+
+
+class AdaptivePollingPolicy:
+    """This class gives each ticket its own checking interval. Each ticket has a weight, which is higher when a sell-out is more likely to be imminent :
+    when its event is close, when its page changed recently, and according to its site's weight. 
+    If fetch_budget_per_minute is positive, this budget of page loads is shared among the tickets proportionally to their weights,
+    otherwise the interval of a ticket is base_interval divided by its weight. Intervals are clipped to [min_interval, max_interval].
+    If the policy is disabled, all tickets are checked every base_interval seconds.
+    """
+    def __init__(
+        self, 
+        enabled : bool = False, 
+        fetch_budget_per_minute : float = 0, 
+        min_interval : float = 10, 
+        max_interval : float = 3600,
+        site_weights : Optional[Dict[str, float]] = None,
+    ):
+        self.enabled = enabled
+        self.fetch_budget_per_minute = fetch_budget_per_minute
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.site_weights = site_weights if site_weights is not None else {}
+
+    def get_weight(self, signals : TicketSignals) -> float:
+        """Get the weight of a ticket from its signals. A ticket without signals has weight 1.
+
+        Args:
+            signals (TicketSignals): the signals of the ticket
+
+        Returns:
+            float: the weight of the ticket
+        """
+        if not self.enabled:
+            return 1
+        now = datetime.now(timezone.utc)
+        weight = self.site_weights.get(signals.site, 1)
+        # Events in less than a week get more weight, events in more than a week less (x8 the last day, x0.25 four weeks before)
+        if signals.event_date is not None:
+            days_until_event = (signals.event_date - now).total_seconds() / 86400
+            if days_until_event < 0:
+                weight *= 0.25
+            else:
+                weight *= min(max(7 / max(days_until_event, 1 / 24), 0.25), 8)
+        # Pages that changed recently get up to 4 times more weight, decaying with a one hour time constant
+        if signals.last_change_date is not None:
+            hours_since_change = (now - signals.last_change_date).total_seconds() / 3600
+            weight *= 1 + 3 * math.exp(-hours_since_change)
+        return weight
+
+    def get_interval(self, weight : float, total_weight : float, base_interval : float) -> float:
+        """Get the checking interval of a ticket.
+
+        Args:
+            weight (float): the weight of the ticket
+            total_weight (float): the sum of the weights of all the tickets
+            base_interval (float): the checking interval used when the policy is disabled or has no budget
+
+        Returns:
+            float: the checking interval of the ticket, in seconds
+        """
+        if not self.enabled:
+            return base_interval
+        if self.fetch_budget_per_minute > 0:
+            checks_per_second = self.fetch_budget_per_minute / 60 * weight / max(total_weight, weight)
+            interval = 1 / checks_per_second
+        else:
+            interval = base_interval / weight
+        return min(max(interval, self.min_interval), self.max_interval)
+
+
+
+class Scheduler:
+    """This class decides when each ticket of the watchlist has to be checked. It keeps a priority queue of the next due time of each ticket,
+    and the main loop sleeps in wait() until the earliest due time, or until it is woken up by a change of state (new ticket, parameter change, stop).
+
+    A ticket is either scheduled (it has a due time in the queue), in flight (it was popped by pop_due() and is being checked),
+    or unknown (not watched). Times are monotonic times, in seconds.
+
+    The interval between two checks of a ticket is chosen by the polling policy, from the signals recorded with update_signals().
+    """
+    def __init__(self, interval : float, policy : Optional[AdaptivePollingPolicy] = None):
+        self.condition = threading.Condition()
+        self.heap : List[Tuple[float, str]] = []   # (due time, url), entries whose due time differs from due_times[url] are stale
+        self.due_times : Dict[str, float] = {}
+        self.last_check_times : Dict[str, float] = {}
+        self.in_flight : Set[str] = set()
+        self.woken = False
+        self.interval = interval
+        self.policy = policy if policy is not None else AdaptivePollingPolicy()
+        self.signals : Dict[str, TicketSignals] = {}
+        self.weights : Dict[str, float] = {}
+        self.total_weight = 0.0
+
+    def set_interval(self, interval : float, policy : Optional[AdaptivePollingPolicy] = None):
+        """Change the base checking interval and/or the polling policy, and move the due times of the scheduled tickets accordingly.
+
+        Args:
+            interval (float): the new base interval between two checks of a ticket, in seconds
+            policy (Optional[AdaptivePollingPolicy], optional): the new polling policy. Defaults to None (keep the current one).
+        """
+        with self.condition:
+            if interval == self.interval and policy is None:
+                return
+            self.interval = interval
+            if policy is not None:
+                self.policy = policy
+                for url in self.weights:
+                    self.set_weight(url, self.policy.get_weight(self.signals[url]))
+            for url in list(self.due_times):
+                last_check_time = self.last_check_times.get(url)
+                if last_check_time is not None:
+                    self.push(url, last_check_time + self.get_interval(url))
+            self.condition.notify_all()
+
+    def set_weight(self, url : str, weight : float):
+        """Set the weight of a ticket and update the total weight. The caller must hold the condition."""
+        self.total_weight += weight - self.weights.get(url, 0)
+        self.weights[url] = weight
+
+    def get_interval(self, url : str) -> float:
+        """Get the current checking interval of a ticket. The caller must hold the condition."""
+        return self.policy.get_interval(self.weights.get(url, 1), self.total_weight, self.interval)
+
+    def update_signals(self, url : str, site : Optional[str] = None, event_date : Optional[datetime] = None, content_hash : Optional[str] = None):
+        """Record what was learned about a ticket during its last check, and update its weight. Only the given signals are updated.
+
+        Args:
+            url (str): the url of the ticket
+            site (Optional[str], optional): the name of the site of the ticket. Defaults to None.
+            event_date (Optional[datetime], optional): the date of the event. Defaults to None.
+            content_hash (Optional[str], optional): the hash of the content of the page. Defaults to None.
+        """
+        with self.condition:
+            if url not in self.signals:
+                return
+            signals = self.signals[url]
+            if site is not None:
+                signals.site = site
+            if event_date is not None:
+                signals.event_date = event_date
+            if content_hash is not None:
+                if signals.content_hash is not None and signals.content_hash != content_hash:
+                    signals.last_change_date = datetime.now(timezone.utc)
+                signals.content_hash = content_hash
+            self.set_weight(url, self.policy.get_weight(signals))
+
+    def push(self, url : str, due_time : float):
+        """Set the due time of a ticket. The caller must hold the condition."""
+        self.due_times[url] = due_time
+        heapq.heappush(self.heap, (due_time, url))
+
+    def add(self, url : str):
+        """Add a ticket to the schedule, due immediately. Nothing is done if the ticket is already scheduled or in flight."""
+        with self.condition:
+            if url in self.due_times or url in self.in_flight:
+                return
+            self.signals[url] = TicketSignals()
+            self.set_weight(url, self.policy.get_weight(self.signals[url]))
+            self.push(url, monotonic())
+            self.condition.notify_all()
+
+    def remove(self, url : str):
+        """Remove a ticket from the schedule. If it is in flight, it won't be rescheduled."""
+        with self.condition:
+            self.due_times.pop(url, None)
+            self.last_check_times.pop(url, None)
+            self.in_flight.discard(url)
+            self.signals.pop(url, None)
+            self.total_weight -= self.weights.pop(url, 0)
+
+    def sync(self, urls : List[str]):
+        """Make the schedule match the watchlist : add the new tickets and remove the ones that are no longer watched.
+
+        Args:
+            urls (List[str]): the urls of all the tickets in the watchlist
+        """
+        urls = set(urls)
+        with self.condition:
+            for url in list(self.due_times) + list(self.in_flight):
+                if url not in urls:
+                    self.remove(url)
+            for url in urls:
+                self.add(url)
+
+    def reschedule(self, url : str):
+        """Schedule the next check of a ticket that was in flight, one checking interval from now. Nothing is done if the ticket was removed meanwhile."""
+        with self.condition:
+            if url not in self.in_flight:
+                return
+            self.in_flight.discard(url)
+            now = monotonic()
+            self.last_check_times[url] = now
+            self.push(url, now + self.get_interval(url))
+
+    def postpone(self, url : str, delay : float):
+        """Put back in the schedule a ticket that was popped but could not be checked yet (e.g. because of rate limiting), due delay seconds from now."""
+        with self.condition:
+            if url not in self.in_flight:
+                return
+            self.in_flight.discard(url)
+            self.push(url, monotonic() + delay)
+
+    def get_next_due_time(self) -> Optional[float]:
+        """Get the earliest due time, or None if no ticket is scheduled. The caller must hold the condition."""
+        while self.heap:
+            due_time, url = self.heap[0]
+            if self.due_times.get(url) == due_time:
+                return due_time
+            heapq.heappop(self.heap)  # stale entry
+        return None
+
+    def get_lag(self) -> float:
+        """Get how overdue the most overdue ticket is, in seconds (0 if no ticket is overdue)."""
+        with self.condition:
+            next_due_time = self.get_next_due_time()
+            return max(0.0, monotonic() - next_due_time) if next_due_time is not None else 0.0
+
+    def pop_due(self) -> List[str]:
+        """Get the tickets that are due, and mark them as in flight.
+
+        Returns:
+            List[str]: the urls of the due tickets, the most overdue first
+        """
+        due_urls = []
+        with self.condition:
+            now = monotonic()
+            while True:
+                next_due_time = self.get_next_due_time()
+                if next_due_time is None or next_due_time > now:
+                    break
+                _, url = heapq.heappop(self.heap)
+                del self.due_times[url]
+                self.in_flight.add(url)
+                due_urls.append(url)
+        return due_urls
+
+    def pop_early(self, urls : Iterable[str]) -> List[str]:
+        """Mark scheduled tickets as in flight before they are due, e.g. because they are checked with the same fetch as a due ticket.
+        The tickets already in flight or not scheduled are ignored.
+
+        Returns:
+            List[str]: the urls of the tickets marked as in flight
+        """
+        popped_urls = []
+        with self.condition:
+            for url in urls:
+                if url in self.due_times:
+                    del self.due_times[url]  # its entry of the heap becomes stale
+                    self.in_flight.add(url)
+                    popped_urls.append(url)
+        return popped_urls
+
+    def wait(self, timeout : Optional[float] = None):
+        """Sleep until a ticket is due, wake() is called, or timeout seconds passed.
+
+        Args:
+            timeout (Optional[float], optional): the maximum time to sleep, in seconds. Defaults to None (no limit).
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        with self.condition:
+            while not self.woken:
+                now = monotonic()
+                next_due_time = self.get_next_due_time()
+                if deadline is not None and (next_due_time is None or deadline < next_due_time):
+                    next_due_time = deadline
+                if next_due_time is not None and next_due_time <= now:
+                    break
+                self.condition.wait(None if next_due_time is None else next_due_time - now)
+            self.woken = False
+
+    def wake(self):
+        """Wake up the thread sleeping in wait(), e.g. because the state of the bot changed."""
+        with self.condition:
+            self.woken = True
+            self.condition.notify_all()
+
+    def get_n_scheduled(self) -> int:
+        with self.condition:
+            return len(self.due_times) + len(self.in_flight)
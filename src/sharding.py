@@ -0,0 +1,96 @@
+import hashlib
+import os
+import socket
+from time import time
+from typing import List, Optional
+import uuid
+
+from src.interface_database import DBInterface
+
+
+
+def get_rendezvous_weight(node_name : str, ticket_url : str) -> int:
+    """Get the weight of a node for a ticket : the ticket is owned by the live node of highest weight (rendezvous hashing)."""
+    return int.from_bytes(hashlib.sha1(f"{node_name}\n{ticket_url}".encode("utf-8")).digest()[:8], "big")
+
+
+
+def get_default_node_name() -> str:
+    """Get a name of this node that is unique among the machines sharing the database : the hostname and the process id."""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+
+class ShardCoordinator:
+    """This class shares the watchlist between the nodes (instances of the bot) using the same database file, on the same host :
+    - each node heartbeats in the database every heartbeat period. A node is alive while its last heartbeat is less than lease_duration seconds old,
+      so the tickets of a node that stopped (or crashed) are taken over by the other nodes once its lease expires.
+    - each ticket is owned by a single live node, chosen by rendezvous hashing : when a node joins or leaves, only the tickets it gains or loses move.
+    - the leader, i.e. the live node with the smallest name, is the only one receiving the Telegram commands.
+    Each node must have its own name : a node whose name is held by another live instance checks nothing and doesn't receive the commands
+    until the name is released (see name_conflict). If the coordinator is disabled, the node owns all the tickets and is the leader.
+    The database is in WAL mode, which relies on memory shared by the processes : it must not be shared through a network filesystem.
+
+    Args:
+        db_interface (DBInterface): the database shared by the nodes
+        node_name (str): the name of this node
+        lease_duration (float): the time after which a node that didn't heartbeat is considered stopped, in seconds
+        enabled (bool): whether the watchlist is shared with other nodes
+    """
+    def __init__(self, db_interface : DBInterface, node_name : str, lease_duration : float = 30, enabled : bool = False):
+        self.db_interface = db_interface
+        self.node_name = node_name
+        self.lease_duration = lease_duration
+        self.enabled = enabled
+        self.live_nodes : List[str] = [node_name]
+        # The identifier of this process, and the other instance holding the name of this node, if any
+        self.instance = uuid.uuid4().hex
+        self.name_conflict : Optional[str] = None
+
+    def heartbeat(self) -> List[str]:
+        """Renew the lease of this node and update the list of the live nodes.
+
+        Returns:
+            List[str]: the names of the live nodes, this one included
+        """
+        if not self.enabled:
+            self.live_nodes = [self.node_name]
+            return self.live_nodes
+        now = time()
+        name_conflict = self.db_interface.heartbeat_node(self.node_name, self.instance, now, since=now - self.lease_duration)
+        if name_conflict is not None and self.name_conflict is None:
+            print(f"Warning : machine name {self.node_name} is already used by another running instance, this one checks nothing until it stops. Set a unique MACHINE_NAME.")
+        self.name_conflict = name_conflict
+        live_nodes = self.db_interface.get_live_nodes(now - self.lease_duration)
+        if self.node_name not in live_nodes:
+            live_nodes.append(self.node_name)
+        self.live_nodes = sorted(live_nodes)
+        return self.live_nodes
+
+    def leave(self):
+        """Give up the lease of this node, so that its tickets are taken over immediately by the other nodes."""
+        if self.enabled:
+            self.db_interface.remove_node(self.node_name, self.instance)
+
+    def get_owner(self, ticket_url : str) -> str:
+        """Get the name of the node owning a ticket, according to the last heartbeat."""
+        live_nodes = self.live_nodes
+        if len(live_nodes) == 1:
+            return live_nodes[0]
+        return max(live_nodes, key=lambda node_name: get_rendezvous_weight(node_name, ticket_url))
+
+    def owns(self, ticket_url : str) -> bool:
+        """Return True if this node must check the ticket."""
+        if not self.enabled:
+            return True
+        return self.name_conflict is None and self.get_owner(ticket_url) == self.node_name
+
+    def get_owned_ticket_urls(self, ticket_urls : List[str]) -> List[str]:
+        """Get the tickets that this node must check, among the given ones."""
+        return [ticket_url for ticket_url in ticket_urls if self.owns(ticket_url)]
+
+    def is_leader(self) -> bool:
+        """Return True if this node is the one receiving the Telegram commands."""
+        if not self.enabled:
+            return True
+        return self.name_conflict is None and self.live_nodes[0] == self.node_name
@@ -1,22 +1,45 @@
-from datetime import datetime
-import re
+import os
 import sys
-from typing import Callable, Dict, List
+import tempfile
+import threading
+from time import monotonic, time
+from typing import Callable, Dict, List, Set
 from dotenv import dotenv_values
 
-from telegram.ext import Updater, CommandHandler, CallbackContext
+from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, CallbackContext
 from telegram import Update
 
-from src.interface_database import DBInterface
-from src.web_scraping import url_to_detector, get_driver
-from src.config import DEFAULT_VALUES
-from src.utils import to_right_type, command_signature_to_description
+from src.interface_database import DBInterface, DATABASE_PATH
+from src.web_scraping import url_to_detector, detector_registry, DriverPool, BrowserProfile, DEFAULT_BLOCKED_DOMAINS, TIER_NAMES
+from src.http_fetching import HttpFetcher
+from src.page_cache import PageCache
+from src.check_engine import CheckEngine, CheckResult
+from src.online_learning import OnlineMarkerLearner
+from src.sharding import ShardCoordinator, get_default_node_name
+from src.listings import ListingIndex
+from src.watchlist_io import canonicalize_watchlist, get_canonical_url, import_tickets, export_tickets, format_added_at
+from src.check_history import get_history_row, get_site_stats_from_history, get_site_stats_from_rollups, merge_site_stats
+from src.scheduler import Scheduler, AdaptivePollingPolicy
+from src.rate_limiting import DomainRateLimiter
+from src.alert_outbox import AlertSender, ALERT_SOLDOUT, ALERT_ERROR, ALERT_INFO
+from src.profiling import profiler
+from src.metrics import Metric, MetricsExporter, METRIC_COUNTER, METRIC_GAUGE, METRIC_SUMMARY
+from src.config import POSITIVE_PARAMETERS
+from src.utils import to_right_type, parse_weights, command_signature_to_description
 
 
 # Load environment variables
 env_values = dotenv_values(".env")
 CHAT_ID = env_values["CHAT_ID"]
 BOT_TOKEN = env_values["BOT_TOKEN"]
+# When several machines share the database, each of them must have its own name (the parameters being shared too) : 
+# the hostname and the process id by default
+MACHINE_NAME = env_values.get("MACHINE_NAME") or get_default_node_name()
+BOT_DATABASE_PATH = env_values.get("DATABASE_PATH") or DATABASE_PATH
+
+HISTORY_DOWNSAMPLING_PERIOD = 3600  # the time between two downsamplings of the check history, in seconds
+PROFILE_N_STAGES = 10               # the number of stages displayed by /profile
+LIST_PAGE_SIZE = 50                 # the number of tickets displayed by /list, by default
 
 
 
@@ -56,19 +79,74 @@ class TelegramBot():
     """This class is the Telegram bot. It is responsible for doing the interface between the database, the web scraping and the Telegram API.
     """
     def  __init__(self):
-        # Get webdriver
-        self.driver = get_driver()
         # Connect to database and initialize parameters
-        self.db_interface = DBInterface()
+        self.db_interface = DBInterface(BOT_DATABASE_PATH)
+        # Create the coordinator sharing the watchlist with the other instances using the same database on this host, if sharding is True
+        self.shard_coordinator = ShardCoordinator(
+            self.db_interface,
+            node_name=MACHINE_NAME,
+            lease_duration=to_right_type(self.get_parameter_from_db("lease_duration")),
+            enabled=to_right_type(self.get_parameter_from_db("sharding")),
+        )
+        # Create the webdriver pool, shared by the check engine and the commands
+        self.driver_pool = DriverPool(**self.get_driver_pool_limits(), profile=self.get_browser_profile())
+        # Create the HTTP fetcher, used instead of the browser when possible
+        self.http_fetcher = HttpFetcher(
+            pool_size=to_right_type(self.get_parameter_from_db("http_pool_size")), 
+            timeout=to_right_type(self.get_parameter_from_db("http_timeout")),
+        )
+        # Create the cache of the verdicts of the pages fetched with HTTP
+        self.page_cache = PageCache(max_entries=to_right_type(self.get_parameter_from_db("page_cache_size")))
+        # Create the per-site rate limiter
+        self.rate_limiter = DomainRateLimiter(**self.get_rate_limits())
+        # Create the scheduler, which decides when each ticket is checked
+        self.scheduler = Scheduler(interval=to_right_type(self.get_parameter_from_db("checking_frequency")), policy=self.get_polling_policy())
+        self.parameters_changed = threading.Event()
+        # Create the index of the listing pages of the events, used to check the events of a listing with a single fetch
+        self.listing_index = ListingIndex()
+        # Create the check engine, which wakes up the main loop each time a check is finished
+        self.check_engine = CheckEngine(
+            n_workers=to_right_type(self.get_parameter_from_db("n_workers")), 
+            driver_pool=self.driver_pool,
+            http_fetcher=self.get_http_fetcher_for_fetch_mode(),
+            page_cache=self.page_cache,
+            on_result=self.scheduler.wake,
+        )
+        # Create the online learner of the markers, fed with the candidate markers collected by the check engine if online_learning is True
+        self.marker_learner = OnlineMarkerLearner(self.db_interface, **self.get_marker_validation_limits())
+        self.held_soldout_urls : Set[str] = set()  # the tickets whose sold out verdict is ignored because the markers of their site may be broken
+        self.check_engine.collect_marker_candidates = to_right_type(self.get_parameter_from_db("online_learning"))
+        self.check_engine.max_render_age = self.get_max_render_age()
+        profiler.enabled = to_right_type(self.get_parameter_from_db("profiling"))
+        # Create the metrics endpoint, started if metrics_port is not 0. A pass is over when as many checks as tickets are done.
+        self.metrics_exporter = MetricsExporter(self.collect_metrics)
+        self.pass_start_time = monotonic()
+        self.n_checks_in_pass = 0
+        self.last_pass_duration = None
         # Connect to telegram and register commands
         self.updater = Updater(BOT_TOKEN)
         self.dispatcher = self.updater.dispatcher
+        # Create the sender of the alerts queued in the database
+        self.alert_sender = AlertSender(
+            db_interface=self.db_interface,
+            send_message=lambda text: self.updater.bot.send_message(chat_id=CHAT_ID, text=text, disable_web_page_preview=True),
+            window=to_right_type(self.get_parameter_from_db("alert_window")),
+            min_send_interval=to_right_type(self.get_parameter_from_db("alert_min_send_interval")),
+            node_name=f"{self.shard_coordinator.node_name}/{self.shard_coordinator.instance}",
+        )
         self.dispatcher.add_handler(CommandHandler("help", self.execute_help))
         self.dispatcher.add_handler(CommandHandler("watch", self.execute_watch))
         self.dispatcher.add_handler(CommandHandler("unwatch", self.execute_unwatch))
         self.dispatcher.add_handler(CommandHandler("check", self.execute_check))
         self.dispatcher.add_handler(CommandHandler("list", self.execute_list))
+        self.dispatcher.add_handler(CommandHandler("import", self.execute_import))
+        self.dispatcher.add_handler(MessageHandler(Filters.document & Filters.caption_regex(r"^/import\b"), self.execute_import_document))
+        self.dispatcher.add_handler(CommandHandler("export", self.execute_export))
         self.dispatcher.add_handler(CommandHandler("status", self.execute_status))
+        self.dispatcher.add_handler(CommandHandler("stats", self.execute_stats))
+        self.dispatcher.add_handler(CommandHandler("profile", self.execute_profile))
+        self.dispatcher.add_handler(CommandHandler("markers", self.execute_markers))
+        self.dispatcher.add_handler(CommandHandler("label", self.execute_label))
         self.dispatcher.add_handler(CommandHandler("set", self.execute_set))
         self.dispatcher.add_handler(CommandHandler("get", self.execute_get))
         self.dispatcher.add_handler(CommandHandler("reset_db", self.execute_reset_db))
@@ -82,17 +160,34 @@ class TelegramBot():
     def start(self):
         """Start the bot and the main loop.
         """
+        # Refuse to start if the name of this machine is used by another running instance, which would check the same tickets and receive the same commands
+        self.shard_coordinator.heartbeat()
+        if self.shard_coordinator.name_conflict is not None:
+            print(f"Error : machine name {MACHINE_NAME} is already used by another running instance sharing the database. Set a unique MACHINE_NAME in .env.")
+            self.db_interface.close()
+            sys.exit(1)
         try:
             self.updater.bot.send_message(chat_id=CHAT_ID, text="Bot is running.", disable_web_page_preview=True)
         except:
             print("Warning : Bot is not running on the authorized chat. Please check the CHAT_ID environment variable.")
-        self.updater.start_polling()
+        self.alert_sender.start()
+        self.metrics_exporter.set_port(to_right_type(self.get_parameter_from_db("metrics_port")))
 
         self.set_parameter_in_db("stop", "False")
-
-        last_global_check = None
-        checking_frequency = to_right_type(self.get_parameter_from_db("checking_frequency"))
-        stop = to_right_type(self.get_parameter_from_db("stop"))
+        # Set the canonical urls of the tickets watched before canonical urls existed, or since the rules of their site changed
+        n_canonicalized = canonicalize_watchlist(self.db_interface)
+        if n_canonicalized > 0:
+            print(f"{n_canonicalized} tickets canonicalized.")
+
+        # Only the leader receives the commands, since Telegram allows a single bot instance to poll the updates
+        self.shard_coordinator.heartbeat()
+        self.is_polling = False
+        self.update_polling()
+        self.scheduler.sync(self.get_owned_ticket_urls())
+        self.listing_index.load(self.db_interface.get_listing_urls())
+        stop = False
+        last_history_downsampling_time = -HISTORY_DOWNSAMPLING_PERIOD
+        last_heartbeat_time = monotonic()
         print("Bot started")
 
         while True:
@@ -102,34 +197,374 @@ class TelegramBot():
                 print("Stopping the program. The program will then have to be restarted manually from the machine.")
                 self.updater.bot.send_message(chat_id=CHAT_ID, text="Stopping the program.")
                 self.updater.stop()
+                self.shard_coordinator.leave()
+                self.metrics_exporter.stop()
+                self.check_engine.close()
+                self.alert_sender.stop()
+                self.driver_pool.close()
+                self.http_fetcher.close()
                 self.db_interface.close()
                 sys.exit()
             
-            # Check tickets every checking_frequency seconds
-            now = datetime.now()
             try:
-                if last_global_check is None or (now - last_global_check).seconds > checking_frequency:
-                    last_global_check = now
-                    tickets_urls = self.get_ticket_urls()
-                    for ticket_url in tickets_urls:
+                # Sleep until a ticket is due, a check is finished, a command changed the state of the bot, or the next heartbeat
+                heartbeat_period = to_right_type(self.get_parameter_from_db("heartbeat_period"))
+                self.scheduler.wait(timeout=max(0, last_heartbeat_time + heartbeat_period - monotonic()) if self.shard_coordinator.enabled else None)
+                if self.shard_coordinator.enabled and monotonic() - last_heartbeat_time >= heartbeat_period:
+                    last_heartbeat_time = monotonic()
+                    self.update_shard()
+                # Update parameters of the python side from the database
+                if self.parameters_changed.is_set():
+                    self.parameters_changed.clear()
+                    stop = to_right_type(self.get_parameter_from_db("stop"))
+                    if stop:
+                        continue
+                    self.update_parameters()
+                # Apply the results of the finished checks, and record them in the check history.
+                # The events that their listing didn't answer are submitted on their own page with the due tickets
+                own_page_ticket_urls = []
+                with profiler.measure("loop.apply_results"):
+                    history_rows = []
+                    for check_result in self.check_engine.get_finished_results():
+                        if check_result.needs_own_page_check:
+                            own_page_ticket_urls.append(check_result.url)
+                            continue
+                        if not check_result.is_listing:
+                            history_rows.append(get_history_row(check_result, checked_at=time()))
                         try:
-                            detector = url_to_detector(ticket_url)
-                            if detector.is_soldout(url=ticket_url, driver=self.driver):
-                                # Send message
-                                print(f"Ticket {ticket_url} is sold out !")
-                                self.updater.bot.send_message(chat_id=CHAT_ID, text=f"Ticket {ticket_url} is sold out !", disable_web_page_preview=True)
-                                # Remove ticket from watch list
-                                self.db_interface.execute(f"DELETE FROM tickets_url WHERE url = ?", (ticket_url,))
-                                self.db_interface.commit()
+                            self.apply_check_result(check_result)
                         except Exception as e:
-                            print(f"Error : Exception while checking ticket {ticket_url} : {e}")
-                            self.updater.bot.send_message(chat_id=CHAT_ID, text=f"Error : Exception while checking ticket {ticket_url} : {e}", disable_web_page_preview=True)
-                    # Update parameters of the python side from the database
-                    checking_frequency = to_right_type(self.get_parameter_from_db("checking_frequency"))
-                    stop = to_right_type(self.get_parameter_from_db("stop"))
+                            print(f"Error : Exception while applying the check result of ticket {check_result.url} : {e}")
+                    if history_rows:
+                        try:
+                            self.db_interface.add_check_history(history_rows)
+                        except Exception as e:
+                            print(f"Error : Exception while recording the check history : {e}")
+                    self.n_checks_in_pass += len(history_rows)
+                    if self.n_checks_in_pass >= max(1, self.scheduler.get_n_scheduled()):
+                        self.last_pass_duration = monotonic() - self.pass_start_time
+                        self.pass_start_time = monotonic()
+                        self.n_checks_in_pass = 0
+                if monotonic() - last_history_downsampling_time > HISTORY_DOWNSAMPLING_PERIOD and self.shard_coordinator.is_leader():
+                    last_history_downsampling_time = monotonic()
+                    self.db_interface.downsample_check_history(
+                        retention=to_right_type(self.get_parameter_from_db("history_retention_hours")) * 3600,
+                        rollup_retention=to_right_type(self.get_parameter_from_db("history_rollup_retention_days")) * 86400,
+                    )
+                # Submit the due tickets to the check engine, unless their site is rate limited or paused.
+                # The due tickets of a listing are checked with a single fetch of the listing, with the other tickets of the listing
+                with profiler.measure("loop.submit"):
+                    due_ticket_urls = self.scheduler.pop_due()
+                    if to_right_type(self.get_parameter_from_db("listing_checks")):
+                        listing_groups, due_ticket_urls = self.listing_index.group(due_ticket_urls)
+                    else:
+                        listing_groups = {}
+                    # A ticket that can't be submitted is rescheduled, otherwise it would stay in flight and never be checked again.
+                    # The first error is raised once all the tickets are submitted, to be reported
+                    submit_error = None
+                    for listing_url, ticket_urls in listing_groups.items():
+                        try:
+                            delay = self.rate_limiter.reserve(self.get_site_name(listing_url))
+                            if delay > 0:
+                                for ticket_url in ticket_urls:
+                                    self.scheduler.postpone(ticket_url, delay)
+                            else:
+                                ticket_urls += self.scheduler.pop_early(self.listing_index.get_tickets(listing_url) - set(ticket_urls))
+                                self.check_engine.submit_listing(listing_url, ticket_urls)
+                        except Exception as e:
+                            for ticket_url in ticket_urls:
+                                self.scheduler.reschedule(ticket_url)
+                            submit_error = submit_error or e
+                    for ticket_url in own_page_ticket_urls + due_ticket_urls:
+                        try:
+                            delay = self.rate_limiter.reserve(self.get_site_name(ticket_url))
+                            if delay > 0:
+                                self.scheduler.postpone(ticket_url, delay)
+                            else:
+                                self.check_engine.submit(ticket_url)
+                        except Exception as e:
+                            self.scheduler.reschedule(ticket_url)
+                            submit_error = submit_error or e
+                    if submit_error is not None:
+                        raise submit_error
             except Exception as e:
                 print("Python error in main loop : ", e)
-                self.updater.bot.send_message(chat_id=CHAT_ID, text=f"Error : error happened in main loop : {e}", disable_web_page_preview=True)
+                try:
+                    self.db_interface.queue_alert(ALERT_ERROR, f"Error : error happened in main loop : {e}")
+                    self.alert_sender.notify()
+                except Exception as e:
+                    print("Python error while queuing the error alert : ", e)
+
+
+    def update_parameters(self):
+        """Update the parameters of the scheduler, the check engine and the driver pool from the database."""
+        self.scheduler.set_interval(to_right_type(self.get_parameter_from_db("checking_frequency")), policy=self.get_polling_policy())
+        self.check_engine.set_n_workers(to_right_type(self.get_parameter_from_db("n_workers")))
+        self.rate_limiter.set_limits(**self.get_rate_limits())
+        self.driver_pool.set_profile(self.get_browser_profile())
+        self.driver_pool.set_limits(**self.get_driver_pool_limits())
+        self.check_engine.http_fetcher = self.get_http_fetcher_for_fetch_mode()
+        self.check_engine.collect_marker_candidates = to_right_type(self.get_parameter_from_db("online_learning"))
+        self.check_engine.max_render_age = self.get_max_render_age()
+        self.marker_learner.set_limits(**self.get_marker_validation_limits())
+        profiler.enabled = to_right_type(self.get_parameter_from_db("profiling"))
+        self.metrics_exporter.set_port(to_right_type(self.get_parameter_from_db("metrics_port")))
+        self.shard_coordinator.lease_duration = to_right_type(self.get_parameter_from_db("lease_duration"))
+        sharding = to_right_type(self.get_parameter_from_db("sharding"))
+        if sharding != self.shard_coordinator.enabled:
+            self.shard_coordinator.enabled = sharding
+            self.update_shard()
+
+
+    def update_shard(self):
+        """Renew the lease of this machine, then take the changes made by the other machines sharing the database into account :
+        reload the parameters, check the tickets now owned by this machine (tickets added by the leader, tickets of machines that stopped...)
+        and start or stop receiving the commands if the leader changed."""
+        self.shard_coordinator.heartbeat()
+        parameters = self.get_parameters()
+        self.db_interface.load_parameters()
+        if self.get_parameters() != parameters:
+            self.parameters_changed.set()
+        self.scheduler.sync(self.get_owned_ticket_urls())
+        self.listing_index.load(self.db_interface.get_listing_urls())
+        self.update_polling()
+
+
+    def update_polling(self):
+        """Start receiving the commands if this machine is the leader, stop otherwise."""
+        is_leader = self.shard_coordinator.is_leader()
+        if is_leader and not self.is_polling:
+            print(f"Machine {self.shard_coordinator.node_name} is the leader, it receives the commands.")
+            self.updater.start_polling()
+        elif not is_leader and self.is_polling:
+            print(f"Machine {self.shard_coordinator.node_name} is no longer the leader.")
+            self.updater.stop()
+        self.is_polling = is_leader
+
+
+    def get_owned_ticket_urls(self) -> List[str]:
+        """Get the canonical urls of the events checked by this machine : all the events, or the events it owns if the watch list is shared by several machines.
+        The aliases of an event share its canonical url, so that it is fetched once."""
+        return self.shard_coordinator.get_owned_ticket_urls(self.db_interface.get_canonical_urls())
+
+
+    def notify_state_change(self):
+        """Wake up the main loop so that it reloads the parameters from the database. Called by the commands modifying parameters."""
+        self.parameters_changed.set()
+        self.scheduler.wake()
+
+
+    def get_rate_limits(self) -> Dict[str, float]:
+        """Get the limits of the per-site rate limiter from the database, as keyword arguments of DomainRateLimiter.set_limits."""
+        return {
+            "rate_per_minute" : to_right_type(self.get_parameter_from_db("site_rate_per_minute")),
+            "burst" : to_right_type(self.get_parameter_from_db("site_burst")),
+            "backoff_base" : to_right_type(self.get_parameter_from_db("backoff_base")),
+            "backoff_max" : to_right_type(self.get_parameter_from_db("backoff_max")),
+            "failure_threshold" : to_right_type(self.get_parameter_from_db("circuit_failure_threshold")),
+            "open_duration" : to_right_type(self.get_parameter_from_db("circuit_open_duration")),
+        }
+
+
+    def get_site_name(self, ticket_url : str) -> str:
+        """Get the name of the site of a ticket, which identifies it for rate limiting, or "unknown" if the site is not detected."""
+        detector = url_to_detector(ticket_url)
+        return detector.get_name() if detector is not None else "unknown"
+
+
+    def get_max_render_age(self) -> float:
+        """Get the time during which the verdict of the browser is reused while the server-rendered HTML doesn't change : the max_render_age parameter,
+        or the base checking interval if it is "auto", so that a sell out is never missed for more than about one check."""
+        max_render_age = self.get_parameter_from_db("max_render_age")
+        if max_render_age == "auto":
+            return to_right_type(self.get_parameter_from_db("checking_frequency"))
+        return to_right_type(max_render_age)
+
+
+    def get_marker_validation_limits(self) -> Dict[str, float]:
+        return {
+            "min_pages" : to_right_type(self.get_parameter_from_db("marker_validation_min_pages")),
+            "min_accuracy" : to_right_type(self.get_parameter_from_db("marker_validation_min_accuracy")),
+            "min_agreement" : to_right_type(self.get_parameter_from_db("marker_validation_min_agreement")),
+        }
+
+
+    def get_polling_policy(self) -> AdaptivePollingPolicy:
+        """Create the polling policy of the scheduler from the parameters in the database."""
+        return AdaptivePollingPolicy(
+            enabled=to_right_type(self.get_parameter_from_db("adaptive_polling")),
+            fetch_budget_per_minute=to_right_type(self.get_parameter_from_db("fetch_budget_per_minute")),
+            min_interval=to_right_type(self.get_parameter_from_db("min_checking_interval")),
+            max_interval=to_right_type(self.get_parameter_from_db("max_checking_interval")),
+            site_weights=parse_weights(self.get_parameter_from_db("site_weights")),
+        )
+
+
+    def get_driver_pool_limits(self) -> Dict[str, float]:
+        """Get the size limits and recycling thresholds of the driver pool from the database, as keyword arguments of DriverPool.set_limits."""
+        return {
+            "min_size" : to_right_type(self.get_parameter_from_db("driver_pool_min_size")),
+            "max_size" : to_right_type(self.get_parameter_from_db("driver_pool_max_size")),
+            "max_page_loads" : to_right_type(self.get_parameter_from_db("driver_max_page_loads")),
+            "max_memory_mb" : to_right_type(self.get_parameter_from_db("driver_max_memory_mb")),
+        }
+
+
+    def get_browser_profile(self) -> BrowserProfile:
+        """Create the browser profile of the driver pool from the parameters in the database."""
+        blocked_domains = self.get_parameter_from_db("browser_blocked_domains")
+        if blocked_domains == "default":
+            blocked_domains = list(DEFAULT_BLOCKED_DOMAINS)
+        elif blocked_domains in ("None", ""):
+            blocked_domains = []
+        else:
+            blocked_domains = [domain.strip() for domain in blocked_domains.split(",") if domain.strip() != ""]
+        return BrowserProfile(
+            headless=to_right_type(self.get_parameter_from_db("browser_headless")),
+            block_assets=to_right_type(self.get_parameter_from_db("browser_block_assets")),
+            blocked_domains=blocked_domains,
+            page_load_strategy=self.get_parameter_from_db("page_load_strategy"),
+            marker_wait_timeout=to_right_type(self.get_parameter_from_db("marker_wait_timeout")),
+        )
+
+
+    def get_http_fetcher_for_fetch_mode(self) -> HttpFetcher:
+        """Get the HTTP fetcher to give to the detectors according to the fetch_mode parameter : the fetcher in "auto" mode, None in "selenium" mode."""
+        fetch_mode = self.get_parameter_from_db("fetch_mode")
+        if fetch_mode == "auto":
+            return self.http_fetcher
+        elif fetch_mode == "selenium":
+            return None
+        else:
+            print(f"Warning : unknown fetch_mode {fetch_mode}, using the browser only.")
+            return None
+
+
+    def apply_check_result(self, check_result : CheckResult):
+        """Apply the side effects of the check of a ticket : alert and removal from the watch list if sold out, backoff of its site if the check failed
+        (with a single message when the site gets paused, and another one when it is resumed). The failed fetch of a listing page counts as a failure of its site.
+        A sold out verdict is not acted upon while the online learning suspects the markers of its site to be broken : the ticket is kept and an error is alerted.
+        This is the only place where check results modify the database or send messages, and it is called from the main loop's thread.
+
+        Args:
+            check_result (CheckResult): the result of the check of a ticket
+        """
+        ticket_url = check_result.url
+        site = check_result.site if check_result.site is not None else "unknown"
+        if check_result.error is not None:
+            self.scheduler.update_signals(ticket_url, site=check_result.site)
+            self.scheduler.reschedule(ticket_url)
+            # Errors are reported once per site, when the site is paused
+            checked_page = "listing" if check_result.is_listing else "ticket"
+            print(f"Error : Exception while checking {checked_page} {ticket_url} : {check_result.error}")
+            if self.rate_limiter.record_failure(site, error=str(check_result.error)):
+                open_duration = self.get_parameter_from_db("circuit_open_duration")
+                message = f"Error : site {site} is paused for {open_duration} seconds after too many consecutive errors. Last error, on {checked_page} {ticket_url} : {check_result.error}"
+                print(message)
+                self.db_interface.queue_alert(ALERT_ERROR, message)
+                self.alert_sender.notify()
+            return
+        # Validate the markers with the page before acting on its verdict : the learner may find that they drifted
+        marker_message = None
+        if check_result.marker_candidates is not None:
+            try:
+                marker_message = self.marker_learner.observe(check_result, url_to_detector(ticket_url).available_marker_matcher.markers)
+            except Exception as e:
+                print(f"Error : Exception while learning the markers of ticket {ticket_url} : {e}")
+        is_held = check_result.is_soldout and check_result.marker_candidates is not None and self.marker_learner.are_markers_suspect(site)
+        if check_result.is_soldout and not is_held:
+            self.scheduler.remove(ticket_url)
+            self.listing_index.remove(ticket_url)
+        else:
+            self.scheduler.update_signals(ticket_url, site=check_result.site, event_date=check_result.event_date, content_hash=check_result.content_hash)
+            self.scheduler.reschedule(ticket_url)
+        if self.rate_limiter.record_success(site):
+            print(f"Site {site} is resumed.")
+            self.db_interface.queue_alert(ALERT_INFO, f"Info : site {site} is resumed.")
+            self.alert_sender.notify()
+        if check_result.listing_url is not None and self.listing_index.set(ticket_url, check_result.listing_url):
+            self.db_interface.set_listing_url(ticket_url, check_result.listing_url)
+        if marker_message is not None:
+            # Reported once, until the markers agree again
+            marker_message += f" Sold out verdicts of this site are ignored until then (see /markers {site})."
+            print(marker_message)
+            self.db_interface.queue_alert(ALERT_ERROR, marker_message)
+            self.alert_sender.notify()
+        if is_held:
+            # Reported once per ticket, until its verdict changes
+            print(f"Ticket {ticket_url} seems sold out, but the markers of site {site} may be broken : it is kept in the watch list.")
+            if ticket_url not in self.held_soldout_urls:
+                self.held_soldout_urls.add(ticket_url)
+                self.db_interface.queue_alert(
+                    ALERT_ERROR, 
+                    f"Error : ticket {ticket_url} seems sold out, but the markers of site {site} may be broken : it is kept in the watch list. "
+                    f"Check it and label it with /label {ticket_url} available or soldout.",
+                )
+                self.alert_sender.notify()
+            return
+        self.held_soldout_urls.discard(ticket_url)
+        if check_result.is_soldout:
+            # Queue a single alert for all the aliases of the event and remove them from the watch list, in the same transaction
+            # (unless they were removed meanwhile). The checked url is the canonical url of the event
+            print(f"Ticket {ticket_url} is sold out ! (checked with {check_result.fetch_path})")
+            alias_urls = self.db_interface.get_aliases(ticket_url) or [ticket_url]
+            if len(alias_urls) == 1:
+                alert_text = f"Ticket {alias_urls[0]} is sold out !"
+            else:
+                alert_text = f"Ticket {ticket_url} is sold out ! Watched as :\n" + "\n".join(f"- {alias_url}" for alias_url in alias_urls)
+            if self.db_interface.queue_alert(ALERT_SOLDOUT, alert_text, removed_canonical_url=ticket_url):
+                self.alert_sender.notify()
+
+
+    def collect_metrics(self) -> List[Metric]:
+        """Collect the metrics served by the metrics endpoint, from the counters of the modules. Called from the thread of the endpoint, at each scrape."""
+        check_counts, check_durations = self.check_engine.get_check_counters()
+        driver_pool_stats = self.driver_pool.get_stats()
+        page_cache_stats = self.page_cache.get_stats()
+        listing_counts = self.check_engine.get_listing_counters()
+        tier_counts = self.check_engine.get_tier_counters()
+        n_writes, write_duration_total = self.db_interface.get_write_stats()
+        checks = Metric("soldout_checks_total", METRIC_COUNTER, "Number of checks, by site and outcome.")
+        for (site, outcome), count in sorted(check_counts.items()):
+            checks.add(count, {"site" : site, "outcome" : outcome})
+        checks_by_tier = Metric("soldout_checks_by_tier_total", METRIC_COUNTER, "Number of successful checks, by site and tier that settled them.")
+        for (site, tier), count in sorted(tier_counts.items()):
+            checks_by_tier.add(count, {"site" : site, "tier" : TIER_NAMES[tier]})
+        check_duration = Metric("soldout_check_duration_seconds", METRIC_SUMMARY, "Duration of the checks, by site.")
+        for site, duration_total in sorted(check_durations.items()):
+            check_duration.add(duration_total, {"site" : site}, suffix="_sum")
+            check_duration.add(sum(count for (count_site, _), count in check_counts.items() if count_site == site), {"site" : site}, suffix="_count")
+        return [
+            Metric("soldout_pass_duration_seconds", METRIC_GAUGE, "Time taken by the last pass over all the watched tickets.").add(
+                self.last_pass_duration if self.last_pass_duration is not None else float("nan")
+            ),
+            Metric("soldout_scheduler_lag_seconds", METRIC_GAUGE, "How overdue the most overdue ticket is.").add(self.scheduler.get_lag()),
+            Metric("soldout_tickets_watched", METRIC_GAUGE, "Number of tickets in the schedule.").add(self.scheduler.get_n_scheduled()),
+            checks,
+            checks_by_tier,
+            check_duration,
+            Metric("soldout_driver_pool_drivers", METRIC_GAUGE, "Number of webdrivers, by state.")
+                .add(driver_pool_stats["leased"], {"state" : "leased"})
+                .add(driver_pool_stats["idle"], {"state" : "idle"}),
+            Metric("soldout_driver_pool_utilization_ratio", METRIC_GAUGE, "Ratio of the maximum number of webdrivers that are leased.").add(
+                driver_pool_stats["leased"] / driver_pool_stats["max_size"] if driver_pool_stats["max_size"] > 0 else 0.0
+            ),
+            Metric("soldout_page_cache_lookups_total", METRIC_COUNTER, "Number of lookups in the page cache, by result.")
+                .add(page_cache_stats["hits"], {"result" : "hit"})
+                .add(page_cache_stats["not_modified"], {"result" : "not_modified"})
+                .add(page_cache_stats["misses"], {"result" : "miss"}),
+            Metric("soldout_page_cache_hit_ratio", METRIC_GAUGE, "Ratio of the checks answered by the page cache.").add(page_cache_stats["hit_ratio"]),
+            Metric("soldout_listings_fetched_total", METRIC_COUNTER, "Number of listing pages fetched to check several events at once.").add(
+                listing_counts["listings"]
+            ),
+            Metric("soldout_listing_events_total", METRIC_COUNTER, "Number of events of the fetched listings, by whether the listing answered.")
+                .add(listing_counts["answered"], {"result" : "answered"})
+                .add(listing_counts["fallbacks"], {"result" : "fallback"}),
+            Metric("soldout_alert_outbox_depth", METRIC_GAUGE, "Number of alerts waiting to be sent.").add(self.db_interface.get_outbox_depth()),
+            Metric("soldout_db_write_duration_seconds", METRIC_SUMMARY, "Duration of the database writes, including their wait in the writer queue.")
+                .add(write_duration_total, suffix="_sum")
+                .add(n_writes, suffix="_count"),
+        ]
 
 
     def idle(self):
@@ -214,6 +649,7 @@ class TelegramBot():
             return
         
         answer_message = ""
+        ticket_urls_to_add = []
         for ticket_url in args:
             # Check if ticket is already in watch list
             if self.is_ticket_existing(ticket_url):
@@ -224,9 +660,13 @@ class TelegramBot():
             if detector is None:
                 answer_message += f"Error : Site not detected for ticket {ticket_url}.\n"
                 continue
-            # Add ticket to watch list
-            self.db_interface.execute(f"INSERT INTO tickets_url (url) VALUES (?)", (ticket_url,))
-            self.db_interface.commit()
+            ticket_urls_to_add.append((ticket_url, detector.canonicalize(ticket_url)))
+        # Add tickets to watch list, in a single transaction. An alias of an event already watched is not checked again
+        canonical_urls = dict(ticket_urls_to_add)
+        for ticket_url in self.db_interface.add_tickets(ticket_urls_to_add):
+            canonical_url = canonical_urls[ticket_url]
+            if self.shard_coordinator.owns(canonical_url):
+                self.scheduler.add(canonical_url)
             answer_message += f"Info : Ticket {ticket_url} added to watch list.\n"
         
         update.message.reply_text(answer_message, disable_web_page_preview=True)
@@ -243,15 +683,18 @@ class TelegramBot():
             return
         
         answer_message = ""
+        ticket_urls_to_remove = []
         for ticket_url in args:
             # Check if ticket is in watch list
             if not self.is_ticket_existing(ticket_url):
                 answer_message += f"Warning : Ticket {ticket_url} not in watch list.\n"
                 continue
-            # Remove ticket from watch list
-            self.db_interface.execute(f"DELETE FROM tickets_url WHERE url = ?", (ticket_url,))
-            self.db_interface.commit()
+            ticket_urls_to_remove.append(ticket_url)
+        # Remove tickets from watch list, in a single transaction
+        for ticket_url in self.db_interface.remove_tickets(ticket_urls_to_remove):
             answer_message += f"Info : Ticket {ticket_url} removed from watch list.\n"
+        # The events are still checked while they have other aliases
+        self.scheduler.sync(self.get_owned_ticket_urls())
 
         update.message.reply_text(answer_message, disable_web_page_preview=True)
 
@@ -288,12 +731,19 @@ class TelegramBot():
             else:
                 ticket_line += f"Site : {detector.get_name()}, "
                 try:
-                    if detector.is_soldout(url=ticket_url, driver=self.driver):
+                    answer = detector.check(
+                        url=ticket_url, 
+                        driver_pool=self.driver_pool, 
+                        http_fetcher=self.get_http_fetcher_for_fetch_mode(), 
+                        page_cache=self.page_cache,
+                        max_render_age=self.get_max_render_age(),
+                    )
+                    if answer.is_soldout:
                         # Case 2 : sold out
-                        ticket_line += "Status : sold out."
+                        ticket_line += f"Status : sold out (checked with {answer.fetch_path}, tier {TIER_NAMES[answer.tier]})."
                     else:
                         # Case 3 : available
-                        ticket_line += "Status : available."
+                        ticket_line += f"Status : available (checked with {answer.fetch_path}, tier {TIER_NAMES[answer.tier]})."
                 except Exception as e:
                     # Case 4 : error during check
                     ticket_line += f"Status : error : {e}"
@@ -305,35 +755,88 @@ class TelegramBot():
 
     @command_execution_method
     def execute_list(self, update : Update, context : CallbackContext):
-        """List the tickets in the watch list."""
+        """List the tickets in the watch list, the last added first, by pages of n tickets."""
         message_text = update.message.text
         command_signature, *args = message_text.split()
-        if len(args) >= 2:
-            update.message.reply_text("Error : Invalid number of arguments (should be 0 or 1)", disable_web_page_preview=True)
+        if len(args) >= 3:
+            update.message.reply_text("Error : Invalid number of arguments (should be 0, 1 or 2)", disable_web_page_preview=True)
             return
         
-        if len(args) == 1:
-            try:
-                n_last_tickets = int(args[0])
-            except:
-                update.message.reply_text(f"Error : Invalid argument {args[0]} (should be an integer)", disable_web_page_preview=True)
-                return
-        else:
-            n_last_tickets = sys.maxsize
+        try:
+            n_tickets_per_page = int(args[0]) if len(args) >= 1 else LIST_PAGE_SIZE
+            page = int(args[1]) if len(args) == 2 else 1
+        except ValueError:
+            update.message.reply_text(f"Error : Invalid arguments {' '.join(args)} (should be integers)", disable_web_page_preview=True)
+            return
+        if n_tickets_per_page <= 0 or page <= 0:
+            update.message.reply_text("Error : The number of tickets and the page should be positive", disable_web_page_preview=True)
+            return
         
-        tickets_urls = self.get_ticket_urls()
-        if len(tickets_urls) == 0:
+        n_tickets = self.db_interface.get_n_tickets()
+        if n_tickets == 0:
             update.message.reply_text("Watch list is empty.")
             return
                 
-        tickets_urls = self.get_ticket_urls()
-        answer = "Tickets watched:\n"
-        for ticket_url in tickets_urls[:n_last_tickets]:
-            answer += f"- {ticket_url}\n"
+        tickets = self.db_interface.get_tickets_page(limit=n_tickets_per_page, offset=(page - 1) * n_tickets_per_page)
+        n_pages = (n_tickets + n_tickets_per_page - 1) // n_tickets_per_page
+        answer = f"Tickets watched (page {page}/{n_pages}, {n_tickets} tickets, last added first):\n"
+        for ticket_url, added_at in tickets:
+            answer += f"- {ticket_url} (added {format_added_at(added_at) or 'before dates were recorded'})\n"
         update.message.reply_text(answer, disable_web_page_preview=True)
 
 
 
+    @command_execution_method
+    def execute_import(self, update : Update, context : CallbackContext):
+        """Add the tickets of a file of the machine (one url per line) to the watch list."""
+        message_text = update.message.text
+        command_signature, *args = message_text.split()
+        if len(args) != 1:
+            update.message.reply_text(
+                "Error : Invalid number of arguments (should be the path of a file, or send the file with the caption /import)", disable_web_page_preview=True,
+            )
+            return
+        
+        with open(args[0], "r", encoding="utf-8") as f:
+            import_report = import_tickets(self.db_interface, f)
+        self.scheduler.sync(self.get_owned_ticket_urls())
+        # The urls are not listed, so that the content of files of the machine is not displayed
+        update.message.reply_text(f"Import of {args[0]} : {import_report.format(list_invalid_urls=False)}", disable_web_page_preview=True)
+
+
+
+    @command_execution_method
+    def execute_import_document(self, update : Update, context : CallbackContext):
+        """Add the tickets of a file sent in the chat with the caption /import (one url per line) to the watch list."""
+        document = update.message.document
+        content = document.get_file().download_as_bytearray().decode("utf-8", errors="replace")
+        import_report = import_tickets(self.db_interface, content.splitlines())
+        self.scheduler.sync(self.get_owned_ticket_urls())
+        update.message.reply_text(f"Import of {document.file_name} : {import_report.format()}", disable_web_page_preview=True)
+
+
+
+    @command_execution_method
+    def execute_export(self, update : Update, context : CallbackContext):
+        """Send the watch list as a file, one "url,date added" line per ticket."""
+        message_text = update.message.text
+        command_signature, *args = message_text.split()
+        if len(args) != 0:
+            update.message.reply_text("Error : Invalid number of arguments (should be exactly 0)", disable_web_page_preview=True)
+            return
+        
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "watchlist.csv")
+            with open(path, "w", encoding="utf-8") as f:
+                n_tickets = export_tickets(self.db_interface, f)
+            if n_tickets == 0:
+                update.message.reply_text("Watch list is empty.")
+                return
+            with open(path, "rb") as f:
+                update.message.reply_document(document=f, filename="watchlist.csv", caption=f"{n_tickets} tickets watched.")
+
+
+
     @command_execution_method
     def execute_status(self, update : Update, context : CallbackContext):
         """Display the status of the bot : if it is running, the number of tickets watched, and the parameters."""
@@ -345,8 +848,20 @@ class TelegramBot():
         
         tickets_urls = self.get_ticket_urls()
         parameter_dict = self.get_parameters()
+        page_cache_stats = self.page_cache.get_stats()
         answer = "Bot is running.\n"
-        answer += f"Tickets watched: {len(tickets_urls)}\n\n"
+        answer += f"Tickets watched: {len(tickets_urls)}\n"
+        if self.shard_coordinator.enabled:
+            answer += f"Machines: {', '.join(self.shard_coordinator.live_nodes)} (this one : {self.shard_coordinator.node_name}, checking {self.scheduler.get_n_scheduled()} tickets)\n"
+        answer += f"Alerts waiting to be sent: {self.db_interface.get_outbox_depth()}\n"
+        answer += f"Paused sites: {', '.join(self.rate_limiter.get_paused_domains()) or 'none'}\n"
+        answer += f"Page cache: {page_cache_stats['hits']} hits, {page_cache_stats['not_modified']} not modified, {page_cache_stats['misses']} misses (hit ratio {page_cache_stats['hit_ratio']:.0%})\n"
+        tier_counts = self.check_engine.get_tier_counters()
+        answer += "Checks by tier: " + ", ".join(
+            f"{sum(count for (_, count_tier), count in tier_counts.items() if count_tier == tier)} {tier_name}" for tier, tier_name in TIER_NAMES.items()
+        ) + "\n"
+        listing_counts = self.check_engine.get_listing_counters()
+        answer += f"Listing checks: {listing_counts['listings']} listings fetched, {listing_counts['answered']} events answered, {listing_counts['fallbacks']} checked on their own page\n\n"
         answer += "Parameters:\n"
         for parameter_name, parameter_value in parameter_dict.items():
             answer += f"- {parameter_name}: {parameter_value}\n"
@@ -354,6 +869,123 @@ class TelegramBot():
 
 
 
+    @command_execution_method
+    def execute_stats(self, update : Update, context : CallbackContext):
+        """Display statistics of the checks of each site over the last hours : checks per minute, error rate, median and 95th percentile latency."""
+        message_text = update.message.text
+        command_signature, *args = message_text.split()
+        if len(args) > 1:
+            update.message.reply_text("Error : Invalid number of arguments (should be 0 or 1)", disable_web_page_preview=True)
+            return
+        n_hours = float(args[0]) if len(args) == 1 else 1
+        if n_hours <= 0:
+            update.message.reply_text("Error : The number of hours should be positive", disable_web_page_preview=True)
+            return
+
+        # Recent checks are computed from the raw history, older ones from the hourly rollups
+        now = time()
+        since = now - n_hours * 3600
+        retention = to_right_type(self.get_parameter_from_db("history_retention_hours")) * 3600
+        if n_hours * 3600 <= retention:
+            site_stats = get_site_stats_from_history(self.db_interface.get_check_history(since))
+        else:
+            raw_since = (now - retention) // 3600 * 3600
+            site_stats = merge_site_stats(
+                get_site_stats_from_rollups(self.db_interface.get_check_rollups(since, raw_since)),
+                get_site_stats_from_history(self.db_interface.get_check_history(raw_since)),
+            )
+        if len(site_stats) == 0:
+            update.message.reply_text(f"No checks in the last {n_hours:g} hours.", disable_web_page_preview=True)
+            return
+        answer = f"Checks of the last {n_hours:g} hours:\n"
+        for site, stats in sorted(site_stats.items()):
+            answer += (
+                f"- {site}: {stats.n_checks} checks ({stats.n_checks / (n_hours * 60):.2f}/min), error rate {stats.get_error_rate():.1%}, "
+                f"latency p50 {stats.latency_p50:.2f}s, p95 {stats.latency_p95:.2f}s\n"
+            )
+        update.message.reply_text(answer, disable_web_page_preview=True)
+
+
+
+    @command_execution_method
+    def execute_profile(self, update : Update, context : CallbackContext):
+        """Display the stages of the checks and of the main loop which took the most time, reset the measures, 
+        or sample the checks of the next pass with cProfile."""
+        message_text = update.message.text
+        command_signature, *args = message_text.split()
+        if len(args) > 1 or (len(args) == 1 and args[0] not in ("reset", "sample")):
+            update.message.reply_text("Error : Invalid arguments (should be nothing, \"reset\" or \"sample\")", disable_web_page_preview=True)
+            return
+
+        if args == ["reset"]:
+            profiler.reset()
+            update.message.reply_text("Profiling measures are reset.", disable_web_page_preview=True)
+            return
+        if args == ["sample"]:
+            n_checks = max(1, len(self.get_ticket_urls()))
+            path = profiler.request_sampling(n_checks)
+            update.message.reply_text(f"The next {n_checks} checks will be profiled with cProfile, into the file {path}.", disable_web_page_preview=True)
+            return
+        
+        stages = profiler.get_hottest_stages(PROFILE_N_STAGES)
+        if not profiler.enabled:
+            answer = "Profiling is disabled (see the profiling parameter).\n"
+        elif len(stages) == 0:
+            answer = "No stage was measured yet.\n"
+        else:
+            answer = "Hottest stages:\n"
+            for stage, histogram in stages:
+                answer += (
+                    f"- {stage}: {histogram.total:.1f}s in total, {histogram.count} times, "
+                    f"mean {histogram.get_mean() * 1000:.1f}ms, p95 {histogram.get_percentile(95) * 1000:.1f}ms, max {histogram.max * 1000:.1f}ms\n"
+                )
+        if profiler.is_sampling():
+            answer += "A cProfile sampling is in progress.\n"
+        if profiler.last_sample_path is not None:
+            answer += f"Last cProfile file: {profiler.last_sample_path}\n"
+        update.message.reply_text(answer, disable_web_page_preview=True)
+
+
+
+    @command_execution_method
+    def execute_markers(self, update : Update, context : CallbackContext):
+        """Display what the online learning learned about the markers of a site (given by its name or the url of a ticket) : 
+        the scores of the markers of its detector and the best candidate markers."""
+        message_text = update.message.text
+        command_signature, *args = message_text.split()
+        if len(args) != 1:
+            update.message.reply_text("Error : Invalid number of arguments (should be 1)", disable_web_page_preview=True)
+            return
+        detector = detector_registry.get_detector_by_name(args[0]) or url_to_detector(args[0])
+        if detector is None:
+            update.message.reply_text(f"Error : Unknown site {args[0]}", disable_web_page_preview=True)
+            return
+        answer = self.marker_learner.get_report(detector.get_name(), detector.available_marker_matcher.markers)
+        if not to_right_type(self.get_parameter_from_db("online_learning")):
+            answer += "Online learning is disabled (see the online_learning parameter).\n"
+        update.message.reply_text(answer, disable_web_page_preview=True)
+
+
+
+    @command_execution_method
+    def execute_label(self, update : Update, context : CallbackContext):
+        """Label the last checked page of a ticket as available or soldout, e.g. to correct a wrong verdict, for the online learning of the markers."""
+        message_text = update.message.text
+        command_signature, *args = message_text.split()
+        if len(args) != 2 or args[1] not in ("available", "soldout"):
+            update.message.reply_text("Error : Invalid arguments (should be an url and \"available\" or \"soldout\")", disable_web_page_preview=True)
+            return
+        ticket_url, label = args
+        # The pages are checked, and so kept, under the canonical urls of the events
+        if not self.marker_learner.label(get_canonical_url(ticket_url), is_available=label == "available"):
+            update.message.reply_text(
+                f"Error : No page of ticket {ticket_url} was checked since the bot started with online learning enabled", disable_web_page_preview=True,
+            )
+            return
+        update.message.reply_text(f"The last page of ticket {ticket_url} is labelled {label}.", disable_web_page_preview=True)
+
+
+
     # ========== Admin commands ========== #
 
     @command_execution_method
@@ -375,8 +1007,14 @@ class TelegramBot():
         if parameter_value == parameter_value_old:
             update.message.reply_text(f"Parameter {parameter_name} value unchanged ({parameter_value})", disable_web_page_preview=True)
             return
+        # Check if the value is valid
+        typed_value = to_right_type(parameter_value)
+        if parameter_name in POSITIVE_PARAMETERS and (isinstance(typed_value, bool) or not isinstance(typed_value, (int, float)) or typed_value <= 0):
+            update.message.reply_text(f"Error : Parameter {parameter_name} must be a positive number", disable_web_page_preview=True)
+            return
         # Change the parameter value
         self.set_parameter_in_db(parameter_name, parameter_value)
+        self.notify_state_change()
         update.message.reply_text(f"Parameter {parameter_name} value changed from {parameter_value_old} to {parameter_value}")
 
 
@@ -412,6 +1050,8 @@ class TelegramBot():
         
         self.db_interface.remove_tables()
         self.db_interface.create_tables()
+        self.scheduler.sync(self.get_owned_ticket_urls())
+        self.notify_state_change()
         update.message.reply_text("Database is reset.")
         print("Database is reset.")
 
@@ -427,6 +1067,7 @@ class TelegramBot():
             return
         
         self.set_parameter_in_db("stop", "True")
+        self.notify_state_change()
         update.message.reply_text("Stopping the program. The program will then have to be restarted manually from the machine.", disable_web_page_preview=True)
         print("Stopping the program. The program will then have to be restarted manually from the machine.")
 
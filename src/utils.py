@@ -1,4 +1,5 @@
-from typing import Any, Dict, List
+import math
+from typing import Dict, Optional, Sequence
 
 
 
@@ -21,16 +22,57 @@ def to_right_type(string : str):
                 return string  # Return string if it can't be converted to a number
             
 
+def parse_weights(string : str) -> Dict[str, float]:
+    """Parse a parameter of the form "name1:weight1,name2:weight2" into a dict. An empty string gives an empty dict.
+
+    Args:
+        string (str): the string to parse
+
+    Returns:
+        Dict[str, float]: the weights, by name
+    """
+    weights = {}
+    for item in string.split(","):
+        if item.strip() == "":
+            continue
+        name, weight = item.rsplit(":", 1)
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+def get_percentile(values : Sequence[float], q : float) -> Optional[float]:
+    """Get the q-th percentile of some values (nearest-rank method), or None if there are no values.
+
+    Args:
+        values (Sequence[float]): the values
+        q (float): the percentile, between 0 and 100
+
+    Returns:
+        Optional[float]: the percentile
+    """
+    if len(values) == 0:
+        return None
+    sorted_values = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
 
 command_signature_to_description : Dict[str, str] = {
     "/help" : "Display this message",
     "/watch <url1> <url2> ..." : "Add one or more tickets' urls to the watchlist",
     "/unwatch <url1> <url2> ..." : "Remove one or more tickets' urls from the watchlist",
-    "/list [n]" : "List the n last tickets that were watched (list all tickets if n not specified)",
+    "/list [n] [page]" : "List the tickets watched, the last added first, n per page (50 if not specified)",
+    "/import <path>" : "Add the tickets of a file of the machine to the watchlist, one url per line (or send a file with the caption /import)",
+    "/export" : "Get the watchlist as a file",
     "/check <url1> <url2> ..." : "Check the availability of one or more tickets' urls",
     "/set <parameter name> <value>" : "Set a parameter to a new value",
     "/get <parameter name>" : "Get the value of a parameter",
     "/status" : "Get the status of the bot",
+    "/profile [reset|sample]" : "Get the stages taking the most time, reset the measures, or profile the next pass with cProfile",
+    "/stats [hours]" : "Get the checks per minute, error rate and latency of each site over the last hours (1 if not specified)",
+    "/markers <site or url>" : "Get the learned scores of the markers of a site, and the best candidate markers",
+    "/label <url> <available|soldout>" : "Label the last checked page of a ticket, for the online learning of the markers",
     "/reset_db" : "Delete the whole database (tickets and parameters) and recreate a new one",
     "/print <anything>" : "Print this command in the console",
     "/stop" : "Stop the program. The program will then have to be restarted manually from the machine",
@@ -0,0 +1,116 @@
+from datetime import datetime
+import re
+from typing import Iterable, List, Optional, TextIO
+
+from src.interface_database import DBInterface
+from src.web_scraping import url_to_detector
+
+
+
+class ImportReport:
+    """The result of the import of a list of tickets : the number of urls read, the number of tickets added,
+    and the urls ignored because they were duplicates or because their site is not detected."""
+    def __init__(self, n_read : int, n_added : int, n_duplicates : int, invalid_urls : List[str]):
+        self.n_read = n_read
+        self.n_added = n_added
+        self.n_duplicates = n_duplicates
+        self.invalid_urls = invalid_urls
+
+    def format(self, list_invalid_urls : bool = True) -> str:
+        """Get the (user destined) summary of the import, listing the first urls whose site is not detected if list_invalid_urls is True."""
+        report = (
+            f"{self.n_read} urls read : {self.n_added} tickets added, {self.n_read - self.n_duplicates - len(self.invalid_urls) - self.n_added} already watched, "
+            f"{self.n_duplicates} duplicates in the list, {len(self.invalid_urls)} sites not detected."
+        )
+        if self.invalid_urls and list_invalid_urls:
+            report += "\nSites not detected :\n" + "\n".join(f"- {url}" for url in self.invalid_urls[:10])
+            if len(self.invalid_urls) > 10:
+                report += f"\n... and {len(self.invalid_urls) - 10} others."
+        return report
+
+
+
+# The date added, as written by export_tickets() after the last comma of each line (empty if unknown)
+EXPORTED_DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}|")
+
+def read_ticket_urls(lines : Iterable[str]) -> Iterable[str]:
+    """Read the urls of a list of tickets, one per line. Empty lines and lines starting with "#" are skipped, and the date added
+    that export_tickets() writes after the last comma is dropped, so that its files can be imported. Urls are never split on their own commas."""
+    for line in lines:
+        line = line.strip()
+        if line == "" or line.startswith("#"):
+            continue
+        if "," in line:
+            ticket_url, last_field = line.rsplit(",", 1)
+            if EXPORTED_DATE_PATTERN.fullmatch(last_field.strip()):
+                line = ticket_url.strip()
+        if line != "":
+            yield line.split()[0]
+
+def import_tickets(db_interface : DBInterface, lines : Iterable[str]) -> ImportReport:
+    """Add the tickets of a list to the watch list : the urls are validated and deduplicated in memory, then inserted in a single transaction.
+
+    Args:
+        db_interface (DBInterface): the database
+        lines (Iterable[str]): the lines of the list, one url per line
+
+    Returns:
+        ImportReport: the numbers of urls read and added, and the urls whose site is not detected
+    """
+    seen_urls = set()
+    tickets = []
+    invalid_urls = []
+    n_read = 0
+    for ticket_url in read_ticket_urls(lines):
+        n_read += 1
+        if ticket_url in seen_urls:
+            continue
+        seen_urls.add(ticket_url)
+        detector = url_to_detector(ticket_url)
+        if detector is None:
+            invalid_urls.append(ticket_url)
+        else:
+            tickets.append((ticket_url, detector.canonicalize(ticket_url)))
+    n_added = db_interface.import_tickets(tickets) if tickets else 0
+    return ImportReport(n_read, n_added, n_read - len(seen_urls), invalid_urls)
+
+def get_canonical_url(ticket_url : str) -> str:
+    """Get the canonical url of a ticket, i.e. the url of its event shared by all its aliases, or the url itself if its site is not detected."""
+    detector = url_to_detector(ticket_url)
+    return detector.canonicalize(ticket_url) if detector is not None else ticket_url
+
+def canonicalize_watchlist(db_interface : DBInterface) -> int:
+    """Set the canonical url of the tickets whose canonical url is missing (tickets added before canonical urls existed) or outdated 
+    (the rules of their site changed), so that the aliases of an event are merged and distinct events are not.
+
+    Returns:
+        int: the number of tickets canonicalized
+    """
+    tickets = []
+    for ticket_url, previous_canonical_url in db_interface.get_ticket_canonical_urls():
+        canonical_url = get_canonical_url(ticket_url)
+        if canonical_url != previous_canonical_url:
+            tickets.append((ticket_url, canonical_url))
+    if tickets:
+        db_interface.set_canonical_urls(tickets)
+    return len(tickets)
+
+def export_tickets(db_interface : DBInterface, file : TextIO) -> int:
+    """Write the watch list to a file, one "url,date added" line per ticket, the first added first. The tickets are streamed from the database.
+
+    Args:
+        db_interface (DBInterface): the database
+        file (TextIO): the file to write to
+
+    Returns:
+        int: the number of tickets written
+    """
+    n_tickets = 0
+    for ticket_url, added_at in db_interface.iter_tickets():
+        file.write(f"{ticket_url},{format_added_at(added_at)}\n")
+        n_tickets += 1
+    return n_tickets
+
+def format_added_at(added_at : Optional[float]) -> str:
+    """Get the (user destined) date a ticket was added, or "" if it is unknown."""
+    return datetime.fromtimestamp(added_at).isoformat(sep=" ", timespec="seconds") if added_at is not None else ""
@@ -1,30 +1,598 @@
 from abc import ABC, abstractmethod
-from typing import Any
+from contextlib import contextmanager
+from datetime import datetime
+import re
+import threading
+from time import monotonic, time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qsl, quote, urlencode, urljoin, urlsplit, urlunsplit
+import requests
 from selenium import webdriver
 from selenium.webdriver.common.by import By
-from webdriver_manager.firefox import GeckoDriverManager
-import argparse
-from selenium.common.exceptions import NoSuchElementException
-from bs4 import BeautifulSoup
-
-
-def get_driver():
-    return webdriver.Firefox("driver")
-
-def is_in_url_classes(
-    url: str, 
-    element: Any, 
-    driver: webdriver.Firefox
-):
-    driver.get(url)
-    page_source = driver.page_source
-    soup = BeautifulSoup(page_source, "html.parser")
-    tags = soup.find_all(class_=True)
-    classes = [tag["class"] for tag in tags]
-    return element in classes
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.support.ui import WebDriverWait
+try:
+    import psutil
+except ImportError:
+    psutil = None
+from src.http_fetching import HttpFetcher
+from src.page_cache import PageCache, get_content_hash
+from src.html_matching import Marker, MarkerMatcher, parse_listing, MARKER_ID, MARKER_CLASS, MARKER_TEXT
+from src.config import DETECTOR_RULES
+from src.profiling import profiler
+
+
+# Domains blocked by default in lean browser profiles : analytics, ads and tracking
+DEFAULT_BLOCKED_DOMAINS : List[str] = [
+    "google-analytics.com",
+    "googletagmanager.com",
+    "doubleclick.net",
+    "googlesyndication.com",
+    "facebook.net",
+    "connect.facebook.net",
+    "hotjar.com",
+    "newrelic.com",
+    "nr-data.net",
+    "segment.io",
+    "optimizely.com",
+]
+
+DEFAULT_MARKER_WAIT_TIMEOUT = 10
+
+# The date of the event in the schema.org metadata of event pages (JSON-LD or microdata)
+EVENT_DATE_PATTERN = re.compile(r'"startDate"\s*:\s*"([^"]+)"|itemprop="startDate"\s+content="([^"]+)"')
+
+
+
+class BrowserProfile:
+    """The settings of the Firefox instances used for checks. The default profile is lean : headless, without images, media, fonts and stylesheets,
+    with analytics and ads domains blocked, and with an "eager" page load strategy (driver.get returns as soon as the DOM is ready, 
+    detectors then wait explicitly for their marker, for at most marker_wait_timeout seconds).
+
+    Args:
+        headless (bool): whether Firefox runs without a window
+        block_assets (bool): whether images, media, fonts and stylesheets are not downloaded
+        blocked_domains (List[str]): the domains (and their subdomains) to which no request is made
+        page_load_strategy (str): "normal" (wait for the load event), "eager" (wait for the DOM) or "none" (don't wait)
+        marker_wait_timeout (float): the maximum time detectors wait for their marker, in seconds
+    """
+    def __init__(
+        self, 
+        headless : bool = True, 
+        block_assets : bool = True, 
+        blocked_domains : Optional[List[str]] = None,
+        page_load_strategy : str = "eager",
+        marker_wait_timeout : float = DEFAULT_MARKER_WAIT_TIMEOUT,
+    ):
+        if page_load_strategy not in ("normal", "eager", "none"):
+            raise ValueError(f"Unknown page load strategy {page_load_strategy}")
+        self.headless = headless
+        self.block_assets = block_assets
+        self.blocked_domains = blocked_domains if blocked_domains is not None else list(DEFAULT_BLOCKED_DOMAINS)
+        self.page_load_strategy = page_load_strategy
+        self.marker_wait_timeout = marker_wait_timeout
+
+    def __eq__(self, other : object) -> bool:
+        return isinstance(other, BrowserProfile) and vars(self) == vars(other)
+
+    def get_options(self) -> webdriver.FirefoxOptions:
+        """Get the Firefox options implementing this profile."""
+        options = webdriver.FirefoxOptions()
+        options.page_load_strategy = self.page_load_strategy
+        if self.headless:
+            options.add_argument("-headless")
+        if self.block_assets:
+            options.set_preference("permissions.default.image", 2)
+            options.set_preference("permissions.default.stylesheet", 2)
+            options.set_preference("media.autoplay.default", 5)
+            options.set_preference("media.autoplay.blocking_policy", 2)
+            options.set_preference("gfx.downloadable_fonts.enabled", False)
+            options.set_preference("browser.display.use_document_fonts", 0)
+        options.set_preference("network.prefetch-next", False)
+        options.set_preference("network.dns.disablePrefetch", True)
+        if self.blocked_domains:
+            # Requests to blocked domains are sent to a proxy that doesn't exist, through a proxy auto-config script
+            options.set_preference("network.proxy.type", 2)
+            options.set_preference("network.proxy.autoconfig_url", "data:text/javascript," + quote(self.get_proxy_auto_config()))
+        return options
+
+    def get_proxy_auto_config(self) -> str:
+        """Get the proxy auto-config script blocking the requests to the blocked domains."""
+        domains = ", ".join(f'"{domain}"' for domain in self.blocked_domains)
+        return (
+            "function FindProxyForURL(url, host) {"
+            f" var blocked = [{domains}];"
+            " for (var i = 0; i < blocked.length; i++) {"
+            "  if (host == blocked[i] || dnsDomainIs(host, '.' + blocked[i])) { return 'PROXY 127.0.0.1:9'; }"
+            " }"
+            " return 'DIRECT';"
+            "}"
+        )
+
+
+def get_driver(profile : Optional[BrowserProfile] = None):
+    if profile is None:
+        profile = BrowserProfile()
+    return webdriver.Firefox("driver", options=profile.get_options())
+
+def get_marker_wait_timeout(driver : webdriver.Firefox) -> float:
+    """Get the maximum time to wait for a marker with this driver, from its browser profile."""
+    profile = getattr(driver, "profile", None)
+    return profile.marker_wait_timeout if profile is not None else DEFAULT_MARKER_WAIT_TIMEOUT
+
+def load_page(driver : webdriver.Firefox, url : str):
+    """Load a page and wait until its DOM is parsed, whatever the page load strategy of the driver 
+    (with the "none" strategy, driver.get can return before the browser even left the previous page).
+
+    Args:
+        driver (webdriver.Firefox): the webdriver to use
+        url (str): the url of the page
+    """
+    # Flag the current document, so that the previous page is not mistaken for the new one
+    try:
+        driver.execute_script("window.__previous_page = true;")
+    except WebDriverException:
+        pass
+    with profiler.measure("driver.get"):
+        driver.get(url)
+    is_new_page_parsed = lambda driver: driver.execute_script("return window.__previous_page !== true && document.readyState !== 'loading';")
+    try:
+        with profiler.measure("driver.wait_for_page"):
+            WebDriverWait(driver, get_marker_wait_timeout(driver), poll_frequency=0.1).until(is_new_page_parsed)
+    except TimeoutException:
+        pass
+
+def get_and_wait_for_element(driver : webdriver.Firefox, url : str, by : Optional[str], value : Optional[str], timeout : Optional[float] = None) -> bool:
+    """Load a page and wait until an element is present, or until the page is completely loaded without it.
+    Waiting is explicit, so that it works with the "eager" and "none" page load strategies.
+
+    Args:
+        driver (webdriver.Firefox): the webdriver to use
+        url (str): the url of the page
+        by (Optional[str]): the locator strategy of the element, e.g. By.ID, or None to wait until the page is completely loaded
+        value (Optional[str]): the locator of the element
+        timeout (Optional[float], optional): the maximum time to wait, in seconds. Defaults to None (the marker_wait_timeout of the driver's profile).
+
+    Returns:
+        bool: whether the element is present in the page
+    """
+    load_page(driver, url)
+
+    def element_or_complete_page(driver : webdriver.Firefox) -> Optional[str]:
+        if by is not None and driver.find_elements(by, value):
+            return "present"
+        if driver.execute_script("return document.readyState;") == "complete":
+            return "absent"
+        return None
+
+    try:
+        with profiler.measure("driver.wait_for_marker"):
+            timeout = timeout if timeout is not None else get_marker_wait_timeout(driver)
+            return WebDriverWait(driver, timeout, poll_frequency=0.1).until(element_or_complete_page) == "present"
+    except TimeoutException:
+        return False
+
+
+
+class PooledDriver:
+    """A webdriver leased from a DriverPool. It can be used exactly as the webdriver it wraps, and counts its page loads so that the pool knows when to recycle it."""
+    def __init__(self, driver : webdriver.Firefox, profile : Optional[BrowserProfile] = None):
+        self.driver = driver
+        self.profile = profile
+        self.n_page_loads = 0
+        self.created_at = monotonic()
+
+    def get(self, url : str):
+        self.n_page_loads += 1
+        return self.driver.get(url)
+
+    def __getattr__(self, name : str):
+        return getattr(self.driver, name)
+
+
+
+class DriverPool:
+    """A pool of webdrivers. Drivers are leased to one user at a time and returned after use, which bounds the number of Firefox processes.
+    Drivers are probed before being leased and restarted if they crashed, and they are recycled after max_page_loads page loads
+    or when their processes use more than max_memory_mb megabytes (only if psutil is installed, a warning is printed otherwise).
+    All drivers are started with the browser profile of the pool, and are recycled when it changes.
+
+    Usage :
+        with driver_pool.lease() as driver:
+            detector.is_soldout(url, driver)
+    """
+    def __init__(
+        self, 
+        min_size : int = 1, 
+        max_size : int = 4, 
+        max_page_loads : int = 200, 
+        max_memory_mb : float = 1500, 
+        profile : Optional[BrowserProfile] = None,
+        driver_factory : Callable[[BrowserProfile], webdriver.Firefox] = get_driver,
+    ):
+        self.driver_factory = driver_factory
+        self.profile = profile if profile is not None else BrowserProfile()
+        self.condition = threading.Condition()
+        self.idle_drivers : List[PooledDriver] = []
+        self.n_drivers = 0  # number of drivers alive, idle or leased
+        self.n_leased = 0
+        self.closed = False
+        self.warned_memory_unmeasured = False
+        self.set_limits(min_size, max_size, max_page_loads, max_memory_mb)
+
+    def set_limits(self, min_size : int, max_size : int, max_page_loads : int, max_memory_mb : float):
+        """Set the size limits and the recycling thresholds of the pool, and start drivers until min_size drivers are alive.
+
+        Args:
+            min_size (int): the number of drivers kept alive even when unused
+            max_size (int): the maximum number of drivers alive at the same time
+            max_page_loads (int): the number of page loads after which a driver is recycled
+            max_memory_mb (float): the memory, in MB, above which a driver is recycled
+        """
+        with self.condition:
+            self.max_size = max(1, int(max_size))
+            self.min_size = min(max(0, int(min_size)), self.max_size)
+            self.max_page_loads = int(max_page_loads)
+            self.max_memory_mb = float(max_memory_mb)
+            if psutil is None and self.max_memory_mb > 0 and not self.warned_memory_unmeasured:
+                self.warned_memory_unmeasured = True
+                print(f"Warning : psutil is not installed, the memory of the drivers is not measured and driver_max_memory_mb ({self.max_memory_mb:g} MB) is ignored. Install it with pip install psutil.")
+            # Quit idle drivers in excess
+            drivers_in_excess = []
+            while self.idle_drivers and self.n_drivers > self.max_size:
+                drivers_in_excess.append(self.idle_drivers.pop())
+                self.n_drivers -= 1
+            self.condition.notify_all()
+        for pooled_driver in drivers_in_excess:
+            self.quit_driver(pooled_driver)
+        self.fill()
+
+    def fill(self):
+        """Start drivers until min_size drivers are alive."""
+        while True:
+            with self.condition:
+                if self.closed or self.n_drivers >= self.min_size:
+                    return
+                self.n_drivers += 1
+            pooled_driver = self.create_driver()
+            self.release(pooled_driver, lease=False)
+
+    def create_driver(self) -> PooledDriver:
+        """Start a new driver. The caller must have already counted it in n_drivers."""
+        try:
+            profile = self.profile
+            return PooledDriver(self.driver_factory(profile), profile)
+        except Exception:
+            with self.condition:
+                self.n_drivers -= 1
+                self.condition.notify_all()
+            raise
+
+    def acquire(self, timeout : Optional[float] = None) -> PooledDriver:
+        """Lease a driver, waiting for one to be available if the pool is at max_size. Prefer the lease() context manager.
+
+        Args:
+            timeout (Optional[float], optional): the maximum time to wait for a driver, in seconds. Defaults to None (wait forever).
+
+        Raises:
+            TimeoutError: if no driver became available in time
+
+        Returns:
+            PooledDriver: a live driver, that must be given back with release()
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            with self.condition:
+                pooled_driver = None
+                while pooled_driver is None:
+                    if self.closed:
+                        raise RuntimeError("The driver pool is closed")
+                    if self.idle_drivers:
+                        pooled_driver = self.idle_drivers.pop()
+                    elif self.n_drivers < self.max_size:
+                        self.n_drivers += 1
+                        break
+                    else:
+                        remaining = None if deadline is None else deadline - monotonic()
+                        if remaining is not None and remaining <= 0:
+                            raise TimeoutError("No driver available in the driver pool")
+                        self.condition.wait(remaining)
+                self.n_leased += 1
+            if pooled_driver is None:
+                try:
+                    return self.create_driver()
+                except Exception:
+                    with self.condition:
+                        self.n_leased -= 1
+                    raise
+            # Liveness probe : restart the driver if it crashed
+            if pooled_driver.profile is not self.profile:
+                self.release(pooled_driver, discard=True)
+            elif self.is_alive(pooled_driver):
+                return pooled_driver
+            else:
+                print("Warning : a webdriver of the pool crashed, restarting it.")
+                self.release(pooled_driver, discard=True)
+
+    def release(self, pooled_driver : PooledDriver, discard : bool = False, lease : bool = True):
+        """Give back a leased driver to the pool. It is quit instead if it is discarded or has to be recycled.
+
+        Args:
+            pooled_driver (PooledDriver): the driver given back
+            discard (bool, optional): whether the driver is known to be broken. Defaults to False.
+            lease (bool, optional): whether the driver was leased (False for drivers freshly started by fill()). Defaults to True.
+        """
+        if not discard and self.needs_recycling(pooled_driver):
+            discard = True
+        with self.condition:
+            if lease:
+                self.n_leased -= 1
+            if discard or self.closed or self.n_drivers > self.max_size:
+                self.n_drivers -= 1
+            else:
+                self.idle_drivers.append(pooled_driver)
+                pooled_driver = None
+            self.condition.notify()
+        if pooled_driver is not None:
+            self.quit_driver(pooled_driver)
+            if not discard:
+                return
+            self.fill()
+
+    @contextmanager
+    def lease(self, timeout : Optional[float] = None) -> Iterator[PooledDriver]:
+        """Lease a driver for the duration of a with block.
+
+        Args:
+            timeout (Optional[float], optional): the maximum time to wait for a driver, in seconds. Defaults to None (wait forever).
+
+        Yields:
+            Iterator[PooledDriver]: a live driver
+        """
+        with profiler.measure("driver.acquire"):
+            pooled_driver = self.acquire(timeout)
+        discard = False
+        try:
+            yield pooled_driver
+        except WebDriverException:
+            discard = not self.is_alive(pooled_driver)
+            raise
+        finally:
+            self.release(pooled_driver, discard=discard)
+
+    def is_alive(self, pooled_driver : PooledDriver) -> bool:
+        """Probe a driver, returning False if its browser crashed or is not responding."""
+        try:
+            pooled_driver.driver.execute_script("return 1;")
+            return True
+        except Exception:
+            return False
+
+    def get_memory_mb(self, pooled_driver : PooledDriver) -> Optional[float]:
+        """Get the memory used by the processes of a driver (geckodriver and its browser), or None if it can't be measured."""
+        if psutil is None:
+            return None
+        try:
+            process = psutil.Process(pooled_driver.driver.service.process.pid)
+            processes = [process] + process.children(recursive=True)
+            return sum(p.memory_info().rss for p in processes) / 2**20
+        except Exception:
+            return None
+
+    def set_profile(self, profile : BrowserProfile):
+        """Change the browser profile. Drivers started with the previous profile are recycled when they are leased or given back."""
+        with self.condition:
+            if profile != self.profile:
+                self.profile = profile
+
+    def needs_recycling(self, pooled_driver : PooledDriver) -> bool:
+        """Return True if the driver made too many page loads, uses too much memory, or was started with a previous profile."""
+        if pooled_driver.profile is not self.profile:
+            return True
+        if pooled_driver.n_page_loads >= self.max_page_loads:
+            return True
+        memory_mb = self.get_memory_mb(pooled_driver)
+        return memory_mb is not None and memory_mb > self.max_memory_mb
+
+    def quit_driver(self, pooled_driver : PooledDriver):
+        try:
+            pooled_driver.driver.quit()
+        except Exception as e:
+            print(f"Warning : could not quit webdriver : {e}")
+
+    def get_stats(self) -> dict:
+        """Get the number of drivers alive, leased and idle."""
+        with self.condition:
+            return {"alive" : self.n_drivers, "leased" : self.n_leased, "idle" : len(self.idle_drivers), "max_size" : self.max_size}
+
+    def close(self):
+        """Quit the idle drivers. Drivers still leased are quit when they are given back."""
+        with self.condition:
+            self.closed = True
+            idle_drivers, self.idle_drivers = self.idle_drivers, []
+            self.n_drivers -= len(idle_drivers)
+            self.condition.notify_all()
+        for pooled_driver in idle_drivers:
+            self.quit_driver(pooled_driver)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def extract_event_date(page_source : str) -> Optional[datetime]:
+    """Extract the date of the event from the schema.org metadata (JSON-LD or microdata "startDate") that ticket sites embed in their event pages.
+
+    Args:
+        page_source (str): the HTML of the event page
+
+    Returns:
+        Optional[datetime]: the (timezone aware) date of the event, or None if not found
+    """
+    match = EVENT_DATE_PATTERN.search(page_source)
+    if match is None:
+        return None
+    date_string = match.group(1) or match.group(2)
+    try:
+        event_date = datetime.fromisoformat(date_string.strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if event_date.tzinfo is None:
+        event_date = event_date.astimezone()
+    return event_date
+
+# Fetch paths, i.e. the way a check was answered
+FETCH_PATH_HTTP = "http"
+FETCH_PATH_SELENIUM = "selenium"
+FETCH_PATH_LISTING = "listing"
+
+# Tiers of the checks, from the cheapest : the page didn't change since the last verdict (not modified, or same server-rendered content),
+# the markers were matched in the server-rendered HTML, or the page was rendered in the browser
+TIER_UNCHANGED = 0
+TIER_STATIC = 1
+TIER_BROWSER = 2
+TIER_NAMES : Dict[int, str] = {TIER_UNCHANGED : "unchanged", TIER_STATIC : "static", TIER_BROWSER : "browser"}
+
+# The time during which a verdict given by the browser is reused while the server-rendered HTML of the page doesn't change, in seconds.
+# A sell out can be missed during this time, which is why it is the default checking interval
+DEFAULT_MAX_RENDER_AGE = 60
+
+# Query parameters that only track where a visitor comes from, and never identify an event
+TRACKING_QUERY_PARAMETERS = {"fbclid", "gclid", "dclid", "msclkid", "mc_cid", "mc_eid", "_ga", "_gl", "ref", "referrer", "source", "aff", "affiliate"}
+TRACKING_QUERY_PARAMETER_PREFIXES = ("utm_",)
+
+def canonicalize_url(url : str, query_parameters : Optional[List[str]] = None) -> str:
+    """Get the canonical form of an event url, so that the aliases of an event (with tracking parameters, a fragment, 
+    a different case in the hostname, a trailing slash...) have the same canonical url. The canonical url can be fetched.
+
+    Args:
+        url (str): the url
+        query_parameters (Optional[List[str]], optional): the query parameters identifying an event, the others being dropped. 
+            Defaults to None (only the tracking parameters are dropped).
+
+    Returns:
+        str: the canonical url, with a lowercase scheme and hostname, no default port, no fragment, no trailing slash and sorted query parameters
+    """
+    parts = urlsplit(url.strip() if "//" in url else "https://" + url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme, netloc.rsplit(":", 1)[-1]) in (("https", "443"), ("http", "80")):
+        netloc = netloc.rsplit(":", 1)[0]
+    path = parts.path.rstrip("/") or "/"
+    query = [
+        (name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if (name in query_parameters if query_parameters is not None else 
+            name.lower() not in TRACKING_QUERY_PARAMETERS and not name.lower().startswith(TRACKING_QUERY_PARAMETER_PREFIXES))
+    ]
+    return urlunsplit((scheme, netloc, path, urlencode(sorted(query)), ""))
+
+# Fetch modes allowed by the detector rules : a plain HTTP request first then the browser if inconclusive, or the browser only
+FETCH_MODE_AUTO = "auto"
+FETCH_MODE_SELENIUM = "selenium"
+
+# Texts revealing that the page obtained with a plain HTTP request is an anti-bot challenge and not the real page : the forms, elements and
+# iframes of the challenge pages themselves, and their titles. Generic texts (e.g. "captcha", "Access Denied") are only looked for in the title,
+# since real pages can contain them anywhere else (a reCAPTCHA in a newsletter form, a FAQ, a noscript block...)
+BOT_CHALLENGE_MARKERS : List[str] = [
+    "cf-chl",                       # Cloudflare challenge scripts and form
+    'id="challenge-form"',          # Cloudflare challenge form
+    'id="px-captcha"',              # PerimeterX block page
+    "captcha-delivery.com",         # DataDome challenge iframe
+    "Incapsula incident ID",        # Imperva block page
+]
+BOT_CHALLENGE_TITLES : List[str] = [
+    "Just a moment...",             # Cloudflare
+    "Attention Required! | Cloudflare",
+    "Access Denied",                # Akamai
+    "Access to this page has been denied",  # PerimeterX
+]
+
+TITLE_PATTERN = re.compile(r"<title[^>]*>(.*?)</title>", re.IGNORECASE | re.DOTALL)
+
+def is_bot_challenge(page_source : str) -> bool:
+    """Return True if a page obtained with a plain HTTP request is an anti-bot challenge and not the real page."""
+    if any(marker in page_source for marker in BOT_CHALLENGE_MARKERS):
+        return True
+    title = TITLE_PATTERN.search(page_source)
+    return title is not None and any(challenge_title in title.group(1) for challenge_title in BOT_CHALLENGE_TITLES)
+
+HREF_PATTERN = re.compile(r"""href\s*=\s*["']([^"']+)["']""", re.IGNORECASE)
+
+def get_marker_selector(markers : List[Marker]) -> Optional[str]:
+    """Get a CSS selector matching the tags having any of the id and class markers (a tag with the classes of a class marker, and maybe others),
+    for the browser to wait for. Text markers can't be waited for : the selector is None if there are only text markers."""
+    selectors = []
+    for marker in markers:
+        if marker.kind == MARKER_ID:
+            selectors.append(f'[id="{marker.value}"]')
+        elif marker.kind == MARKER_CLASS:
+            selectors.append("".join(f'[class~="{class_name}"]' for class_name in sorted(marker.value)))
+    return ", ".join(selectors) if selectors else None
+
+
+
+class ListingRule:
+    """How the events of a site are found in its listing pages (the events of a venue or of a promoter), so that all the watched events
+    of a listing are checked with a single fetch of the listing.
+
+    Args:
+        link_pattern (str): a regular expression matching the links of the event pages to their listing page
+        item_marker (Marker): the marker of the tag of each event in a listing page (id or class, the tag may have other classes)
+        soldout_marker (Marker): the marker whose presence in the tag of an event means that it is soldout
+    """
+    def __init__(self, link_pattern : str, item_marker : Marker, soldout_marker : Marker):
+        if item_marker.kind == MARKER_TEXT:
+            raise ValueError("The item marker of a listing must be an id or class marker")
+        self.link_pattern = re.compile(link_pattern)
+        self.item_marker = item_marker
+        self.soldout_marker = soldout_marker
+        self.item_selector = get_marker_selector([item_marker])
+
+
+
+class CheckAnswer:
+    """The answer of a detector to the check of an event : whether it is soldout, the fetch path that answered (FETCH_PATH_HTTP or FETCH_PATH_SELENIUM),
+    the HTML of the page that was checked and the hash of its content if they are known (a page not modified since the last check is not downloaded),
+    and the tier that settled the check (TIER_UNCHANGED, TIER_STATIC or TIER_BROWSER).
+    """
+    def __init__(
+        self, 
+        is_soldout : bool, 
+        fetch_path : str, 
+        page_source : Optional[str] = None, 
+        content_hash : Optional[str] = None, 
+        tier : int = TIER_STATIC,
+    ):
+        self.is_soldout = is_soldout
+        self.fetch_path = fetch_path
+        self.page_source = page_source
+        self.content_hash = content_hash
+        self.tier = tier
+
+
+
+class StaticProbe:
+    """What a plain HTTP request learned about a page whose markers are rendered by scripts, when it could not settle the check :
+    the hash of its server-rendered content and its HTTP validators, stored in the page cache with the verdict of the browser."""
+    def __init__(self, content_hash : Optional[str], etag : Optional[str] = None, last_modified : Optional[str] = None):
+        self.content_hash = content_hash
+        self.etag = etag
+        self.last_modified = last_modified
+
+
 
 class SoldoutDetector(ABC):
     """Abstract class for soldout detectors"""
+
+    # Whether the marker of the detector is present in the server-rendered HTML of the page, i.e. whether a plain HTTP request is enough to check the event.
+    marker_in_static_html : bool = False
+    # How the events are found in the listing pages of the site, if they can be checked by listing
+    listing_rule : Optional[ListingRule] = None
+    # The maximum time the browser waits for a marker, in seconds (None : the marker_wait_timeout of the driver's profile)
+    wait_timeout : Optional[float] = None
+
     def __init__(self) -> None:
         super().__init__()
     @abstractmethod
@@ -41,79 +609,361 @@ class SoldoutDetector(ABC):
             driver (webdriver.Firefox): the webdriver to use
         """
         raise NotImplementedError("Please Implement this method")
+    def canonicalize(self, url : str) -> str:
+        """Get the canonical url of an event, shared by all the urls of the same event. The tickets of an event are checked with a single fetch of this url.
 
+        Args:
+            url (str): the url of the event
+        """
+        return canonicalize_url(url)
+    def is_soldout_from_html(self, page_source : str) -> bool:
+        """Return True if the event is soldout, False otherwise, from the HTML of the event page. 
+        Only detectors whose marker_in_static_html is True need to implement it.
 
-
-class TicktwebSoldoutDetector(SoldoutDetector):
-    
-    def get_name(self):
-        return "TicketWeb"
+        Args:
+            page_source (str): the HTML of the event page
+        """
+        raise NotImplementedError("Please Implement this method")
     
-    def is_soldout(self, url : str, driver : webdriver.Firefox):
-        driver.get(url)
+    def is_soldout_from_html_cached(self, url : str, page_source : str, page_cache : Optional[PageCache] = None) -> Tuple[bool, str, bool]:
+        """Same as is_soldout_from_html, but the page is not parsed if its normalized content is the same as at the last check.
+
+        Args:
+            url (str): the url of the event
+            page_source (str): the HTML of the event page
+            page_cache (Optional[PageCache], optional): the cache of the verdicts. Defaults to None (always parse).
+
+        Returns:
+            Tuple[bool, str, bool]: whether the event is soldout, the hash of the content of the page, and whether the verdict came from the cache
+        """
+        with profiler.measure("content_hash"):
+            content_hash = get_content_hash(page_source)
+        if page_cache is None:
+            return self.is_soldout_from_html(page_source), content_hash, False
+        is_soldout = page_cache.lookup(url, content_hash)
+        if is_soldout is not None:
+            return is_soldout, content_hash, True
+        is_soldout = self.is_soldout_from_html(page_source)
+        page_cache.store(url, content_hash, is_soldout)
+        return is_soldout, content_hash, False
+
+    def check_with_http(self, url : str, http_fetcher : HttpFetcher, page_cache : Optional[PageCache] = None) -> Optional[CheckAnswer]:
+        """Check the event with a plain HTTP request, conditional if the page is in the cache. The result is None if this is inconclusive 
+        (request failed, status code is not 200 or 304, or the page is an anti-bot challenge), in which case the browser must be used.
+
+        Args:
+            url (str): the url of the event
+            http_fetcher (HttpFetcher): the HTTP fetcher to use
+            page_cache (Optional[PageCache], optional): the cache of the verdicts. Defaults to None.
+
+        Returns:
+            Optional[CheckAnswer]: the answer, or None if inconclusive
+        """
+        headers = page_cache.get_conditional_headers(url) if page_cache is not None else {}
         try:
-            driver.find_element(By.ID, "edp-section-tickets-heading")
-            return False
-        except NoSuchElementException:
-            return True
-    
+            response = http_fetcher.fetch(url, headers=headers)
+        except requests.RequestException:
+            return None
+        if response.status_code == 304 and page_cache is not None:
+            is_soldout = page_cache.get_not_modified_verdict(url)
+            return None if is_soldout is None else CheckAnswer(is_soldout, FETCH_PATH_HTTP, tier=TIER_UNCHANGED)
+        if response.status_code != 200:
+            return None
+        page_source = response.text
+        if is_bot_challenge(page_source):
+            return None
+        is_soldout, content_hash, is_cached = self.is_soldout_from_html_cached(url, page_source, page_cache)
+        if page_cache is not None:
+            page_cache.store_validators(url, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        return CheckAnswer(is_soldout, FETCH_PATH_HTTP, page_source, content_hash, tier=TIER_UNCHANGED if is_cached else TIER_STATIC)
 
+    def probe_with_http(
+        self, url : str, http_fetcher : HttpFetcher, page_cache : PageCache, max_render_age : float,
+    ) -> Tuple[Optional[CheckAnswer], Optional[StaticProbe]]:
+        """Try to settle the check of an event whose markers are rendered by scripts without the browser, with a conditional HTTP request :
+        the last verdict of the browser is reused if the server-rendered HTML didn't change since it was given, less than max_render_age seconds ago,
+        and the event is available if a marker is already in the server-rendered HTML. Their absence settles nothing, since scripts may add them.
 
-class SeeTicketsSoldoutDetector(SoldoutDetector):
-    def get_name(self):
-        return "SeeTickets"
-    
-    def is_soldout(self, url: str, driver: webdriver.Firefox):
-        
-        # Tag identifier method
-        return not is_in_url_classes(url, ['changeMe', 'shipping'], driver)
+        Args:
+            url (str): the url of the event
+            http_fetcher (HttpFetcher): the HTTP fetcher to use
+            page_cache (PageCache): the cache of the verdicts
+            max_render_age (float): the maximum age of a reused verdict of the browser, in seconds
 
-        # Text reading method
-        driver.get(url)
-        page_source = driver.page_source
-        for text_of_soldout_page in [
-            "Event is SOLD OUT",
-            "Tickets are not available",
-            "No recordsNo records",
-            "Tickets available at the box office",
-            ]:
-            if text_of_soldout_page in page_source:
-                return True
-        return False
+        Returns:
+            Tuple[Optional[CheckAnswer], Optional[StaticProbe]]: the answer, or None if the browser is needed, in which case 
+                the probe to store with the verdict of the browser is given if the request succeeded
+        """
+        headers = page_cache.get_conditional_headers(url)
+        try:
+            response = http_fetcher.fetch(url, headers=headers)
+        except requests.RequestException:
+            return None, None
+        if response.status_code == 304:
+            is_soldout = page_cache.get_not_modified_verdict(url, max_render_age=max_render_age)
+            if is_soldout is not None:
+                return CheckAnswer(is_soldout, FETCH_PATH_HTTP, tier=TIER_UNCHANGED), None
+            return None, StaticProbe(page_cache.get_content_hash(url), headers.get("If-None-Match"), headers.get("If-Modified-Since"))
+        if response.status_code != 200:
+            return None, None
+        page_source = response.text
+        if is_bot_challenge(page_source):
+            return None, None
+        with profiler.measure("content_hash"):
+            content_hash = get_content_hash(page_source)
+        is_soldout = page_cache.lookup(url, content_hash, max_render_age=max_render_age)
+        if is_soldout is not None:
+            return CheckAnswer(is_soldout, FETCH_PATH_HTTP, page_source, content_hash, tier=TIER_UNCHANGED), None
+        if not self.is_soldout_from_html(page_source):
+            return CheckAnswer(False, FETCH_PATH_HTTP, page_source, content_hash, tier=TIER_STATIC), None
+        return None, StaticProbe(content_hash, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+
+    def check(
+        self, 
+        url : str, 
+        driver_pool : DriverPool, 
+        http_fetcher : Optional[HttpFetcher] = None, 
+        page_cache : Optional[PageCache] = None,
+        max_render_age : float = DEFAULT_MAX_RENDER_AGE,
+    ) -> CheckAnswer:
+        """Return whether the event is soldout, with the cheapest tier that settles it : a conditional HTTP request showing that the page 
+        didn't change since the last verdict, a match of the markers in the server-rendered HTML, or the browser if they are inconclusive.
+
+        Args:
+            url (str): the url of the event
+            driver_pool (DriverPool): the pool to lease a webdriver from, if the browser is needed
+            http_fetcher (Optional[HttpFetcher], optional): the HTTP fetcher to use. Defaults to None (always use the browser).
+            page_cache (Optional[PageCache], optional): the cache of the verdicts of the HTTP path. Defaults to None.
+            max_render_age (float, optional): if the markers are rendered by scripts, the time during which a verdict of the browser is reused 
+                while the server-rendered HTML doesn't change, in seconds (0 to always use the browser). Defaults to DEFAULT_MAX_RENDER_AGE.
+
+        Returns:
+            CheckAnswer: whether the event is soldout, the fetch path and tier that answered and the HTML of the page
+        """
+        probe = None
+        if http_fetcher is not None and self.marker_in_static_html:
+            answer = self.check_with_http(url, http_fetcher, page_cache)
+            if answer is not None:
+                return answer
+        elif http_fetcher is not None and page_cache is not None and max_render_age > 0:
+            answer, probe = self.probe_with_http(url, http_fetcher, page_cache, max_render_age)
+            if answer is not None:
+                return answer
+        with driver_pool.lease() as driver:
+            is_soldout, page_source = self.check_in_browser(url, driver)
+        if probe is None or probe.content_hash is None:
+            return CheckAnswer(is_soldout, FETCH_PATH_SELENIUM, page_source, tier=TIER_BROWSER)
+        # The verdict is reused while the server-rendered HTML doesn't change, whose hash is also the signal of change given to the scheduler
+        page_cache.store(url, probe.content_hash, is_soldout, rendered_at=time())
+        page_cache.store_validators(url, probe.etag, probe.last_modified)
+        return CheckAnswer(is_soldout, FETCH_PATH_SELENIUM, page_source, probe.content_hash, tier=TIER_BROWSER)
+
+    def check_in_browser(self, url : str, driver : webdriver.Firefox) -> Tuple[bool, str]:
+        """Return whether the event is soldout and the HTML of the page, using the browser."""
+        is_soldout = self.is_soldout(url, driver)
+        with profiler.measure("driver.page_source"):
+            page_source = driver.page_source
+        return is_soldout, page_source
+
+    def get_listing_url(self, url : str, page_source : str) -> Optional[str]:
+        """Get the url of the listing page of an event, from the first link of its page matching the link pattern of the listing rule.
+
+        Args:
+            url (str): the url of the event
+            page_source (str): the HTML of the event page
+
+        Returns:
+            Optional[str]: the canonical url of the listing page, or None if the site has no listing rule or the page links to no listing
+        """
+        if self.listing_rule is None:
+            return None
+        for href in HREF_PATTERN.findall(page_source):
+            if self.listing_rule.link_pattern.search(href):
+                return canonicalize_url(urljoin(url, href))
+        return None
+
+    def get_listing_verdicts(self, listing_url : str, page_source : str) -> Dict[str, Optional[bool]]:
+        """Get whether each event of a listing page is soldout. An event linked from several items with different verdicts is ambiguous.
+
+        Args:
+            listing_url (str): the url of the listing page
+            page_source (str): the HTML of the listing page
+
+        Returns:
+            Dict[str, Optional[bool]]: whether each event is soldout (None if ambiguous), by canonical url
+        """
+        verdicts : Dict[str, Optional[bool]] = {}
+        for links, is_soldout in parse_listing(page_source, self.listing_rule.item_marker, self.listing_rule.soldout_marker):
+            for event_url in {self.canonicalize(urljoin(listing_url, link)) for link in links}:
+                verdicts[event_url] = is_soldout if verdicts.get(event_url, is_soldout) == is_soldout else None
+        return verdicts
+
+    def check_listing(self, listing_url : str, driver_pool : DriverPool, http_fetcher : Optional[HttpFetcher] = None) -> Tuple[Dict[str, Optional[bool]], str]:
+        """Fetch a listing page, with a plain HTTP request if possible and the browser otherwise, and get whether each of its events is soldout.
 
+        Args:
+            listing_url (str): the url of the listing page
+            driver_pool (DriverPool): the pool to lease a webdriver from, if the browser is needed
+            http_fetcher (Optional[HttpFetcher], optional): the HTTP fetcher to use. Defaults to None (always use the browser).
+
+        Returns:
+            Tuple[Dict[str, Optional[bool]], str]: whether each event is soldout (see get_listing_verdicts), and the fetch path used
+        """
+        if self.listing_rule is None:
+            raise ValueError(f"The detector of {self.get_name()} has no listing rule")
+        if http_fetcher is not None and self.marker_in_static_html:
+            try:
+                response = http_fetcher.fetch(listing_url)
+                if response.status_code == 200 and not is_bot_challenge(response.text):
+                    return self.get_listing_verdicts(listing_url, response.text), FETCH_PATH_HTTP
+            except requests.RequestException:
+                pass
+        with driver_pool.lease() as driver:
+            get_and_wait_for_element(driver, listing_url, By.CSS_SELECTOR, self.listing_rule.item_selector, timeout=self.wait_timeout)
+            with profiler.measure("driver.page_source"):
+                page_source = driver.page_source
+        return self.get_listing_verdicts(listing_url, page_source), FETCH_PATH_SELENIUM
+
+
+
+class RuleBasedSoldoutDetector(SoldoutDetector):
+    """A soldout detector defined by a rule of DETECTOR_RULES : the event is available if any of the markers is in its page.
+    All the markers are matched in a single pass over the page. In the browser, the detector waits until one of the id or class markers
+    is present, or until the page is completely loaded, then matches the markers on the page source.
+
+    Args:
+        name (str): the name of the site
+        markers (List[Marker]): the markers whose presence means that the event is available
+        fetch_mode (str): FETCH_MODE_AUTO if the markers are in the server-rendered HTML, FETCH_MODE_SELENIUM otherwise
+        wait_timeout (Optional[float], optional): the maximum time to wait for a marker in the browser, in seconds.
+            Defaults to None (the marker_wait_timeout of the driver's profile).
+        query_parameters (Optional[List[str]], optional): the query parameters identifying an event, kept in the canonical urls.
+            Defaults to None (all the parameters but the tracking ones).
+        listing_rule (Optional[ListingRule], optional): how the events are found in the listing pages of the site. Defaults to None (no listing checks).
+    """
+    def __init__(
+        self, 
+        name : str, 
+        markers : List[Marker], 
+        fetch_mode : str, 
+        wait_timeout : Optional[float] = None, 
+        query_parameters : Optional[List[str]] = None,
+        listing_rule : Optional[ListingRule] = None,
+    ):
+        super().__init__()
+        if len(markers) == 0:
+            raise ValueError(f"The detector of {name} has no marker")
+        if fetch_mode not in (FETCH_MODE_AUTO, FETCH_MODE_SELENIUM):
+            raise ValueError(f"Unknown fetch mode {fetch_mode} for the detector of {name}")
+        self.name = name
+        self.available_marker_matcher = MarkerMatcher(markers)
+        self.marker_in_static_html = fetch_mode == FETCH_MODE_AUTO
+        self.wait_timeout = wait_timeout
+        self.query_parameters = query_parameters
+        self.listing_rule = listing_rule
+        # A CSS selector matching the tags of any of the id and class markers, that the browser waits for
+        self.marker_selector = get_marker_selector(markers)
 
-class EtixSoldoutDetector(SoldoutDetector):
     def get_name(self):
-        return "Etix"
-    
+        return self.name
+
+    def canonicalize(self, url : str) -> str:
+        return canonicalize_url(url, self.query_parameters)
+
     def is_soldout(self, url : str, driver : webdriver.Firefox):
-        driver.get(url)
-        try:
-            driver.find_element(By.ID, "normal-price-code")
-            return False
-        except NoSuchElementException:
-            return True
-        
+        return self.check_in_browser(url, driver)[0]
+
+    def is_soldout_from_html(self, page_source : str) -> bool:
+        return not self.available_marker_matcher.matches(page_source)
+
+    def check_in_browser(self, url : str, driver : webdriver.Firefox) -> Tuple[bool, str]:
+        by = By.CSS_SELECTOR if self.marker_selector is not None else None
+        get_and_wait_for_element(driver, url, by, self.marker_selector, timeout=self.wait_timeout)
+        with profiler.measure("driver.page_source"):
+            page_source = driver.page_source
+        return self.is_soldout_from_html(page_source), page_source
 
-        
-def url_to_detector(url : str) -> SoldoutDetector:
-    """This function try to extract the site name from the url, and return the corresponding SoldoutDetector object
+
+
+class DetectorRegistry:
+    """The soldout detectors, compiled once from rules (see DETECTOR_RULES) and indexed by hostname, so that finding the detector of an url
+    takes a few dictionary lookups (one per level of its hostname) whatever the number of sites. Each site has a single detector instance,
+    shared by all the checks.
+    """
+    def __init__(self, rules : List[Dict[str, Any]]):
+        self.host_to_detector : Dict[str, SoldoutDetector] = {}
+        # The detectors of the hosts given as "name.*", i.e. the domain name under any top-level domain
+        self.label_to_detector : Dict[str, SoldoutDetector] = {}
+        self.name_to_detector : Dict[str, SoldoutDetector] = {}
+        for rule in rules:
+            listing = rule.get("listing")
+            detector = RuleBasedSoldoutDetector(
+                name=rule["name"],
+                markers=[Marker(marker["kind"], marker["value"]) for marker in rule["markers"]],
+                fetch_mode=rule.get("fetch_mode", FETCH_MODE_SELENIUM),
+                wait_timeout=rule.get("wait_timeout"),
+                query_parameters=rule.get("query_parameters"),
+                listing_rule=ListingRule(
+                    link_pattern=listing["link_pattern"],
+                    item_marker=Marker(listing["item"]["kind"], listing["item"]["value"]),
+                    soldout_marker=Marker(listing["soldout"]["kind"], listing["soldout"]["value"]),
+                ) if listing is not None else None,
+            )
+            self.register(detector, rule["hosts"])
+
+    def register(self, detector : SoldoutDetector, hosts : List[str]):
+        """Add a detector, used for the urls of the given hostnames and of their subdomains. A hostname "name.*" matches the domain name
+        under any top-level domain of one or two labels (e.g. "seetickets.*" matches seetickets.eu and seetickets.co.uk)."""
+        if detector.get_name() in self.name_to_detector:
+            raise ValueError(f"There are several detectors named {detector.get_name()}")
+        self.name_to_detector[detector.get_name()] = detector
+        for host in hosts:
+            host = host.lower().strip(".")
+            host_to_detector = self.host_to_detector
+            if host.endswith(".*"):
+                host, host_to_detector = host[:-2], self.label_to_detector
+            if host in host_to_detector:
+                raise ValueError(f"Host {host} is in the rules of both {host_to_detector[host].get_name()} and {detector.get_name()}")
+            host_to_detector[host] = detector
+
+    def get_detector(self, url : str) -> Optional[SoldoutDetector]:
+        """Get the detector of an url, from its hostname or the closest of its parent domains, or None if the site is not supported."""
+        hostname = urlsplit(url if "//" in url else "//" + url).hostname
+        if hostname is None:
+            return None
+        labels = hostname.split(".")
+        for start in range(len(labels)):
+            detector = self.host_to_detector.get(".".join(labels[start:]))
+            if detector is not None:
+                return detector
+        # The domain name followed by a top-level domain of one or two labels
+        for start in range(max(0, len(labels) - 3), len(labels) - 1):
+            detector = self.label_to_detector.get(labels[start])
+            if detector is not None:
+                return detector
+        return None
+
+    def get_detector_by_name(self, name : str) -> Optional[SoldoutDetector]:
+        """Get the detector of a site from its name (case insensitive), or None if there is no such site."""
+        detector = self.name_to_detector.get(name)
+        if detector is None:
+            detector = next((detector for detector_name, detector in self.name_to_detector.items() if detector_name.lower() == name.lower()), None)
+        return detector
+
+    def get_detectors(self) -> List[SoldoutDetector]:
+        return list(self.name_to_detector.values())
+
+
+
+detector_registry = DetectorRegistry(DETECTOR_RULES)
+
+def url_to_detector(url : str) -> Optional[SoldoutDetector]:
+    """Get the soldout detector of the site of an url.
 
     Args:
-        url (str): the url to extract the site name from
+        url (str): the url of the event
 
     Returns:
-        SoldoutDetector: the corresponding SoldoutDetector object
+        Optional[SoldoutDetector]: the detector of the site, or None if the site is not supported
     """
-    
-    if "www.ticketweb.com" in url:
-        return TicktwebSoldoutDetector()
-    
-    elif "seetickets" in url:
-        return SeeTicketsSoldoutDetector()
-    
-    elif "etix.com" in url:
-        return EtixSoldoutDetector()
-    
-    else:
-        return None
\ No newline at end of file
+    return detector_registry.get_detector(url)
@@ -0,0 +1,76 @@
+import sqlite3
+import threading
+
+import pytest
+
+from src.alert_outbox import AlertSender, ALERT_ERROR, ALERT_SOLDOUT
+from src.interface_database import DBInterface
+
+
+TICKET_URL = "https://www.etix.com/ticket/p/1/show"
+
+
+@pytest.fixture
+def db_interface(tmp_path):
+    db_interface = DBInterface(str(tmp_path / "database.db"))
+    yield db_interface
+    db_interface.close()
+
+
+def test_queue_alert_removes_the_ticket_with_the_alert(db_interface):
+    db_interface.add_tickets([(TICKET_URL, TICKET_URL)])
+    assert db_interface.queue_alert(ALERT_SOLDOUT, "sold out", removed_canonical_url=TICKET_URL)
+    assert db_interface.get_ticket_urls() == []
+    assert [alert[1:3] for alert in db_interface.get_pending_alerts()] == [(ALERT_SOLDOUT, "sold out")]
+
+
+def test_queue_alert_is_queued_once_for_an_event(db_interface):
+    db_interface.add_tickets([(TICKET_URL, TICKET_URL), (TICKET_URL + "?utm_source=x", TICKET_URL)])
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(db_interface.queue_alert(ALERT_SOLDOUT, "sold out", removed_canonical_url=TICKET_URL)))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(results) == [False] * 7 + [True]
+    assert db_interface.get_outbox_depth() == 1
+    assert db_interface.get_ticket_urls() == []
+
+
+def test_queue_alert_keeps_the_ticket_if_the_alert_is_not_queued(db_interface, tmp_path):
+    db_interface.add_tickets([(TICKET_URL, TICKET_URL)])
+    conn = sqlite3.connect(str(tmp_path / "database.db"))
+    conn.execute("CREATE TRIGGER fail_alerts BEFORE INSERT ON alert_outbox BEGIN SELECT RAISE(ABORT, 'outbox unavailable'); END")
+    conn.commit()
+    conn.close()
+    with pytest.raises(sqlite3.DatabaseError):
+        db_interface.queue_alert(ALERT_SOLDOUT, "sold out", removed_canonical_url=TICKET_URL)
+    assert db_interface.get_ticket_urls() == [TICKET_URL]
+    assert db_interface.get_outbox_depth() == 0
+
+
+def test_sender_survives_database_errors(db_interface):
+    sent = []
+    sender = AlertSender(db_interface, send_message=sent.append, window=0.01, min_send_interval=0, max_backoff=0.05)
+    claim_alerts = db_interface.claim_alerts
+    n_calls = []
+    def failing_claim_alerts(*args):
+        n_calls.append(None)
+        if len(n_calls) <= 2:
+            raise sqlite3.OperationalError("database is locked")
+        return claim_alerts(*args)
+    db_interface.claim_alerts = failing_claim_alerts
+    db_interface.queue_alert(ALERT_ERROR, "error")
+    sender.start()
+    try:
+        for _ in range(200):
+            if sent:
+                break
+            threading.Event().wait(0.01)
+    finally:
+        sender.stop()
+    assert sent == ["error"]
+    assert db_interface.get_outbox_depth() == 0
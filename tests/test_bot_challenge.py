@@ -0,0 +1,29 @@
+from src.web_scraping import is_bot_challenge
+
+
+def test_page_embedding_a_recaptcha_is_not_a_challenge():
+    page_source = """<html><head><title>Concert - Tickets</title>
+    <script src="https://www.google.com/recaptcha/api.js" async defer></script></head>
+    <body><div class="ticket-type">Standing</div>
+    <form id="newsletter"><input type="email" name="email"><div class="g-recaptcha" data-sitekey="abc"></div></form>
+    </body></html>"""
+    assert not is_bot_challenge(page_source)
+
+
+def test_challenge_pages_are_detected():
+    cloudflare_page = """<html><head><title>Just a moment...</title></head>
+    <body><form id="challenge-form" action="/?__cf_chl_f_tk=abc" method="POST"></form></body></html>"""
+    perimeterx_page = """<html><head><title>Access to this page has been denied</title></head><body><div id="px-captcha"></div></body></html>"""
+    datadome_page = """<html><body><iframe src="https://geo.captcha-delivery.com/captcha/?initialCid=abc"></iframe></body></html>"""
+    for page_source in (cloudflare_page, perimeterx_page, datadome_page):
+        assert is_bot_challenge(page_source)
+
+
+def test_generic_texts_only_count_in_the_title():
+    page_source = """<html><head><title>Concert - Tickets</title></head><body><div id="buy">Buy</div>
+    <noscript>Please enable JS to see the seat map</noscript>
+    <div class="faq">Access Denied at the door ? Request unsuccessful refunds are handled by the promoter.</div>
+    <script>var errors = {denied : "Access Denied"};</script></body></html>"""
+    assert not is_bot_challenge(page_source)
+    assert is_bot_challenge("<html><head><title>Access Denied</title></head><body>You don't have permission to access this page.</body></html>")
+    assert is_bot_challenge('<html><body><iframe id="main-iframe">Request unsuccessful. Incapsula incident ID: 123</iframe></body></html>')
@@ -0,0 +1,61 @@
+from src.web_scraping import canonicalize_url, url_to_detector
+
+
+def test_canonicalize_url_normalizes_aliases():
+    canonical_url = "https://www.etix.com/ticket/p/123/show"
+    for url in [
+        "https://www.etix.com/ticket/p/123/show",
+        "HTTPS://WWW.Etix.com/ticket/p/123/show/",
+        "https://www.etix.com:443/ticket/p/123/show#tickets",
+        "https://www.etix.com/ticket/p/123/show?utm_source=newsletter&fbclid=abc",
+    ]:
+        assert canonicalize_url(url) == canonical_url
+
+
+def test_canonicalize_url_sorts_and_keeps_identifying_query_parameters():
+    assert canonicalize_url("https://example.com/e?b=2&a=1&utm_medium=x") == "https://example.com/e?a=1&b=2"
+
+
+def test_canonicalize_url_keeps_non_default_port_and_path_case():
+    assert canonicalize_url("http://Example.com:8080/Event/A") == "http://example.com:8080/Event/A"
+
+
+def test_canonicalize_url_with_query_parameters_whitelist():
+    url = "https://example.com/e?id=1&session=abc"
+    assert canonicalize_url(url, query_parameters=["id"]) == "https://example.com/e?id=1"
+    assert canonicalize_url(url, query_parameters=[]) == "https://example.com/e"
+
+
+def test_distinct_events_identified_by_query_stay_distinct():
+    urls = [
+        "https://www.etix.com/ticket/online/performanceSale.do?performance_id=123",
+        "https://www.etix.com/ticket/online/performanceSale.do?performance_id=456",
+    ]
+    canonical_urls = {url_to_detector(url).canonicalize(url) for url in urls}
+    assert canonical_urls == {
+        "https://www.etix.com/ticket/online/performanceSale.do?performance_id=123",
+        "https://www.etix.com/ticket/online/performanceSale.do?performance_id=456",
+    }
+
+
+def test_detectors_keep_event_query_parameters():
+    for url in [
+        "https://www.ticketweb.com/event/show?eventId=1",
+        "https://www.seetickets.us/event/show?eventId=1",
+    ]:
+        assert url_to_detector(url).canonicalize(url) != url_to_detector(url).canonicalize(url.replace("eventId=1", "eventId=2"))
+
+
+def test_canonicalize_watchlist_splits_wrongly_merged_events(tmp_path):
+    from src.interface_database import DBInterface
+    from src.watchlist_io import canonicalize_watchlist
+    db_interface = DBInterface(str(tmp_path / "database.db"))
+    try:
+        merged_url = "https://www.etix.com/ticket/online/performanceSale.do"
+        urls = [merged_url + "?performance_id=123", merged_url + "?performance_id=456"]
+        db_interface.add_tickets([(url, merged_url) for url in urls])
+        assert canonicalize_watchlist(db_interface) == 2
+        assert sorted(db_interface.get_canonical_urls()) == urls
+        assert canonicalize_watchlist(db_interface) == 0
+    finally:
+        db_interface.close()
@@ -0,0 +1,118 @@
+import pytest
+
+from src import check_engine
+from src.check_engine import CheckEngine
+from src.page_cache import get_content_hash
+from src.web_scraping import CheckAnswer, FETCH_PATH_HTTP, FETCH_PATH_LISTING, FETCH_PATH_SELENIUM, TIER_BROWSER
+
+
+LISTING_URL = "https://www.example.com/venue/1"
+EVENT_URLS = [f"https://www.example.com/event/{i}" for i in range(4)]
+EVENT_PAGE = '<html><head><script type="application/ld+json">{"startDate" : "2030-06-01T20:00:00+02:00"}</script></head><body>Sold out</body></html>'
+
+
+class FakeListingDetector:
+    listing_rule = None
+
+    def __init__(self, verdicts = None, error = None):
+        self.verdicts = verdicts
+        self.error = error
+
+    def get_name(self):
+        return "example"
+
+    def check_listing(self, listing_url, driver_pool, http_fetcher = None):
+        if self.error is not None:
+            raise self.error
+        return self.verdicts, FETCH_PATH_HTTP
+
+
+class FakePageDetector:
+    listing_rule = None
+
+    def __init__(self, answer = None, error = None):
+        self.answer = answer
+        self.error = error
+
+    def get_name(self):
+        return "example"
+
+    def check(self, url, driver_pool, http_fetcher = None, page_cache = None, max_render_age = None):
+        if self.error is not None:
+            raise self.error
+        return self.answer
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    engine = CheckEngine(n_workers=1, driver_pool=None)
+    # The events must not be submitted from the worker, bypassing the rate limiting of the main loop
+    monkeypatch.setattr(engine, "submit", lambda url: pytest.fail("check_listing submitted an event itself"))
+    yield engine
+    engine.close()
+
+
+def test_check_listing_gives_back_the_events_to_check_on_their_own_page(engine, monkeypatch):
+    detector = FakeListingDetector(verdicts={EVENT_URLS[0] : False, EVENT_URLS[1] : True, EVENT_URLS[2] : None})
+    monkeypatch.setattr(check_engine, "url_to_detector", lambda url: detector)
+    check_results = engine.check_listing(LISTING_URL, EVENT_URLS)
+    answered = [check_result for check_result in check_results if not check_result.needs_own_page_check]
+    assert [(check_result.url, check_result.is_soldout, check_result.fetch_path) for check_result in answered] == [
+        (EVENT_URLS[0], False, FETCH_PATH_LISTING)
+    ]
+    assert sorted(check_result.url for check_result in check_results if check_result.needs_own_page_check) == EVENT_URLS[1:]
+    assert not any(check_result.is_listing for check_result in check_results)
+    assert engine.get_listing_counters() == {"listings" : 1, "answered" : 1, "fallbacks" : 3}
+
+
+def test_check_listing_reports_the_failure_of_the_listing(engine, monkeypatch):
+    detector = FakeListingDetector(error=ConnectionError("listing unreachable"))
+    monkeypatch.setattr(check_engine, "url_to_detector", lambda url: detector)
+    check_results = engine.check_listing(LISTING_URL, EVENT_URLS)
+    assert sorted(check_result.url for check_result in check_results if check_result.needs_own_page_check) == EVENT_URLS
+    listing_results = [check_result for check_result in check_results if check_result.is_listing]
+    assert len(listing_results) == 1
+    assert listing_results[0].url == LISTING_URL
+    assert listing_results[0].site == "example"
+    assert isinstance(listing_results[0].error, ConnectionError)
+
+
+def test_run_check_records_the_fetch_path_and_the_signals_of_the_page(engine, monkeypatch):
+    detector = FakePageDetector(answer=CheckAnswer(True, FETCH_PATH_SELENIUM, page_source=EVENT_PAGE, tier=TIER_BROWSER))
+    monkeypatch.setattr(check_engine, "url_to_detector", lambda url: detector)
+    check_result = engine.run_check(EVENT_URLS[0])
+    assert check_result.error is None
+    assert (check_result.is_soldout, check_result.fetch_path, check_result.tier, check_result.site) == (True, FETCH_PATH_SELENIUM, TIER_BROWSER, "example")
+    assert check_result.event_date.isoformat() == "2030-06-01T20:00:00+02:00"
+    assert check_result.content_hash == get_content_hash(EVENT_PAGE)
+    assert not check_result.needs_own_page_check and not check_result.is_listing
+
+
+def test_run_check_turns_the_failure_of_the_detector_into_an_error_result(engine, monkeypatch):
+    detector = FakePageDetector(error=TimeoutError("page too slow"))
+    monkeypatch.setattr(check_engine, "url_to_detector", lambda url: detector)
+    check_result = engine.run_check(EVENT_URLS[0])
+    assert isinstance(check_result.error, TimeoutError)
+    assert (check_result.is_soldout, check_result.fetch_path, check_result.tier, check_result.site) == (None, None, None, "example")
+    assert not check_result.needs_own_page_check
+
+
+def test_run_check_of_an_unknown_site_is_an_error(engine, monkeypatch):
+    monkeypatch.setattr(check_engine, "url_to_detector", lambda url: None)
+    check_result = engine.run_check("https://www.unknown.com/event/1")
+    assert isinstance(check_result.error, ValueError)
+    assert check_result.site is None
+
+
+def test_check_url_counts_the_checks_by_site_and_outcome(engine, monkeypatch):
+    detectors = {
+        EVENT_URLS[0] : FakePageDetector(answer=CheckAnswer(False, FETCH_PATH_HTTP)),
+        EVENT_URLS[1] : FakePageDetector(answer=CheckAnswer(True, FETCH_PATH_HTTP)),
+        EVENT_URLS[2] : FakePageDetector(error=ConnectionError("unreachable")),
+    }
+    monkeypatch.setattr(check_engine, "url_to_detector", lambda url: detectors[url])
+    check_results = list(engine.run_pass(EVENT_URLS[:3]))
+    assert sorted(check_result.url for check_result in check_results) == EVENT_URLS[:3]
+    check_counts, check_durations = engine.get_check_counters()
+    assert check_counts == {("example", "available") : 1, ("example", "soldout") : 1, ("example", "error") : 1}
+    assert set(check_durations) == {"example"}
@@ -0,0 +1,83 @@
+from time import time
+
+import pytest
+
+from src.check_engine import CheckResult
+from src.check_history import get_history_row, get_site_stats_from_history, get_site_stats_from_rollups, merge_site_stats, SiteStats, VERDICT_SOLDOUT
+from src.interface_database import DBInterface
+from src.web_scraping import FETCH_PATH_HTTP
+
+
+TICKET_URL = "https://www.etix.com/ticket/p/1/show"
+
+
+@pytest.fixture
+def db_interface(tmp_path):
+    db_interface = DBInterface(str(tmp_path / "database.db"))
+    yield db_interface
+    db_interface.close()
+
+
+def get_check_rows(site, hour, latencies, n_soldout = 0, n_errors = 0):
+    """Rows of checks of a site spread over an hour, the first n_soldout sold out, the last n_errors failed, the others available."""
+    rows = []
+    for i, latency in enumerate(latencies):
+        if i >= len(latencies) - n_errors:
+            verdict, error_class = None, "TimeoutException"
+        else:
+            verdict, error_class = (1 if i < n_soldout else 0), None
+        rows.append((TICKET_URL, site, hour + i * 3600 / len(latencies), verdict, FETCH_PATH_HTTP, latency, error_class))
+    return rows
+
+
+def test_history_row_of_a_check():
+    check_result = CheckResult(TICKET_URL, is_soldout=True, duration=1.5, fetch_path=FETCH_PATH_HTTP, site="etix")
+    assert get_history_row(check_result, 1000.0) == (TICKET_URL, "etix", 1000.0, VERDICT_SOLDOUT, FETCH_PATH_HTTP, 1.5, None)
+    check_result = CheckResult(TICKET_URL, error=TimeoutError("too slow"), duration=10.0)
+    assert get_history_row(check_result, 1000.0) == (TICKET_URL, "unknown", 1000.0, None, None, 10.0, "TimeoutError")
+
+
+def test_site_stats_from_history():
+    history = [("etix", latency, None) for latency in range(1, 20)] + [("etix", 20, "TimeoutException"), ("seetickets", 3, None)]
+    site_stats = get_site_stats_from_history(history)
+    assert (site_stats["etix"].n_checks, site_stats["etix"].n_errors, site_stats["etix"].latency_p50, site_stats["etix"].latency_p95) == (20, 1, 10, 19)
+    assert site_stats["etix"].get_error_rate() == pytest.approx(0.05)
+    assert (site_stats["seetickets"].n_checks, site_stats["seetickets"].latency_p95) == (1, 3)
+
+
+def test_downsampling_rolls_up_whole_hours_only(db_interface):
+    current_hour = time() // 3600 * 3600
+    old_hour = current_hour - 5 * 3600
+    db_interface.add_check_history(
+        get_check_rows("etix", old_hour, [1.0] * 9 + [10.0], n_soldout=2, n_errors=1)
+        + get_check_rows("seetickets", old_hour, [2.0, 4.0])
+        + get_check_rows("etix", current_hour, [3.0])
+    )
+    # Checks are kept one hour : the checks of the current hour stay raw, whatever the time in the hour
+    db_interface.downsample_check_history(retention=3600, rollup_retention=24 * 3600)
+    assert sorted(db_interface.get_check_rollups(old_hour, current_hour)) == [("etix", 10, 1, 1.0, 10.0), ("seetickets", 2, 0, 2.0, 4.0)]
+    assert db_interface.read("SELECT n_soldout FROM check_history_hourly WHERE site = 'etix'") == [(2,)]
+    assert db_interface.get_check_history(0) == [("etix", 3.0, None)]
+
+
+def test_downsampling_merges_late_checks_and_drops_old_rollups(db_interface):
+    current_hour = time() // 3600 * 3600
+    old_hour, expired_hour = current_hour - 5 * 3600, current_hour - 30 * 3600
+    db_interface.add_check_history(get_check_rows("etix", old_hour, [1.0, 1.0]) + get_check_rows("etix", expired_hour, [1.0]))
+    db_interface.downsample_check_history(retention=3600, rollup_retention=24 * 3600)
+    # Checks of an hour already rolled up, recorded late, are merged into its rollup
+    db_interface.add_check_history(get_check_rows("etix", old_hour, [4.0, 4.0], n_errors=1))
+    db_interface.downsample_check_history(retention=3600, rollup_retention=24 * 3600)
+    assert db_interface.get_check_rollups(0, current_hour) == [("etix", 4, 1, 2.5, 2.5)]
+    assert db_interface.get_check_history(0) == []
+
+
+def test_site_stats_from_rollups_and_history_are_merged():
+    rollups = [("etix", 10, 1, 1.0, 2.0), ("etix", 30, 0, 3.0, 6.0)]
+    rollup_stats = get_site_stats_from_rollups(rollups)
+    assert (rollup_stats["etix"].n_checks, rollup_stats["etix"].n_errors) == (40, 1)
+    assert (rollup_stats["etix"].latency_p50, rollup_stats["etix"].latency_p95) == (pytest.approx(2.5), pytest.approx(5.0))
+    merged_stats = merge_site_stats(rollup_stats, {"etix" : SiteStats(10, 4, 0.5, 1.0), "seetickets" : SiteStats(0, 0, None, None)})
+    assert set(merged_stats) == {"etix"}
+    assert (merged_stats["etix"].n_checks, merged_stats["etix"].n_errors) == (50, 5)
+    assert (merged_stats["etix"].latency_p50, merged_stats["etix"].latency_p95) == (pytest.approx(2.1), pytest.approx(4.2))
@@ -0,0 +1,45 @@
+import pytest
+
+from src.html_matching import Marker
+from src.web_scraping import DetectorRegistry, RuleBasedSoldoutDetector, url_to_detector
+
+
+@pytest.mark.parametrize("url, name", [
+    ("https://www.etix.com/ticket/p/123/show", "Etix"),
+    ("https://ETIX.com/ticket/p/123/show", "Etix"),
+    ("www.etix.com/ticket/p/123/show", "Etix"),
+    ("https://www.ticketweb.com/event/show-123", "TicketWeb"),
+    ("https://wl.seetickets.us/event/show/123", "SeeTickets"),
+    ("https://www.seetickets.com/event/show/123", "SeeTickets"),
+    ("https://www.seetickets.co.uk/event/show/123", "SeeTickets"),
+    ("https://seetickets.eu/event/show/123", "SeeTickets"),
+])
+def test_supported_urls(url, name):
+    assert url_to_detector(url).get_name() == name
+
+
+@pytest.mark.parametrize("url", [
+    "https://www.example.com/event/123",
+    "https://etix.com.evil.org/ticket/p/123/show",
+    "https://notetix.com/ticket/p/123/show",
+    "https://seetickets.evil.example.com/event/show/123",
+    "not an url",
+])
+def test_unsupported_urls(url):
+    assert url_to_detector(url) is None
+
+
+def test_detectors_are_shared():
+    assert url_to_detector("https://www.etix.com/a") is url_to_detector("https://etix.com/b")
+
+
+def test_conflicting_hosts_are_rejected():
+    registry = DetectorRegistry([])
+    registry.register(RuleBasedSoldoutDetector("A", [Marker("id", "a")], "auto"), ["a.com"])
+    with pytest.raises(ValueError):
+        registry.register(RuleBasedSoldoutDetector("B", [Marker("id", "b")], "auto"), ["A.com"])
+
+
+def test_get_detector_by_name_is_case_insensitive():
+    registry = DetectorRegistry([{"name" : "Site", "hosts" : ["site.*"], "markers" : [{"kind" : "id", "value" : "buy"}]}])
+    assert registry.get_detector_by_name("site") is registry.get_detector("https://www.site.fr/e")
@@ -0,0 +1,76 @@
+import random
+
+import numpy as np
+
+from src.discriminators import IdentifierMatrix, StreamingIdentifierCounter
+
+
+def get_corpus(n_pages = 60, seed = 0):
+    """Pages with identifiers in every page, discriminating identifiers (noisy), common identifiers and rare ones."""
+    random_generator = random.Random(seed)
+    pages = []
+    for i in range(n_pages):
+        is_available = i % 3 != 0
+        identifiers = {("id", "header"), ("class", "footer")}
+        if is_available == (random_generator.random() < 0.9):
+            identifiers.add(("id", "buy"))
+        if not is_available and random_generator.random() < 0.7:
+            identifiers.add(("class", "badge soldout"))
+        identifiers |= {("class", f"common-{j}") for j in range(10) if random_generator.random() < 0.5}
+        identifiers |= {("text", f"rare-{random_generator.randrange(1000)}") for _ in range(5)}
+        if i >= n_pages // 2:
+            identifiers.discard(("class", "footer"))  # in every page of the first half only
+        pages.append((identifiers, is_available))
+    return pages
+
+
+def get_top_scores(identifier_counter, n_pages, k):
+    """Get the k best identifiers that are not in every page, with their F1 score and polarity. The identifiers tied with the k-th are left out,
+    since their order depends on the order of the identifiers."""
+    identifiers, scores = identifier_counter.get_scores()
+    n_available, n_soldout = n_pages
+    top_scores = [
+        (identifiers[i], round(float(scores.f1[i]), 9), bool(scores.is_inverted[i])) for i in scores.get_top_k(len(identifiers))
+        if scores.available_counts[i] < n_available or scores.soldout_counts[i] < n_soldout
+    ][:k + 1]
+    return [top_score for top_score in top_scores[:k] if top_score[1] > top_scores[-1][1]]
+
+
+def test_streaming_counts_match_the_matrix():
+    identifier_matrix = IdentifierMatrix()
+    identifier_counter = StreamingIdentifierCounter(min_support=1, min_frequency=0, prune_period=7)
+    for identifiers, is_available in get_corpus():
+        identifier_matrix.add_page(identifiers, is_available)
+        identifier_counter.add_page(identifiers, is_available)
+    assert identifier_counter.get_n_pages() == identifier_matrix.get_n_pages()
+    # The identifier that left the set of the identifiers in every page got exact counts back
+    assert ("class", "footer") in identifier_counter.counts
+    matrix_identifiers, matrix_scores = identifier_matrix.get_scores()
+    n_available, n_soldout = identifier_matrix.get_n_pages()
+    expected_counts = {
+        identifier : [int(soldout_count), int(available_count)] 
+        for identifier, available_count, soldout_count in zip(matrix_identifiers, matrix_scores.available_counts, matrix_scores.soldout_counts)
+        if available_count < n_available or soldout_count < n_soldout
+    }
+    counter_identifiers, _ = identifier_counter.get_scores()
+    assert {identifier : identifier_counter.counts[identifier] for identifier in counter_identifiers} == expected_counts
+    top_scores = get_top_scores(identifier_matrix, (n_available, n_soldout), k=10)
+    assert len(top_scores) >= 3
+    assert get_top_scores(identifier_counter, (n_available, n_soldout), k=10) == top_scores
+
+
+def test_pruning_bounds_the_counters_and_keeps_the_top_k():
+    identifier_matrix = IdentifierMatrix()
+    identifier_counter = StreamingIdentifierCounter(min_support=1, min_frequency=0.05, prune_period=10)
+    n_counters = []
+    for identifiers, is_available in get_corpus(n_pages=300):
+        identifier_matrix.add_page(identifiers, is_available)
+        identifier_counter.add_page(identifiers, is_available)
+        n_counters.append(len(identifier_counter.counts) + len(identifier_counter.in_every_page))
+    # The rare identifiers don't accumulate : at most about 50 new ones per prune period, plus the frequent ones
+    assert max(n_counters[100:]) < 80
+    assert len(identifier_matrix.identifiers) > 700
+    n_pages = identifier_matrix.get_n_pages()
+    top_scores = get_top_scores(identifier_matrix, n_pages, k=5)
+    assert len(top_scores) >= 3
+    assert get_top_scores(identifier_counter, n_pages, k=5) == top_scores
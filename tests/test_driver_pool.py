@@ -0,0 +1,17 @@
+from src import web_scraping
+from src.web_scraping import DriverPool
+
+
+def test_unmeasured_memory_limit_is_warned_once(monkeypatch, capsys):
+    monkeypatch.setattr(web_scraping, "psutil", None)
+    driver_pool = DriverPool(min_size=0, max_memory_mb=1500, driver_factory=lambda profile: None)
+    driver_pool.set_limits(min_size=0, max_size=4, max_page_loads=200, max_memory_mb=1000)
+    assert capsys.readouterr().out.count("psutil is not installed") == 1
+    driver_pool.close()
+
+
+def test_no_warning_without_memory_limit(monkeypatch, capsys):
+    monkeypatch.setattr(web_scraping, "psutil", None)
+    driver_pool = DriverPool(min_size=0, max_memory_mb=0, driver_factory=lambda profile: None)
+    assert "psutil" not in capsys.readouterr().out
+    driver_pool.close()
@@ -0,0 +1,61 @@
+import os
+
+import pytest
+
+from src.config import DETECTOR_RULES
+from src.html_matching import Marker, MarkerMatcher, MARKER_ID, MARKER_CLASS, MARKER_TEXT, BACKEND_HTML_PARSER, BACKEND_LXML, CHUNK_SIZE, etree
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks", "fixtures")
+BACKENDS = [BACKEND_HTML_PARSER] + ([BACKEND_LXML] if etree is not None else [])
+PAGE = """<html><body><div id="header" class="top bar"><p>Tickets on sale</p></div>
+<div class="changeMe shipping extra"></div><div class="shipping changeMe"></div></body></html>"""
+
+
+def get_page_with_boundary_at(offset : int, content : str) -> str:
+    """Get a page where the first chunk ends offset characters after the beginning of content."""
+    prefix = "<html><body><p>"
+    padding = "x" * (CHUNK_SIZE - offset - len(prefix) - len("</p>"))
+    return f"{prefix}{padding}</p>{content}</body></html>"
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_id_and_class_markers(backend):
+    assert MarkerMatcher([Marker(MARKER_ID, "header")], backend=backend).matches(PAGE)
+    assert not MarkerMatcher([Marker(MARKER_ID, "head")], backend=backend).matches(PAGE)
+    # A class marker matches the tags with exactly its set of classes, in any order
+    class_marker = Marker(MARKER_CLASS, ["changeMe", "shipping"])
+    assert MarkerMatcher([class_marker], backend=backend).find_first(PAGE) is class_marker
+    assert not MarkerMatcher([Marker(MARKER_CLASS, ["top"])], backend=backend).matches(PAGE)
+
+
+def test_text_markers():
+    matcher = MarkerMatcher([Marker(MARKER_TEXT, "on sale")])
+    assert matcher.backend == BACKEND_HTML_PARSER
+    assert matcher.matches(PAGE)
+    assert not matcher.matches(PAGE.replace("on sale", "sold out"))
+    # A text spanning several tags is found
+    assert MarkerMatcher([Marker(MARKER_TEXT, "Tickets on sale")]).matches("<p>Tickets on </p><p>sale</p>")
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_markers_split_across_chunks(backend):
+    page_source = get_page_with_boundary_at(10, '<div id="buy-now" class="btn primary">Buy now</div>')
+    assert page_source[CHUNK_SIZE - 10:CHUNK_SIZE] == '<div id="b'
+    assert MarkerMatcher([Marker(MARKER_ID, "buy-now")], backend=backend).matches(page_source)
+    assert MarkerMatcher([Marker(MARKER_CLASS, ["primary", "btn"])], backend=backend).matches(page_source)
+    page_source = get_page_with_boundary_at(7, "<span>Buy tickets now</span>")
+    assert MarkerMatcher([Marker(MARKER_TEXT, "Buy tickets")]).matches(page_source)
+
+
+@pytest.mark.skipif(etree is None, reason="lxml is not installed")
+@pytest.mark.parametrize("rule", DETECTOR_RULES, ids=[rule["name"] for rule in DETECTOR_RULES])
+def test_backends_agree_on_the_fixture_pages(rule):
+    markers = [Marker(marker["kind"], marker["value"]) for marker in rule["markers"]]
+    for state, is_available in [("available", True), ("soldout", False)]:
+        with open(os.path.join(FIXTURES_DIR, f"{rule['name'].lower()}_{state}.html"), encoding="utf-8") as file:
+            page_source = file.read()
+        html_parser_marker = MarkerMatcher(markers, backend=BACKEND_HTML_PARSER).find_first(page_source)
+        lxml_marker = MarkerMatcher(markers, backend=BACKEND_LXML).find_first(page_source)
+        assert html_parser_marker is lxml_marker
+        assert (html_parser_marker is not None) == is_available
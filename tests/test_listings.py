@@ -0,0 +1,60 @@
+from src.html_matching import Marker, MARKER_CLASS, MARKER_ID, MARKER_TEXT, parse_listing
+from src.listings import ListingIndex
+from src.web_scraping import RuleBasedSoldoutDetector, ListingRule, FETCH_MODE_AUTO
+
+
+LISTING_URL = "https://www.example.com/venue/1"
+ITEM_MARKER = Marker(MARKER_CLASS, ["event"])
+SOLDOUT_MARKER = Marker(MARKER_CLASS, ["soldout"])
+
+
+def get_detector(soldout_marker = SOLDOUT_MARKER):
+    return RuleBasedSoldoutDetector(
+        "example", [Marker(MARKER_ID, "buy")], fetch_mode=FETCH_MODE_AUTO,
+        listing_rule=ListingRule(r"/venue/\d+", ITEM_MARKER, soldout_marker),
+    )
+
+
+def test_nested_tags_stay_in_their_item():
+    page_source = """<div class="list">
+        <div class="event card"><div class="title"><div><a href="/event/1">One</a></div></div><div class="badge soldout">Sold out</div></div>
+        <div class="event card"><div class="title"><a href="/event/2">Two</a></div></div>
+    </div>"""
+    assert parse_listing(page_source, ITEM_MARKER, SOLDOUT_MARKER) == [(["/event/1"], True), (["/event/2"], False)]
+
+
+def test_soldout_class_on_the_item_itself():
+    page_source = """<li class="event soldout"><a href="/event/1">One</a></li><li class="event"><a href="/event/2">Two</a></li>"""
+    assert parse_listing(page_source, ITEM_MARKER, SOLDOUT_MARKER) == [(["/event/1"], True), (["/event/2"], False)]
+
+
+def test_text_soldout_marker():
+    page_source = """<li class="event"><a href="/event/1">One</a> <span>Sold out</span></li><li class="event"><a href="/event/2">Two</a></li>"""
+    assert parse_listing(page_source, ITEM_MARKER, Marker(MARKER_TEXT, "Sold out")) == [(["/event/1"], True), (["/event/2"], False)]
+
+
+def test_listing_verdicts_by_canonical_url():
+    page_source = """
+        <li class="event"><a href="/event/1?utm_source=x">One</a><a href="https://www.example.com/event/1">Tickets</a></li>
+        <li class="event soldout"><a href="/event/2">Two</a></li>
+        <li class="event"><a href="/event/3">Three</a></li>
+        <li class="event"><a href="/event/3">Three again</a></li>
+        <li class="event"><a href="/event/4">Four, first date</a></li>
+        <li class="event soldout"><a href="/event/4">Four, second date</a></li>"""
+    assert get_detector().get_listing_verdicts(LISTING_URL, page_source) == {
+        "https://www.example.com/event/1" : False,
+        "https://www.example.com/event/2" : True,
+        "https://www.example.com/event/3" : False,
+        # Linked from items with different verdicts : ambiguous, checked on its own page
+        "https://www.example.com/event/4" : None,
+    }
+
+
+def test_listing_index_groups_listings_with_several_events():
+    listing_index = ListingIndex()
+    listing_index.load({"https://a/1" : LISTING_URL, "https://a/2" : LISTING_URL, "https://a/3" : "https://www.example.com/venue/2"})
+    listing_groups, single_ticket_urls = listing_index.group(["https://a/1", "https://a/3", "https://a/4"])
+    assert listing_groups == {LISTING_URL : ["https://a/1"]}
+    assert single_ticket_urls == ["https://a/3", "https://a/4"]
+    listing_index.remove("https://a/2")
+    assert listing_index.group(["https://a/1"]) == ({}, ["https://a/1"])
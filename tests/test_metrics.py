@@ -0,0 +1,77 @@
+import socket
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+
+from src.metrics import format_metrics, Metric, MetricsExporter, METRIC_COUNTER, METRIC_GAUGE, METRIC_SUMMARY, METRICS_CONTENT_TYPE
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_metrics_are_formatted_in_the_prometheus_text_format():
+    metrics = [
+        Metric("tickets_watched", METRIC_GAUGE, "Number of tickets in the watch list").add(12),
+        Metric("checks_total", METRIC_COUNTER, "Number of checks")
+            .add(3, {"site" : "etix", "outcome" : "soldout"})
+            .add(40, {"site" : "etix", "outcome" : "available"}),
+        Metric("stage_duration_seconds", METRIC_SUMMARY, "Duration of the stages")
+            .add(0.5, {"stage" : "driver.get", "quantile" : "0.5"})
+            .add(4.25, {"stage" : "driver.get"}, suffix="_sum")
+            .add(8, {"stage" : "driver.get"}, suffix="_count"),
+    ]
+    assert format_metrics(metrics) == (
+        "# HELP tickets_watched Number of tickets in the watch list\n"
+        "# TYPE tickets_watched gauge\n"
+        "tickets_watched 12.0\n"
+        "# HELP checks_total Number of checks\n"
+        "# TYPE checks_total counter\n"
+        'checks_total{site="etix",outcome="soldout"} 3.0\n'
+        'checks_total{site="etix",outcome="available"} 40.0\n'
+        "# HELP stage_duration_seconds Duration of the stages\n"
+        "# TYPE stage_duration_seconds summary\n"
+        'stage_duration_seconds{stage="driver.get",quantile="0.5"} 0.5\n'
+        'stage_duration_seconds_sum{stage="driver.get"} 4.25\n'
+        'stage_duration_seconds_count{stage="driver.get"} 8.0\n'
+    )
+
+
+def test_label_values_and_special_values_are_escaped():
+    metric = Metric("lag_seconds", METRIC_GAUGE, "Lag").add(float("nan"), {"site" : 'a "b"\\c\nd'}).add(float("inf")).add(float("-inf"))
+    assert format_metrics([metric]).splitlines()[2:] == [
+        'lag_seconds{site="a \\"b\\"\\\\c\\nd"} NaN',
+        "lag_seconds +Inf",
+        "lag_seconds -Inf",
+    ]
+
+
+def test_metric_without_samples_only_has_its_help_and_type():
+    assert format_metrics([Metric("alerts_pending", METRIC_GAUGE, "Alerts in the outbox")]) == (
+        "# HELP alerts_pending Alerts in the outbox\n# TYPE alerts_pending gauge\n"
+    )
+
+
+def test_exporter_serves_the_metrics_collected_at_each_scrape():
+    n_collects = []
+    def collect_metrics():
+        n_collects.append(1)
+        return [Metric("scrapes", METRIC_COUNTER, "Number of scrapes").add(len(n_collects))]
+    exporter = MetricsExporter(collect_metrics)
+    port = get_free_port()
+    exporter.set_port(port)
+    try:
+        assert n_collects == []
+        for n_scrapes in (1, 2):
+            with urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+                assert response.headers["Content-Type"] == METRICS_CONTENT_TYPE
+                assert response.read().decode("utf-8").endswith(f"scrapes {float(n_scrapes)}\n")
+        with pytest.raises(HTTPError) as error:
+            urlopen(f"http://127.0.0.1:{port}/other")
+        assert error.value.code == 404
+    finally:
+        exporter.set_port(0)
+    assert exporter.server is None
@@ -0,0 +1,58 @@
+import pytest
+
+from src.check_engine import CheckResult
+from src.html_matching import Marker, MARKER_ID
+from src.interface_database import DBInterface
+from src.online_learning import OnlineMarkerLearner
+
+
+SITE = "example"
+DETECTOR_MARKERS = [Marker(MARKER_ID, "buy")]
+AVAILABLE_PAGE = {"id:buy", "id:header"}
+SOLDOUT_PAGE = {"id:header", "class:badge soldout"}
+
+
+@pytest.fixture
+def learner(tmp_path):
+    db_interface = DBInterface(str(tmp_path / "database.db"))
+    yield OnlineMarkerLearner(db_interface, min_pages=2, min_accuracy=0.9, min_agreement=0.8)
+    db_interface.close()
+
+
+def observe(learner, url, is_soldout, marker_keys):
+    check_result = CheckResult(url, is_soldout=is_soldout, site=SITE, marker_candidates=set(marker_keys))
+    return learner.observe(check_result, DETECTOR_MARKERS)
+
+
+def label_pages(learner):
+    for url, is_available, marker_keys in [
+        ("https://example.com/a1", True, AVAILABLE_PAGE), ("https://example.com/a2", True, AVAILABLE_PAGE), 
+        ("https://example.com/s1", False, SOLDOUT_PAGE), ("https://example.com/s2", False, SOLDOUT_PAGE),
+    ]:
+        observe(learner, url, not is_available, marker_keys)
+        assert learner.label(url, is_available)
+
+
+def test_verdicts_of_the_detector_alone_are_not_learned(learner):
+    for i in range(5):
+        assert observe(learner, f"https://example.com/{i}", i % 2 == 0, SOLDOUT_PAGE if i % 2 == 0 else AVAILABLE_PAGE) is None
+    assert learner.db_interface.get_labelled_page_counts(SITE) == (0, 0)
+    assert learner.label("https://example.com/0", is_available=False)
+    assert learner.db_interface.get_labelled_page_counts(SITE) == (0, 1)
+
+
+def test_verdicts_confirmed_by_the_reference_marker_are_learned(learner):
+    label_pages(learner)
+    assert observe(learner, "https://example.com/a3", False, AVAILABLE_PAGE) is None
+    assert learner.db_interface.get_labelled_page_counts(SITE) == (3, 2)
+    assert not learner.are_markers_suspect(SITE)
+
+
+def test_drifting_markers_are_suspect_and_not_learned(learner):
+    label_pages(learner)
+    # The site renamed its buy button : the detector now sees sold out pages, which the reference marker contradicts
+    assert observe(learner, "https://example.com/d1", True, {"id:header", "id:purchase"}) is None
+    message = observe(learner, "https://example.com/d2", True, {"id:header", "id:purchase"})
+    assert message is not None and "may be broken" in message
+    assert learner.are_markers_suspect(SITE)
+    assert learner.db_interface.get_labelled_page_counts(SITE) == (2, 2)
@@ -0,0 +1,47 @@
+from src.page_cache import PageCache, get_content_hash
+
+
+URL = "https://www.example.com/event/1"
+
+
+def test_volatile_tokens_are_stripped_from_the_hash():
+    page_source = """<html><head><meta name="csrf" content="{token}"><script nonce="{token}">var now = {epoch};</script>
+    <style>.a {{ color : red }}</style></head><body><input type="hidden" value="{token}">
+    <span>Updated {timestamp}</span><div id="buy">Buy</div></body></html>"""
+    first = page_source.format(token="a1b2c3", epoch="1700000000123", timestamp="2024-05-01T10:00:00Z")
+    second = page_source.format(token="z9y8x7", epoch="1700000999", timestamp="2024-05-01 10:05:31.123+02:00")
+    assert get_content_hash(first) == get_content_hash(second)
+    assert get_content_hash(first) != get_content_hash(first.replace('id="buy"', 'id="soldout"'))
+
+
+def test_hits_and_misses_are_counted():
+    page_cache = PageCache()
+    assert page_cache.lookup(URL, "hash1") is None
+    page_cache.store(URL, "hash1", is_soldout=False)
+    assert page_cache.lookup(URL, "hash1") is False
+    assert page_cache.lookup(URL, "hash2") is None
+    assert page_cache.get_not_modified_verdict(URL) is False
+    stats = page_cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["not_modified"]) == (1, 2, 1)
+    assert stats["hit_ratio"] == 0.5
+
+
+def test_conditional_headers_come_from_the_validators():
+    page_cache = PageCache()
+    assert page_cache.get_conditional_headers(URL) == {}
+    page_cache.store(URL, "hash1", is_soldout=False)
+    page_cache.store_validators(URL, '"v1"', "Wed, 01 May 2024 10:00:00 GMT")
+    assert page_cache.get_conditional_headers(URL) == {"If-None-Match" : '"v1"', "If-Modified-Since" : "Wed, 01 May 2024 10:00:00 GMT"}
+    page_cache.store_validators(URL, None, "Wed, 01 May 2024 10:00:00 GMT")
+    assert page_cache.get_conditional_headers(URL) == {"If-Modified-Since" : "Wed, 01 May 2024 10:00:00 GMT"}
+    # A new verdict forgets the validators of the previous content
+    page_cache.store(URL, "hash2", is_soldout=True)
+    assert page_cache.get_conditional_headers(URL) == {}
+
+
+def test_least_recently_used_urls_are_evicted():
+    page_cache = PageCache(max_entries=2)
+    for i in range(3):
+        page_cache.store(f"{URL}/{i}", "hash", is_soldout=False)
+    assert page_cache.get_content_hash(f"{URL}/0") is None
+    assert page_cache.get_content_hash(f"{URL}/2") == "hash"
@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta, timezone
+import math
+
+import pytest
+
+from src.scheduler import AdaptivePollingPolicy, Scheduler, TicketSignals
+
+
+URLS = [f"https://www.example.com/event/{i}" for i in range(3)]
+
+
+def get_signals(site = None, days_until_event = None, hours_since_change = None):
+    signals = TicketSignals()
+    now = datetime.now(timezone.utc)
+    signals.site = site
+    if days_until_event is not None:
+        signals.event_date = now + timedelta(days=days_until_event)
+    if hours_since_change is not None:
+        signals.last_change_date = now - timedelta(hours=hours_since_change)
+    return signals
+
+
+def test_disabled_policy_checks_every_ticket_every_base_interval():
+    policy = AdaptivePollingPolicy(enabled=False, fetch_budget_per_minute=600)
+    assert policy.get_weight(get_signals(site="example", days_until_event=0.5, hours_since_change=0)) == 1
+    assert policy.get_interval(weight=8, total_weight=10, base_interval=60) == 60
+
+
+def test_intervals_are_clipped():
+    policy = AdaptivePollingPolicy(enabled=True, min_interval=10, max_interval=600)
+    assert policy.get_interval(weight=100, total_weight=100, base_interval=60) == 10
+    assert policy.get_interval(weight=0.01, total_weight=0.01, base_interval=60) == 600
+    assert policy.get_interval(weight=2, total_weight=2, base_interval=60) == 30
+
+
+def test_fetch_budget_is_shared_proportionally_to_the_weights():
+    policy = AdaptivePollingPolicy(enabled=True, fetch_budget_per_minute=60, min_interval=0, max_interval=3600)
+    # 60 checks per minute for a total weight of 4 : a ticket of weight 1 gets one check every 4 seconds, a ticket of weight 3 every 4/3 seconds
+    assert policy.get_interval(weight=1, total_weight=4, base_interval=60) == pytest.approx(4)
+    assert policy.get_interval(weight=3, total_weight=4, base_interval=60) == pytest.approx(4 / 3)
+    # The budget spent on all the tickets is the fetch budget
+    assert 1 / policy.get_interval(weight=1, total_weight=4, base_interval=60) + 1 / policy.get_interval(weight=3, total_weight=4, base_interval=60) == pytest.approx(1)
+
+
+def test_close_events_get_more_weight():
+    policy = AdaptivePollingPolicy(enabled=True)
+    assert policy.get_weight(get_signals()) == 1
+    assert policy.get_weight(get_signals(days_until_event=7)) == pytest.approx(1)
+    assert policy.get_weight(get_signals(days_until_event=1)) == pytest.approx(7)
+    # The boost is capped at x8 and the penalty at x0.25
+    assert policy.get_weight(get_signals(days_until_event=0.01)) == pytest.approx(8)
+    assert policy.get_weight(get_signals(days_until_event=100)) == pytest.approx(0.25)
+    assert policy.get_weight(get_signals(days_until_event=-1)) == pytest.approx(0.25)
+
+
+def test_recently_changed_pages_get_more_weight():
+    policy = AdaptivePollingPolicy(enabled=True, site_weights={"example" : 2})
+    assert policy.get_weight(get_signals(site="example", hours_since_change=0)) == pytest.approx(8, rel=1e-3)
+    assert policy.get_weight(get_signals(site="example", hours_since_change=1)) == pytest.approx(2 * (1 + 3 / math.e), rel=1e-3)
+    assert policy.get_weight(get_signals(site="example", hours_since_change=24)) == pytest.approx(2, rel=1e-3)
+    assert policy.get_weight(get_signals(site="other", hours_since_change=24)) == pytest.approx(1, rel=1e-3)
+
+
+def test_page_change_shortens_the_interval_of_the_ticket():
+    policy = AdaptivePollingPolicy(enabled=True, fetch_budget_per_minute=60, min_interval=0, max_interval=3600)
+    scheduler = Scheduler(interval=60, policy=policy)
+    for url in URLS:
+        scheduler.add(url)
+        scheduler.update_signals(url, content_hash="v1")
+    assert scheduler.get_interval(URLS[0]) == pytest.approx(3)
+    # The first hash of a page is not a change, a different hash is
+    scheduler.update_signals(URLS[0], content_hash="v2")
+    assert scheduler.signals[URLS[0]].last_change_date is not None
+    assert scheduler.signals[URLS[1]].last_change_date is None
+    # The changed page has weight 4 out of a total weight of 6
+    assert scheduler.get_interval(URLS[0]) == pytest.approx(6 / 4, rel=1e-3)
+    assert scheduler.get_interval(URLS[1]) == pytest.approx(6, rel=1e-3)
+    assert scheduler.total_weight == pytest.approx(sum(scheduler.weights.values()))
@@ -0,0 +1,88 @@
+from contextlib import nullcontext
+from time import time
+
+import pytest
+
+from src.html_matching import Marker, MARKER_ID
+from src.page_cache import PageCache, get_content_hash
+from src.web_scraping import (
+    RuleBasedSoldoutDetector, FETCH_MODE_AUTO, FETCH_MODE_SELENIUM, FETCH_PATH_HTTP, FETCH_PATH_SELENIUM, TIER_UNCHANGED, TIER_STATIC, TIER_BROWSER,
+)
+
+
+URL = "https://www.example.com/event/1"
+AVAILABLE_PAGE = '<html><body><div id="buy">Buy tickets</div></body></html>'
+SHELL_PAGE = '<html><body><div id="app"></div></body></html>'
+
+
+class FakeResponse:
+    def __init__(self, status_code, text = "", headers = None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers if headers is not None else {}
+
+
+class FakeFetcher:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def fetch(self, url, headers = None):
+        self.requests.append(headers or {})
+        return self.responses.pop(0)
+
+
+class FakeDriverPool:
+    def __init__(self):
+        self.n_leases = 0
+
+    def lease(self):
+        self.n_leases += 1
+        return nullcontext(None)
+
+
+def get_detector(fetch_mode, browser_verdict = True):
+    detector = RuleBasedSoldoutDetector("example", [Marker(MARKER_ID, "buy")], fetch_mode=fetch_mode)
+    detector.check_in_browser = lambda url, driver: (browser_verdict, SHELL_PAGE)
+    return detector
+
+
+def test_not_modified_page_reuses_the_cached_verdict():
+    page_cache, driver_pool = PageCache(), FakeDriverPool()
+    detector = get_detector(FETCH_MODE_AUTO)
+    fetcher = FakeFetcher(FakeResponse(200, AVAILABLE_PAGE, {"ETag" : '"v1"'}), FakeResponse(304))
+    assert detector.check(URL, driver_pool, fetcher, page_cache).tier == TIER_STATIC
+    answer = detector.check(URL, driver_pool, fetcher, page_cache)
+    assert (answer.is_soldout, answer.fetch_path, answer.tier) == (False, FETCH_PATH_HTTP, TIER_UNCHANGED)
+    assert fetcher.requests[1] == {"If-None-Match" : '"v1"'}
+    assert driver_pool.n_leases == 0
+
+
+def test_marker_in_static_html_settles_the_check():
+    page_cache, driver_pool = PageCache(), FakeDriverPool()
+    detector = get_detector(FETCH_MODE_SELENIUM)
+    answer = detector.check(URL, driver_pool, FakeFetcher(FakeResponse(200, AVAILABLE_PAGE)), page_cache, max_render_age=60)
+    assert (answer.is_soldout, answer.fetch_path, answer.tier) == (False, FETCH_PATH_HTTP, TIER_STATIC)
+    assert driver_pool.n_leases == 0
+
+
+def test_marker_absent_from_static_html_falls_back_to_the_browser():
+    page_cache, driver_pool = PageCache(), FakeDriverPool()
+    detector = get_detector(FETCH_MODE_SELENIUM, browser_verdict=True)
+    answer = detector.check(URL, driver_pool, FakeFetcher(FakeResponse(200, SHELL_PAGE)), page_cache, max_render_age=60)
+    assert (answer.is_soldout, answer.fetch_path, answer.tier) == (True, FETCH_PATH_SELENIUM, TIER_BROWSER)
+    assert driver_pool.n_leases == 1
+    # The verdict of the browser is reused while the shell doesn't change and the verdict is recent
+    answer = detector.check(URL, driver_pool, FakeFetcher(FakeResponse(200, SHELL_PAGE)), page_cache, max_render_age=60)
+    assert (answer.is_soldout, answer.tier) == (True, TIER_UNCHANGED)
+    assert driver_pool.n_leases == 1
+
+
+@pytest.mark.parametrize("status_code", [200, 304])
+def test_verdict_older_than_max_render_age_is_not_reused(status_code):
+    page_cache, driver_pool = PageCache(), FakeDriverPool()
+    page_cache.store(URL, get_content_hash(SHELL_PAGE), is_soldout=False, rendered_at=time() - 61)
+    detector = get_detector(FETCH_MODE_SELENIUM, browser_verdict=True)
+    answer = detector.check(URL, driver_pool, FakeFetcher(FakeResponse(status_code, SHELL_PAGE)), page_cache, max_render_age=60)
+    assert (answer.is_soldout, answer.fetch_path, answer.tier) == (True, FETCH_PATH_SELENIUM, TIER_BROWSER)
+    assert driver_pool.n_leases == 1
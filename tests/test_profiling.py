@@ -0,0 +1,76 @@
+import pstats
+
+import pytest
+
+from src.profiling import Profiler, StageHistogram, HISTOGRAM_BUCKETS
+
+
+def test_durations_fall_in_the_bucket_of_their_upper_bound():
+    histogram = StageHistogram()
+    # Bucket upper bounds are inclusive
+    for duration in [0, 0.0001, 0.00011, 0.0002, 0.5]:
+        histogram.add(duration)
+    assert histogram.bucket_counts[0] == 2
+    assert histogram.bucket_counts[1] == 2
+    assert HISTOGRAM_BUCKETS[12] < 0.5 <= HISTOGRAM_BUCKETS[13]
+    assert histogram.bucket_counts[13] == 1
+    assert (histogram.count, histogram.max) == (5, 0.5)
+    assert histogram.get_mean() == pytest.approx(0.50041 / 5)
+
+
+def test_durations_above_the_last_bucket_are_counted_in_the_overflow_bucket():
+    histogram = StageHistogram()
+    histogram.add(HISTOGRAM_BUCKETS[-1] * 2)
+    assert histogram.bucket_counts[-1] == 1
+    assert len(histogram.bucket_counts) == len(HISTOGRAM_BUCKETS) + 1
+    assert histogram.get_percentile(50) == HISTOGRAM_BUCKETS[-1] * 2
+
+
+def test_percentiles_are_upper_bounds_of_the_durations():
+    histogram = StageHistogram()
+    assert histogram.get_percentile(50) == 0.0
+    for _ in range(90):
+        histogram.add(0.001)
+    for _ in range(10):
+        histogram.add(1.0)
+    # 0.001 falls in the bucket up to 0.0016, and 1.0 in the bucket up to 1.6384, but percentiles never exceed the maximum duration
+    assert histogram.get_percentile(50) == pytest.approx(0.0016)
+    assert histogram.get_percentile(90) == pytest.approx(0.0016)
+    assert histogram.get_percentile(95) == 1.0
+    assert histogram.get_percentile(100) == 1.0
+
+
+def test_hottest_stages_are_the_ones_taking_the_most_time():
+    profiler = Profiler()
+    for _ in range(100):
+        profiler.record("parsing", 0.001)
+    profiler.record("driver.get", 2.0)
+    profiler.record("database", 0.01)
+    assert [stage for stage, _ in profiler.get_hottest_stages()] == ["driver.get", "parsing", "database"]
+    assert [stage for stage, _ in profiler.get_hottest_stages(1)] == ["driver.get"]
+    with profiler.measure("telegram"):
+        pass
+    assert profiler.get_hottest_stages()[-1][1].count == 1
+    profiler.reset()
+    assert profiler.get_hottest_stages() == []
+
+
+def test_disabled_profiler_records_nothing():
+    profiler = Profiler(enabled=False)
+    with profiler.measure("driver.get"):
+        pass
+    profiler.record("parsing", 1.0)
+    assert profiler.get_hottest_stages() == []
+
+
+def test_sampled_checks_are_dumped_once_all_done(tmp_path):
+    profiler = Profiler()
+    path = str(tmp_path / "checks.prof")
+    assert profiler.request_sampling(2, path) == path
+    for _ in range(2):
+        assert profiler.is_sampling()
+        with profiler.sample_check():
+            sum(range(1000))
+    assert not profiler.is_sampling()
+    assert profiler.last_sample_path == path
+    assert pstats.Stats(path).total_calls > 0
@@ -0,0 +1,81 @@
+import pytest
+
+from src import rate_limiting
+from src.rate_limiting import DomainRateLimiter, CIRCUIT_CLOSED, CIRCUIT_HALF_OPEN, CIRCUIT_OPEN
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiting, "monotonic", clock)
+    # No jitter : the backoffs are exactly backoff_base * 2^(n-1)
+    monkeypatch.setattr(rate_limiting.random, "uniform", lambda a, b: 1.0)
+    return clock
+
+
+@pytest.fixture
+def rate_limiter(clock):
+    return DomainRateLimiter(rate_per_minute=60, burst=2, backoff_base=5, backoff_max=20, failure_threshold=3, open_duration=100)
+
+
+def test_token_bucket_allows_bursts_then_waits(rate_limiter, clock):
+    assert rate_limiter.reserve("site") == 0
+    assert rate_limiter.reserve("site") == 0
+    assert rate_limiter.reserve("site") == pytest.approx(1.0)
+    clock.now += 0.5
+    assert rate_limiter.reserve("site") == pytest.approx(0.5)
+    clock.now += 0.5
+    assert rate_limiter.reserve("site") == 0
+    # Each domain has its own bucket
+    assert rate_limiter.reserve("other_site") == 0
+
+
+def test_backoff_is_exponential_and_capped(rate_limiter, clock):
+    rate_limiter.set_limits(rate_per_minute=6000, burst=100, backoff_base=5, backoff_max=20, failure_threshold=10, open_duration=100)
+    for expected_backoff in (5, 10, 20, 20):
+        assert not rate_limiter.record_failure("site")
+        assert rate_limiter.reserve("site") == pytest.approx(expected_backoff)
+    rate_limiter.record_success("site")
+    assert rate_limiter.reserve("site") == 0
+
+
+def test_circuit_opens_once_then_half_opens_and_closes(rate_limiter, clock):
+    domain_state = lambda: rate_limiter.domain_states["site"]
+    assert [rate_limiter.record_failure("site", error="timeout") for _ in range(3)] == [False, False, True]
+    assert domain_state().circuit_state == CIRCUIT_OPEN
+    assert rate_limiter.get_paused_domains() == ["site"]
+    # The opening is reported once : more failures while paused return False
+    assert not rate_limiter.record_failure("site")
+    assert rate_limiter.reserve("site") == pytest.approx(100)
+    clock.now += 100
+    # A single trial request is allowed once the pause is over
+    assert rate_limiter.reserve("site") == 0
+    assert domain_state().circuit_state == CIRCUIT_HALF_OPEN
+    assert rate_limiter.reserve("site") > 0
+    assert rate_limiter.record_success("site")
+    assert domain_state().circuit_state == CIRCUIT_CLOSED
+    assert not rate_limiter.record_success("site")
+    assert rate_limiter.get_paused_domains() == []
+
+
+def test_failed_trial_reopens_without_reporting_again(rate_limiter, clock):
+    for _ in range(3):
+        rate_limiter.record_failure("site")
+    clock.now += 100
+    assert rate_limiter.reserve("site") == 0
+    assert not rate_limiter.record_failure("site")
+    assert rate_limiter.domain_states["site"].circuit_state == CIRCUIT_OPEN
+    assert rate_limiter.reserve("site") == pytest.approx(100)
+
+
+def test_rate_must_be_positive(rate_limiter):
+    with pytest.raises(ValueError):
+        rate_limiter.set_limits(rate_per_minute=0, burst=2, backoff_base=5, backoff_max=20, failure_threshold=3, open_duration=100)
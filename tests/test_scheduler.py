@@ -0,0 +1,83 @@
+from src.scheduler import Scheduler
+
+
+URLS = [f"https://www.example.com/event/{i}" for i in range(3)]
+
+
+def test_added_tickets_are_due_immediately_and_once():
+    scheduler = Scheduler(interval=60)
+    for url in URLS:
+        scheduler.add(url)
+    scheduler.add(URLS[0])
+    assert sorted(scheduler.pop_due()) == URLS
+    assert scheduler.pop_due() == []
+    # Adding an in flight ticket doesn't schedule it a second time
+    scheduler.add(URLS[0])
+    assert scheduler.pop_due() == []
+    assert scheduler.get_n_scheduled() == 3
+
+
+def test_reschedule_waits_one_interval():
+    scheduler = Scheduler(interval=60)
+    scheduler.add(URLS[0])
+    assert scheduler.pop_due() == [URLS[0]]
+    scheduler.reschedule(URLS[0])
+    assert scheduler.pop_due() == []
+    assert URLS[0] in scheduler.due_times and URLS[0] not in scheduler.in_flight
+    # Only in flight tickets can be rescheduled
+    due_time = scheduler.due_times[URLS[0]]
+    scheduler.reschedule(URLS[0])
+    assert scheduler.due_times[URLS[0]] == due_time
+
+
+def test_postpone_puts_the_ticket_back():
+    scheduler = Scheduler(interval=60)
+    scheduler.add(URLS[0])
+    scheduler.add(URLS[1])
+    scheduler.pop_due()
+    scheduler.postpone(URLS[0], 0)
+    scheduler.postpone(URLS[1], 30)
+    assert scheduler.pop_due() == [URLS[0]]
+    assert scheduler.get_n_scheduled() == 2
+
+
+def test_ticket_removed_while_in_flight_is_not_rescheduled():
+    scheduler = Scheduler(interval=0)
+    scheduler.add(URLS[0])
+    scheduler.pop_due()
+    scheduler.remove(URLS[0])
+    scheduler.reschedule(URLS[0])
+    scheduler.postpone(URLS[0], 0)
+    assert scheduler.pop_due() == []
+    assert scheduler.get_n_scheduled() == 0
+
+
+def test_pop_early_only_takes_scheduled_tickets():
+    scheduler = Scheduler(interval=60)
+    scheduler.add(URLS[0])
+    scheduler.add(URLS[1])
+    assert sorted(scheduler.pop_due()) == URLS[:2]
+    scheduler.reschedule(URLS[0])
+    assert scheduler.pop_early([URLS[0], URLS[1], URLS[2]]) == [URLS[0]]
+    assert URLS[0] in scheduler.in_flight
+    # Its stale entry of the heap doesn't make it due again
+    scheduler.reschedule(URLS[0])
+    assert scheduler.get_lag() == 0
+    assert scheduler.pop_due() == []
+
+
+def test_sync_adds_and_removes_tickets():
+    scheduler = Scheduler(interval=60)
+    scheduler.sync(URLS[:2])
+    scheduler.pop_due()
+    scheduler.sync(URLS[1:])
+    assert scheduler.in_flight == {URLS[1]}
+    assert scheduler.pop_due() == [URLS[2]]
+    assert scheduler.get_n_scheduled() == 2
+
+
+def test_wait_returns_when_woken():
+    scheduler = Scheduler(interval=60)
+    scheduler.wake()
+    scheduler.wait(timeout=10)
+    scheduler.wait(timeout=0.01)
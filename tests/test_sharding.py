@@ -0,0 +1,70 @@
+import pytest
+
+from src.interface_database import DBInterface
+from src.sharding import ShardCoordinator
+
+
+TICKET_URLS = [f"https://www.etix.com/ticket/p/{i}/show" for i in range(50)]
+
+
+@pytest.fixture
+def db_interface(tmp_path):
+    db_interface = DBInterface(str(tmp_path / "database.db"))
+    yield db_interface
+    db_interface.close()
+
+
+def test_tickets_are_partitioned_between_nodes(db_interface):
+    nodes = [ShardCoordinator(db_interface, node_name, enabled=True) for node_name in ("a", "b")]
+    for node in nodes + nodes:
+        node.heartbeat()
+    owned = [set(node.get_owned_ticket_urls(TICKET_URLS)) for node in nodes]
+    assert owned[0] | owned[1] == set(TICKET_URLS)
+    assert owned[0] & owned[1] == set()
+    assert [node.is_leader() for node in nodes] == [True, False]
+
+
+def test_node_sharing_a_live_name_owns_nothing(db_interface):
+    first = ShardCoordinator(db_interface, "same", enabled=True)
+    second = ShardCoordinator(db_interface, "same", enabled=True)
+    first.heartbeat()
+    second.heartbeat()
+    assert first.name_conflict is None
+    assert second.name_conflict == first.instance
+    assert second.get_owned_ticket_urls(TICKET_URLS) == []
+    assert not second.is_leader()
+    # The first node keeps the name and all the tickets
+    first.heartbeat()
+    assert first.name_conflict is None
+    assert first.get_owned_ticket_urls(TICKET_URLS) == TICKET_URLS
+    assert first.is_leader()
+
+
+def test_name_is_released_when_its_node_leaves(db_interface):
+    first = ShardCoordinator(db_interface, "same", enabled=True)
+    second = ShardCoordinator(db_interface, "same", enabled=True)
+    first.heartbeat()
+    second.heartbeat()
+    # A node that doesn't hold the name doesn't remove the heartbeat of the one holding it
+    second.leave()
+    assert db_interface.get_live_nodes(0) == ["same"]
+    first.leave()
+    second.heartbeat()
+    assert second.name_conflict is None
+    assert second.get_owned_ticket_urls(TICKET_URLS) == TICKET_URLS
+
+
+def test_expired_name_is_taken_over(db_interface):
+    first = ShardCoordinator(db_interface, "same", lease_duration=0, enabled=True)
+    second = ShardCoordinator(db_interface, "same", lease_duration=0, enabled=True)
+    first.heartbeat()
+    db_interface.heartbeat_node("same", first.instance, 0, since=0)  # the first node stopped long ago without leaving
+    second.heartbeat()
+    assert second.name_conflict is None
+
+
+def test_disabled_coordinator_owns_everything(db_interface):
+    node = ShardCoordinator(db_interface, "a", enabled=False)
+    node.heartbeat()
+    assert node.get_owned_ticket_urls(TICKET_URLS) == TICKET_URLS
+    assert node.is_leader()
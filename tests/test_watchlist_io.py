@@ -0,0 +1,59 @@
+import io
+
+import pytest
+
+from src.interface_database import DBInterface
+from src.watchlist_io import export_tickets, import_tickets, read_ticket_urls
+
+
+@pytest.fixture
+def db_interface(tmp_path):
+    db_interface = DBInterface(str(tmp_path / "database.db"))
+    yield db_interface
+    db_interface.close()
+
+
+def test_read_ticket_urls_skips_blank_and_comment_lines():
+    lines = ["", "  # a comment", "https://www.etix.com/ticket/p/1/show  ", "\n"]
+    assert list(read_ticket_urls(lines)) == ["https://www.etix.com/ticket/p/1/show"]
+
+
+def test_read_ticket_urls_keeps_commas_of_urls():
+    lines = [
+        "https://www.etix.com/ticket/p/1?a=1,2",
+        "https://www.etix.com/ticket/p/1?a=1,2,2024-05-01 20:30:00",
+        "https://www.etix.com/ticket/p/1?a=1,2,",
+    ]
+    assert list(read_ticket_urls(lines)) == ["https://www.etix.com/ticket/p/1?a=1,2"] * 3
+
+
+def test_read_ticket_urls_drops_exported_date():
+    assert list(read_ticket_urls(["https://www.etix.com/ticket/p/1/show,2024-05-01 20:30:00"])) == ["https://www.etix.com/ticket/p/1/show"]
+
+
+def test_import_report(db_interface):
+    lines = [
+        "https://www.etix.com/ticket/p/1/show",
+        "https://www.etix.com/ticket/p/1/show",
+        "https://www.example.com/event/1",
+        "https://www.etix.com/ticket/p/2/show",
+    ]
+    import_report = import_tickets(db_interface, lines)
+    assert (import_report.n_read, import_report.n_added, import_report.n_duplicates) == (4, 2, 1)
+    assert import_report.invalid_urls == ["https://www.example.com/event/1"]
+    assert import_tickets(db_interface, lines[:1]).n_added == 0
+
+
+def test_export_import_round_trip(db_interface, tmp_path):
+    ticket_urls = ["https://www.etix.com/ticket/p/1?a=1,2", "https://www.etix.com/ticket/p/2/show", "https://www.seetickets.us/event/x/3"]
+    import_tickets(db_interface, ticket_urls)
+    exported = io.StringIO()
+    assert export_tickets(db_interface, exported) == 3
+
+    other_db_interface = DBInterface(str(tmp_path / "other.db"))
+    try:
+        import_report = import_tickets(other_db_interface, io.StringIO(exported.getvalue()))
+        assert import_report.n_added == 3
+        assert sorted(other_db_interface.get_ticket_urls()) == sorted(ticket_urls)
+    finally:
+        other_db_interface.close()
@@ -0,0 +1,38 @@
+# Import tickets into the watch list from a file, or export the watch list to a file, without going through Telegram.
+
+import argparse
+import sys
+
+from src.interface_database import DBInterface, DATABASE_PATH
+from src.watchlist_io import canonicalize_watchlist, import_tickets, export_tickets
+
+
+
+if __name__ == "__main__":
+
+    # Parse arguments
+    parser = argparse.ArgumentParser(description="Import or export the watch list.")
+    parser.add_argument("action", choices=["import", "export"])
+    parser.add_argument("path", nargs="?", default="-", help="the file to import from or export to, one url per line (default : standard input or output)")
+    parser.add_argument("--database", default=DATABASE_PATH, help="the path of the database")
+    args = parser.parse_args()
+
+    db_interface = DBInterface(args.database)
+    try:
+        canonicalize_watchlist(db_interface)
+        if args.action == "import":
+            if args.path == "-":
+                import_report = import_tickets(db_interface, sys.stdin)
+            else:
+                with open(args.path, "r", encoding="utf-8") as f:
+                    import_report = import_tickets(db_interface, f)
+            print(import_report.format())
+        else:
+            if args.path == "-":
+                n_tickets = export_tickets(db_interface, sys.stdout)
+            else:
+                with open(args.path, "w", encoding="utf-8") as f:
+                    n_tickets = export_tickets(db_interface, f)
+            print(f"{n_tickets} tickets exported.", file=sys.stderr)
+    finally:
+        db_interface.close()